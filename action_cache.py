@@ -0,0 +1,160 @@
+"""
+动作录制回放缓存
+以 (归一化任务文本, 屏幕感知哈希, 步骤序号) 为键，保存成功步骤的AI响应，
+相同任务再次执行时可直接在本地回放，跳过模型调用
+"""
+
+import argparse
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+
+from screen_diff import hamming_distance
+
+
+def normalize_task(text):
+    """归一化任务文本：去除首尾空白、合并空白字符、统一小写"""
+    return re.sub(r"\s+", " ", text.strip()).lower()
+
+
+class ActionCache:
+    """带LRU淘汰的持久化动作缓存"""
+
+    def __init__(self, path, max_entries=500, max_distance=10, log=print):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.log = log
+        # 按最近使用顺序保存，最久未使用的在最前面
+        self.entries = OrderedDict()
+        self.load()
+
+    @staticmethod
+    def _key(task, step, fingerprint):
+        return f"{task}\x00{step}\x00{fingerprint:x}"
+
+    def load(self):
+        """从磁盘加载缓存，文件不存在或损坏时从空缓存开始"""
+        self.entries.clear()
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for entry in data.get("entries", []):
+                entry["fingerprint"] = int(entry["fingerprint"], 16)
+                key = self._key(entry["task"], entry["step"], entry["fingerprint"])
+                self.entries[key] = entry
+        except Exception as e:
+            self.log(f"加载动作缓存失败: {e}")
+            self.entries.clear()
+
+    def save(self):
+        """写入磁盘（先写临时文件再替换，避免中途崩溃损坏缓存）"""
+        if not self.path:
+            return
+        output_dir = os.path.dirname(self.path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        entries = [
+            dict(entry, fingerprint=f"{entry['fingerprint']:x}")
+            for entry in self.entries.values()
+        ]
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"entries": entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def lookup(self, task, step, fingerprint):
+        """
+        查找与当前屏幕指纹在容差范围内的缓存响应
+        返回缓存的响应文本，未命中返回None
+        """
+        task = normalize_task(task)
+        best_key = None
+        best_distance = self.max_distance + 1
+        for key, entry in self.entries.items():
+            if entry["task"] != task or entry["step"] != step:
+                continue
+            distance = hamming_distance(entry["fingerprint"], fingerprint)
+            if distance < best_distance:
+                best_key, best_distance = key, distance
+        if best_key is None:
+            return None
+        self.entries.move_to_end(best_key)
+        entry = self.entries[best_key]
+        entry["last_used"] = time.time()
+        entry["hits"] = entry.get("hits", 0) + 1
+        return entry["response"]
+
+    def store(self, task, step, fingerprint, response):
+        """记录成功步骤的响应，超出容量时淘汰最久未使用的条目"""
+        task = normalize_task(task)
+        key = self._key(task, step, fingerprint)
+        self.entries[key] = {
+            "task": task,
+            "step": step,
+            "fingerprint": fingerprint,
+            "response": response,
+            "last_used": time.time(),
+            "hits": 0,
+        }
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, task=None, step=None, fingerprint=None):
+        """
+        使缓存失效
+        不传参数时清空全部；只传task时清除该任务的所有步骤；
+        传入step和fingerprint时只清除与之匹配的条目
+        返回被删除的条目数
+        """
+        if task is None:
+            count = len(self.entries)
+            self.entries.clear()
+            return count
+
+        task = normalize_task(task)
+        removed = []
+        for key, entry in self.entries.items():
+            if entry["task"] != task:
+                continue
+            if step is not None and entry["step"] != step:
+                continue
+            if (
+                fingerprint is not None
+                and hamming_distance(entry["fingerprint"], fingerprint)
+                > self.max_distance
+            ):
+                continue
+            removed.append(key)
+        for key in removed:
+            del self.entries[key]
+        return len(removed)
+
+
+def main():
+    """命令行入口：查看或清空动作缓存"""
+    parser = argparse.ArgumentParser(description="动作录制回放缓存管理")
+    parser.add_argument("command", choices=["clear", "stats"], help="要执行的命令")
+    parser.add_argument(
+        "--path", default="cache/action_cache.json", help="缓存文件路径"
+    )
+    parser.add_argument("--task", default=None, help="只清除指定任务的缓存")
+    args = parser.parse_args()
+
+    cache = ActionCache(args.path)
+    if args.command == "clear":
+        count = cache.invalidate(task=args.task)
+        cache.save()
+        print(f"已清除 {count} 条缓存")
+    else:
+        tasks = {entry["task"] for entry in cache.entries.values()}
+        print(f"缓存条目: {len(cache.entries)}，任务数: {len(tasks)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+后台产物写入
+标记图片、调试截图等产物在后台线程中渲染和写入磁盘，
+控制循环只负责提交任务，不等待PNG压缩和磁盘IO
+"""
+
+import threading
+import time
+from collections import deque
+
+
+class ArtifactWriter:
+    """
+    有界的后台任务队列
+    队列满时：drop_oldest策略丢弃最早的可丢弃任务，block策略阻塞提交方；
+    drop_oldest下队列中没有可丢弃的任务（如全是轨迹写入）时同样阻塞，队列长度不超过max_pending
+    """
+
+    def __init__(self, max_pending=8, policy="drop_oldest", log=print):
+        self.max_pending = max_pending
+        self.policy = policy
+        self.log = log
+        self.dropped = 0
+        self.completed = 0
+
+        self._jobs = deque()
+        self._busy = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, func, *args, droppable=True, **kwargs):
+        """
+        提交后台任务
+        droppable=False 的任务（如清理目录）在队列满时也不会被丢弃
+        返回任务是否被接受
+        """
+        with self._condition:
+            if self._closed:
+                return False
+            if len(self._jobs) >= self.max_pending:
+                # 后台线程自身提交的任务不能等待自己，直接入队
+                must_wait = threading.current_thread() is not self._thread and (
+                    self.policy == "block" or not self._drop_oldest()
+                )
+                if must_wait:
+                    while len(self._jobs) >= self.max_pending and not self._closed:
+                        self._condition.wait()
+                    if self._closed:
+                        return False
+            self._jobs.append((func, args, kwargs, droppable))
+            self._condition.notify_all()
+            return True
+
+    def _drop_oldest(self):
+        """丢弃最早的可丢弃任务，返回是否丢弃了任务"""
+        for index, job in enumerate(self._jobs):
+            if job[3]:
+                del self._jobs[index]
+                self.dropped += 1
+                self.log(f"产物写入队列已满，丢弃最早的任务（累计 {self.dropped} 个）")
+                return True
+        return False
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._jobs and not self._closed:
+                    self._condition.wait()
+                if not self._jobs and self._closed:
+                    return
+                func, args, kwargs, _ = self._jobs.popleft()
+                self._busy = True
+                self._condition.notify_all()
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                self.log(f"后台产物写入失败: {e}")
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self.completed += 1
+                    self._condition.notify_all()
+
+    def flush(self, timeout=None):
+        """等待队列中所有任务完成，返回是否在超时前完成"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._jobs or self._busy:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+    def close(self, timeout=None):
+        """写完剩余任务后停止后台线程"""
+        self.flush(timeout)
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
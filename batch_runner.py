@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+批量任务执行（非交互）
+从JSONL文件逐行读取任务，依次执行并把结果追加写入结果JSONL，
+中途崩溃后重新运行会跳过已有结果的任务
+
+任务文件每行一个JSON对象：
+    {"id": "task-1", "task": "打开微信给张三发消息：你好", "max_iterations": 20, "time_limit": 300}
+其中 id 可省略（按行号生成），task 也可写作 prompt 或 body
+
+带有 target 的行是脚本化步骤，目标模板已缓存（target_cache_config）时直接在本地定位执行，不调用模型；
+未命中时按 task 交给模型执行：
+    {"id": "step-1", "target": "微信搜索框", "action": "click", "task": "点击微信搜索框"}
+"""
+
+import argparse
+import json
+import os
+import time
+
+import vl_model_cli
+from vl_model_cli import AgentSession, set_config_path
+
+
+# 逐行读取任务
+def iter_tasks(tasks_path):
+    """流式读取任务文件，跳过空行和无法解析的行"""
+    with open(tasks_path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                print(f"跳过无法解析的任务行 {line_number}: {e}")
+                continue
+
+            task_text = item.get("task") or item.get("prompt") or item.get("body")
+            if not task_text:
+                print(f"跳过缺少任务内容的行 {line_number}")
+                continue
+
+            task_id = item.get("id") or item.get("task_id") or item.get("request_id")
+            yield {
+                "id": str(task_id) if task_id else f"line-{line_number}",
+                "task": task_text,
+                "max_iterations": item.get("max_iterations"),
+                "time_limit": item.get("time_limit"),
+                "target": item.get("target"),
+                "action": item.get("action") or "click",
+                "text": item.get("text") or "",
+            }
+
+
+# 读取已完成的任务ID
+def load_finished_ids(results_path):
+    """读取结果文件中已有的任务ID，用于断点续跑"""
+    finished = set()
+    if not os.path.exists(results_path):
+        return finished
+    with open(results_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                finished.add(json.loads(line)["id"])
+            except (ValueError, KeyError):
+                # 崩溃时可能留下写了一半的行
+                continue
+    return finished
+
+
+# 生成单个任务的结果记录
+def build_result(item, task):
+    """将执行后的TaskState整理为结果记录"""
+    return {
+        "id": item["id"],
+        "task": item["task"],
+        "status": task.status,
+        "result": task.result,
+        "iterations": task.iteration,
+        "wall_time": round(task.wall_time, 3),
+        "step_latencies": [round(latency, 3) for latency in task.step_latencies],
+        "started_at": task.started_at,
+        "finished_at": time.time(),
+        "trace": task.trace.path if task.trace is not None else None,
+    }
+
+
+# 执行单个任务
+def run_item(session, item, max_iterations=None, time_limit=None):
+    """执行一行任务，返回TaskState；脚本化步骤先尝试目标模板，未命中时交给模型"""
+    if item["target"]:
+        task = session.execute_target_step(
+            item["target"], item["action"], item["text"]
+        )
+        if task.status == "completed":
+            return task
+        print(f"目标模板未命中（{task.result}），改由模型执行")
+    return session.execute_task(
+        item["task"],
+        max_iterations=item["max_iterations"] or max_iterations,
+        time_limit=item["time_limit"] or time_limit,
+    )
+
+
+def run_batch(
+    session,
+    tasks_path,
+    results_path,
+    max_iterations=None,
+    time_limit=None,
+):
+    """依次执行任务文件中的任务，返回本次执行的任务数"""
+    finished = load_finished_ids(results_path)
+    if finished:
+        print(f"已有 {len(finished)} 个任务的结果，将跳过")
+
+    output_dir = os.path.dirname(results_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    count = 0
+    with open(results_path, "a", encoding="utf-8") as results_file:
+        for item in iter_tasks(tasks_path):
+            if item["id"] in finished:
+                continue
+
+            print("=" * 50)
+            print(f"任务 {item['id']}: {item['task']}")
+            task = run_item(session, item, max_iterations, time_limit)
+
+            # 用户中断的任务不记录结果，下次运行时重新执行
+            if task.status == "interrupted":
+                print("批量执行被中断")
+                break
+
+            result = build_result(item, task)
+            results_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+            results_file.flush()
+            os.fsync(results_file.fileno())
+            finished.add(item["id"])
+            count += 1
+            print(
+                f"任务 {item['id']} 结束: {task.status}，"
+                f"{task.iteration} 次迭代，耗时 {task.wall_time:.1f}s"
+            )
+
+            if vl_model_cli.should_exit:
+                break
+
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从JSONL文件批量执行任务")
+    parser.add_argument("--config", required=True, help="配置文件路径")
+    parser.add_argument("--tasks", required=True, help="任务JSONL文件")
+    parser.add_argument("--results", required=True, help="结果JSONL文件（追加写入）")
+    parser.add_argument("--max-iterations", type=int, default=None, help="每个任务的最大迭代次数")
+    parser.add_argument("--time-limit", type=float, default=None, help="每个任务的时间上限（秒）")
+    args = parser.parse_args()
+
+    set_config_path(args.config)
+    session = AgentSession(args.config)
+    try:
+        count = run_batch(
+            session,
+            args.tasks,
+            args.results,
+            max_iterations=args.max_iterations,
+            time_limit=args.time_limit,
+        )
+        print(f"本次共执行 {count} 个任务")
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
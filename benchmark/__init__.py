@@ -0,0 +1,5 @@
+"""
+离线性能基准
+使用本地模拟的OpenAI兼容服务、回放截图和空操作输入，
+在无图形界面、无付费模型的环境下端到端测量控制循环的吞吐和各阶段耗时
+"""
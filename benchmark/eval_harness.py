@@ -0,0 +1,508 @@
+"""
+离线评估：回放录制的任务轨迹（trace_config开启时写出），评估提示、响应解析和坐标映射的改动
+每一步用录制的截图和此前录制的响应重建上下文，经AgentSession.build_messages构建请求，
+发给指定的模型服务，解析并按execute_action的方式映射坐标，与录制的操作比较：
+操作类型（结束步比较status）、文本，以及映射到屏幕后的点击距离是否在容差内。
+各步互相独立，用有界的线程池并发请求；报告准确率和耗时，可设置门槛，不达标时退出码为1
+
+用法（在仓库根目录）:
+    # 用config_zhipu.json中的模型服务评估新版本的提示
+    python -m benchmark.eval_harness traces --config config_zhipu.json \
+        --prompt get_next_action_AI_new.md --workers 8 --output eval.json
+    # 不请求真实模型：本地模拟服务按录制的响应回答，用于检验解析和坐标映射的改动
+    python -m benchmark.eval_harness traces --stub --latency 0.2 --min-accuracy 1.0
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import math
+import os
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import vl_model_cli
+from benchmark.stub_server import StubServer
+from metrics import percentile
+from screen_frame import ScreenFrame
+from trace_store import TraceReader
+from vl_model_cli import (
+    AgentSession,
+    TaskState,
+    map_coordinates,
+    record_history,
+)
+
+# 比较文本的操作类型
+TEXT_ACTIONS = {"input", "type", "hotkey"}
+
+
+# 查找轨迹
+def find_traces(paths):
+    """参数可以是轨迹路径（不含扩展名，或.seg/.idx文件）或包含轨迹的目录"""
+    traces = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = glob.glob(os.path.join(path, "**", "*.idx"), recursive=True)
+            traces.extend(sorted(name[:-4] for name in found))
+        elif path.endswith((".seg", ".idx")):
+            traces.append(path[:-4])
+        else:
+            traces.append(path)
+    return traces
+
+
+# 请求内容的键（模拟服务按它查找录制的响应）
+def request_key(messages):
+    """系统提示以外的消息内容的哈希"""
+    payload = json.dumps(messages[1:], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+# 生成评估使用的配置
+def build_config(base_config_path, work_dir, overrides=None, server_url=None):
+    """
+    以指定配置为基础，关闭会操作屏幕或写入文件的功能：
+    输入走dry-run，不等待界面稳定，不读写动作缓存、目标模板、轨迹和耗时统计。
+    轨迹只保存了发送给模型的缩放截图，回放帧的full_image与scale不一致：
+    依赖原始分辨率截图的放大定位和增量帧（裁剪区域按原始分辨率计算）也关闭，
+    每一步都发送整张截图；录制的映射坐标是屏幕坐标，评分不受影响。
+    指定server_url时请求发往本地模拟服务
+    """
+    with open(base_config_path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+
+    for section, values in (overrides or {}).items():
+        if isinstance(values, dict):
+            config.setdefault(section, {}).update(values)
+        else:
+            config[section] = values
+
+    if server_url is not None:
+        config["api_config"].update(
+            {"api_key": "eval", "base_url": server_url, "model_name": "stub"}
+        )
+        config.setdefault("provider_config", {})["enabled"] = False
+    # 截图后端只在截图时才使用，评估中不会截图
+    config["screenshot_config"].update({"backend": "pyautogui", "save_to_disk": False})
+    config["input_config"] = {"backend": "dry_run"}
+    for section in (
+        "settle_config",
+        "action_cache_config",
+        "target_cache_config",
+        "trace_config",
+        "metrics_config",
+        "zoom_config",
+        "delta_config",
+    ):
+        config.setdefault(section, {})["enabled"] = False
+
+    config_path = os.path.join(work_dir, "config.json")
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    return config_path
+
+
+# 按录制的轨迹生成评估样本
+def iter_samples(session, trace_paths, statuses=("completed",), log=print):
+    """
+    依次读取轨迹，只评估结果状态在statuses中的轨迹（None表示全部）
+    每一步用录制的截图构建请求，再把录制的响应写入上下文历史，供后续步骤使用
+    """
+    history_config = session.config.get("history_config", {})
+    for path in trace_paths:
+        try:
+            reader = TraceReader(path)
+        except (OSError, ValueError) as e:
+            log(f"⚠️  无法读取轨迹 {path}: {e}")
+            continue
+        with reader:
+            task_record = reader.task() or {}
+            result = reader.result() or {}
+            if statuses is not None and result.get("status") not in statuses:
+                continue
+            task = TaskState(task_record.get("task", ""))
+            for step in reader.steps():
+                if step.get("frame") is None or not step.get("action"):
+                    continue
+                frame = ScreenFrame(
+                    reader.frame(step["frame"]),
+                    scale=step.get("scale", 1),
+                    origin=tuple(step.get("origin", (0, 0))),
+                )
+                messages, user_message, delta_regions = session.build_messages(
+                    task, frame
+                )
+                if messages is None:
+                    continue
+                # 流式提前执行的步骤没有记录原始响应，用解析结果代替
+                response_text = step.get("response") or json.dumps(
+                    {
+                        key: step.get(key)
+                        for key in ("status", "action", "target", "description")
+                    },
+                    ensure_ascii=False,
+                )
+                yield {
+                    "trace": path,
+                    "iteration": step.get("iteration"),
+                    "messages": messages,
+                    "frame": frame,
+                    "delta_regions": delta_regions,
+                    "response": response_text,
+                    "expected": {
+                        "status": step.get("status"),
+                        "action": step.get("action"),
+                        "mapped": step.get("mapped"),
+                    },
+                }
+                record_history(task, user_message, frame, response_text, history_config)
+                task.last_sent_frame = frame
+
+
+# 预测操作映射到屏幕上的坐标
+def predicted_point(session, frame, ai_response, delta_regions=None):
+    """与execute_action相同的坐标解析和映射，无坐标的操作返回None"""
+    action = ai_response.action if isinstance(ai_response.action, dict) else {}
+    action_type = action.get("type", "wait")
+    if action_type in ("wait", "hotkey"):
+        return None
+    coordinates, mapping = session._action_mapping(frame, ai_response, delta_regions)
+    if not (coordinates and len(coordinates) >= 2):
+        return None
+    if isinstance(coordinates[0], list):
+        if action_type != "drag":
+            return None
+        return [list(map_coordinates(*point, **mapping)) for point in coordinates[:2]]
+    return list(map_coordinates(coordinates[0], coordinates[1], **mapping))
+
+
+# 两个屏幕坐标（单点或拖拽的两点）之间的距离
+def point_distance(expected, predicted):
+    """形状不一致时返回None；拖拽取两个端点中较大的距离"""
+    if not expected or not predicted:
+        return None
+    expected_drag = isinstance(expected[0], list)
+    if expected_drag != isinstance(predicted[0], list):
+        return None
+    pairs = zip(expected, predicted) if expected_drag else [(expected, predicted)]
+    return max(math.dist(a[:2], b[:2]) for a, b in pairs)
+
+
+def _normalize_text(text):
+    return " ".join(str(text or "").split()).lower()
+
+
+# 评估一个样本
+def evaluate_sample(session, sample, tolerance):
+    """请求模型、解析、映射坐标并与录制的操作比较，返回本步的评估记录"""
+    expected = sample["expected"]
+    expected_action = expected["action"] or {}
+    record = {
+        "trace": sample["trace"],
+        "iteration": sample["iteration"],
+        "expected_status": expected["status"],
+        "expected_type": expected_action.get("type"),
+        "expected_mapped": expected["mapped"],
+    }
+
+    start = time.perf_counter()
+    try:
+        completion = session._create_completion(sample["messages"])
+        response_text = completion.choices[0].message.content or ""
+    except Exception as e:
+        record.update(latency=time.perf_counter() - start, error=str(e), correct=False)
+        return record
+    record["latency"] = time.perf_counter() - start
+    usage = getattr(completion, "usage", None)
+    if usage is not None:
+        record["prompt_tokens"] = usage.prompt_tokens or 0
+        record["completion_tokens"] = usage.completion_tokens or 0
+
+    task = TaskState("")
+    ai_response = session._parse_response(task, response_text)
+    action = ai_response.action if isinstance(ai_response.action, dict) else {}
+    mapped = predicted_point(
+        session, sample["frame"], ai_response, sample["delta_regions"]
+    )
+    distance = point_distance(expected["mapped"], mapped)
+    record.update(
+        response=response_text,
+        predicted_status=ai_response.status,
+        predicted_type=action.get("type"),
+        predicted_mapped=mapped,
+        status_match=ai_response.status == expected["status"],
+        type_match=action.get("type") == expected_action.get("type"),
+        distance=None if distance is None else round(distance, 1),
+    )
+
+    checks = [record["status_match"], record["type_match"]]
+    if expected["mapped"]:
+        record["hit"] = distance is not None and distance <= tolerance
+        checks.append(record["hit"])
+    if expected_action.get("type") in TEXT_ACTIONS and expected_action.get("text"):
+        record["text_match"] = _normalize_text(action.get("text")) == _normalize_text(
+            expected_action.get("text")
+        )
+        checks.append(record["text_match"])
+    record["correct"] = all(checks)
+    return record
+
+
+# 用有界的线程池并发评估
+def run_samples(session, samples, tolerance, workers=4, on_record=None):
+    """
+    最多同时进行workers个请求；样本按需生成，已提交未完成的样本不超过workers的两倍
+    （每个线程多排队一个，请求结束后线程不必等待主线程提交），避免一次性在内存中构建全部请求
+    """
+    records = []
+    pending = set()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="eval") as pool:
+
+        def collect(done):
+            for future in done:
+                record = future.result()
+                records.append(record)
+                if on_record:
+                    on_record(record)
+
+        for sample in samples:
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending.add(pool.submit(evaluate_sample, session, sample, tolerance))
+        done, _ = wait(pending)
+        collect(done)
+    records.sort(key=lambda record: (record["trace"], record["iteration"] or 0))
+    return records
+
+
+def _rate(count, total):
+    return round(count / total, 4) if total else None
+
+
+# 汇总评估结果
+def summarize(records, elapsed, tolerance):
+    """总体和各操作类型的准确率、点击距离，以及请求耗时和token数"""
+    answered = [record for record in records if "error" not in record]
+    pointed = [record for record in answered if "hit" in record]
+    texted = [record for record in answered if "text_match" in record]
+    distances = [
+        record["distance"] for record in pointed if record["distance"] is not None
+    ]
+    latencies = [record["latency"] for record in answered]
+
+    by_type = {}
+    for name in sorted(Counter(record["expected_type"] for record in records)):
+        group = [record for record in records if record["expected_type"] == name]
+        group_pointed = [record for record in group if "hit" in record]
+        by_type[name] = {
+            "steps": len(group),
+            "accuracy": _rate(sum(record["correct"] for record in group), len(group)),
+            "type_accuracy": _rate(
+                sum(record.get("type_match", False) for record in group), len(group)
+            ),
+            "click_accuracy": _rate(
+                sum(record["hit"] for record in group_pointed), len(group_pointed)
+            ),
+        }
+
+    return {
+        "steps": len(records),
+        "traces": len({record["trace"] for record in records}),
+        "errors": len(records) - len(answered),
+        "accuracy": _rate(sum(record["correct"] for record in records), len(records)),
+        "status_accuracy": _rate(
+            sum(record["status_match"] for record in answered), len(records)
+        ),
+        "type_accuracy": _rate(
+            sum(record["type_match"] for record in answered), len(records)
+        ),
+        "click_accuracy": _rate(sum(record["hit"] for record in pointed), len(pointed)),
+        "text_accuracy": _rate(
+            sum(record["text_match"] for record in texted), len(texted)
+        ),
+        "tolerance": tolerance,
+        "distance": {
+            "p50": round(percentile(distances, 0.5), 1),
+            "p95": round(percentile(distances, 0.95), 1),
+        },
+        "latency": {
+            "p50": round(percentile(latencies, 0.5), 4),
+            "p95": round(percentile(latencies, 0.95), 4),
+            "mean": round(sum(latencies) / len(latencies), 4) if latencies else 0.0,
+        },
+        "tokens": {
+            "prompt": sum(record.get("prompt_tokens", 0) for record in answered),
+            "completion": sum(record.get("completion_tokens", 0) for record in answered),
+        },
+        "elapsed": round(elapsed, 3),
+        "steps_per_sec": round(len(records) / elapsed, 3) if elapsed else 0.0,
+        "by_type": by_type,
+    }
+
+
+# 检查门槛
+def check_gates(summary, min_accuracy=None, min_click_accuracy=None, max_p95=None):
+    """返回未达到的门槛说明列表"""
+    failures = []
+    accuracy = summary["accuracy"] or 0.0
+    if min_accuracy is not None and accuracy < min_accuracy:
+        failures.append(f"准确率 {accuracy:.2%} 低于 {min_accuracy:.2%}")
+    click_accuracy = summary["click_accuracy"]
+    if (
+        min_click_accuracy is not None
+        and click_accuracy is not None
+        and click_accuracy < min_click_accuracy
+    ):
+        failures.append(f"点击准确率 {click_accuracy:.2%} 低于 {min_click_accuracy:.2%}")
+    p95 = summary["latency"]["p95"]
+    if max_p95 is not None and p95 > max_p95:
+        failures.append(f"请求耗时p95 {p95:.2f}s 超过 {max_p95:.2f}s")
+    return failures
+
+
+def format_summary(summary):
+    """报告的可读文本"""
+
+    def percent(value):
+        return "-" if value is None else f"{value:.1%}"
+
+    lines = [
+        f"轨迹: {summary['traces']}  步数: {summary['steps']}  请求失败: {summary['errors']}",
+        f"准确率: {percent(summary['accuracy'])}  状态: {percent(summary['status_accuracy'])}  "
+        f"操作类型: {percent(summary['type_accuracy'])}  文本: {percent(summary['text_accuracy'])}",
+        f"点击准确率（{summary['tolerance']}px内）: {percent(summary['click_accuracy'])}  "
+        f"距离p50/p95: {summary['distance']['p50']}/{summary['distance']['p95']}px",
+        f"请求耗时 p50/p95/平均: {summary['latency']['p50'] * 1000:.0f}/"
+        f"{summary['latency']['p95'] * 1000:.0f}/{summary['latency']['mean'] * 1000:.0f}ms  "
+        f"吞吐: {summary['steps_per_sec']:.2f} 步/秒",
+        f"token: 输入 {summary['tokens']['prompt']}  输出 {summary['tokens']['completion']}",
+        "各操作类型:",
+    ]
+    for name, stats in summary["by_type"].items():
+        lines.append(
+            f"  {name}: {stats['steps']} 步  准确率 {percent(stats['accuracy'])}  "
+            f"类型 {percent(stats['type_accuracy'])}  点击 {percent(stats['click_accuracy'])}"
+        )
+    return "\n".join(lines)
+
+
+# 模拟服务按录制的响应回答
+def recorded_responder(session, trace_paths, statuses):
+    """
+    预先按每一步的请求内容索引录制的原始响应；请求并发到达时也能按内容找到对应的响应
+    """
+    responses = {
+        request_key(sample["messages"]): sample["response"]
+        for sample in iter_samples(session, trace_paths, statuses)
+    }
+
+    def respond(request):
+        return responses.get(request_key(request.get("messages") or [{}]))
+
+    return respond
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放录制的任务轨迹，离线评估模型、提示和解析")
+    parser.add_argument("traces", nargs="+", help="轨迹路径或包含轨迹的目录")
+    parser.add_argument("--config", default="config_example.json", help="模型服务和各功能的配置")
+    parser.add_argument("--prompt", default=None, help="代替默认系统提示的提示文件")
+    parser.add_argument("--model", default=None, help="覆盖api_config中的模型名")
+    parser.add_argument(
+        "--set",
+        default="{}",
+        help='覆盖配置项的JSON，如 \'{"ai_config": {"structured_output": true}}\'',
+    )
+    parser.add_argument("--workers", type=int, default=4, help="同时进行的请求数")
+    parser.add_argument("--tolerance", type=float, default=30.0, help="点击距离容差（屏幕像素）")
+    parser.add_argument(
+        "--status",
+        default="completed",
+        help="只评估这些结果状态的轨迹（逗号分隔），all表示全部",
+    )
+    parser.add_argument(
+        "--stub", action="store_true", help="启动本地模拟服务，按录制的响应回答"
+    )
+    parser.add_argument("--latency", type=float, default=0.0, help="模拟服务的固定延迟（秒）")
+    parser.add_argument("--quiet", action="store_true", help="不输出会话日志")
+    parser.add_argument("--output", default=None, help="把报告写入JSON文件")
+    parser.add_argument("--steps-output", default=None, help="把每一步的评估记录写入JSONL文件")
+    parser.add_argument("--min-accuracy", type=float, default=None, help="准确率门槛")
+    parser.add_argument("--min-click-accuracy", type=float, default=None, help="点击准确率门槛")
+    parser.add_argument("--max-p95", type=float, default=None, help="请求耗时p95门槛（秒）")
+    args = parser.parse_args()
+
+    if args.quiet:
+        vl_model_cli.log_print = lambda *args, **kwargs: None
+    statuses = None if args.status == "all" else tuple(args.status.split(","))
+    trace_paths = find_traces(args.traces)
+    overrides = json.loads(args.set)
+    if args.model:
+        overrides.setdefault("api_config", {})["model_name"] = args.model
+
+    server = None
+    if args.stub:
+        server = StubServer(latency=args.latency).start()
+    try:
+        work_dir = tempfile.mkdtemp(prefix="cli_vision_eval_")
+        config_path = build_config(
+            args.config, work_dir, overrides, server.url if server else None
+        )
+        session = AgentSession(config_path, prompt_path=args.prompt)
+        error = session.refresh()
+        if error:
+            raise SystemExit(f"会话初始化失败: {error}")
+        session.input_backend.log = lambda *args: None
+        if server is not None:
+            server.responder = recorded_responder(session, trace_paths, statuses)
+
+        steps_file = (
+            open(args.steps_output, "w", encoding="utf-8") if args.steps_output else None
+        )
+        start = time.perf_counter()
+        try:
+            records = run_samples(
+                session,
+                iter_samples(session, trace_paths, statuses),
+                args.tolerance,
+                workers=max(1, args.workers),
+                on_record=(
+                    lambda record: steps_file.write(
+                        json.dumps(record, ensure_ascii=False) + "\n"
+                    )
+                )
+                if steps_file
+                else None,
+            )
+        finally:
+            if steps_file:
+                steps_file.close()
+        elapsed = time.perf_counter() - start
+        session.close()
+    finally:
+        if server is not None:
+            server.stop()
+
+    summary = summarize(records, elapsed, args.tolerance)
+    failures = check_gates(
+        summary, args.min_accuracy, args.min_click_accuracy, args.max_p95
+    )
+    summary["gate_failures"] = failures
+    print("=" * 50)
+    print(format_summary(summary))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+    for failure in failures:
+        print(f"❌ {failure}")
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
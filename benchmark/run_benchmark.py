@@ -0,0 +1,445 @@
+"""
+端到端离线基准
+启动模拟模型服务，使用回放截图后端和dry-run输入后端（不操作鼠标键盘），
+通过AgentSession执行若干任务，报告每秒步数、各阶段耗时、内存和请求字节数
+
+用法（在仓库根目录）:
+    python -m benchmark.run_benchmark --frames imgs/label --tasks 5 --latency 0.05
+    # 在一个事件循环中用4个会话并发执行（异步主循环）
+    python -m benchmark.run_benchmark --tasks 8 --latency 0.5 --sessions 4
+    # 主服务10%的请求慢3秒，另启动一个备用服务，测试对冲请求
+    python -m benchmark.run_benchmark --tasks 4 --latency 0.2 --tail-rate 0.1 \
+        --tail-latency 3 --secondary-latency 0.3
+    # 快、强两档模型分层路由（模拟服务按模型名使用不同延迟）
+    python -m benchmark.run_benchmark --tasks 4 --model-latency '{"fast": 0.2, "strong": 1.0}' \
+        --set '{"routing_config": {"enabled": true, "tiers": [{"name": "fast", "model_name": "fast"}, {"name": "strong", "model_name": "strong"}]}}'
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+import vl_model_cli
+from benchmark.stub_server import StubServer, load_script
+from metrics import percentile
+
+# 会改变屏幕内容的输入动作，执行后切换到下一张回放截图
+SCREEN_CHANGING_ACTIONS = {
+    "click",
+    "double_click",
+    "right_click",
+    "drag_to",
+    "scroll",
+    "hotkey",
+    "press",
+    "type_text",
+}
+
+
+# 生成基准使用的配置
+def build_config(
+    base_config_path,
+    server_url,
+    work_dir,
+    frames_dir,
+    overrides=None,
+    secondary_url=None,
+):
+    """
+    以示例配置为基础，指向模拟服务，回放截图，并打开耗时统计
+    指定secondary_url时配置主、备两个模型服务
+    """
+    with open(base_config_path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+
+    config["api_config"].update(
+        {"api_key": "benchmark", "base_url": server_url, "model_name": "stub"}
+    )
+    config["screenshot_config"].update(
+        {
+            "save_to_disk": False,
+            "backend": "replay",
+            "replay_path": frames_dir,
+            # 只在执行点击等操作后切换截图
+            "replay_advance": "manual",
+        }
+    )
+    config["input_config"] = {"backend": "dry_run"}
+    config["screenshot_config"]["output_path"] = os.path.join(work_dir, "label")
+    config.setdefault("action_cache_config", {})["enabled"] = False
+    provider_config = config.setdefault("provider_config", {})
+    provider_config["enabled"] = secondary_url is not None
+    if secondary_url is not None:
+        # 其余字段继承api_config
+        provider_config["providers"] = [
+            {"name": "primary", "base_url": server_url},
+            {"name": "secondary", "base_url": secondary_url},
+        ]
+    config["metrics_config"] = {
+        "enabled": True,
+        "jsonl_path": os.path.join(work_dir, "metrics.jsonl"),
+    }
+
+    for section, values in (overrides or {}).items():
+        if isinstance(values, dict):
+            config.setdefault(section, {}).update(values)
+        else:
+            config[section] = values
+
+    config_path = os.path.join(work_dir, "config.json")
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    return config_path
+
+
+def run_benchmark(
+    frames_dir,
+    tasks=3,
+    latency=0.0,
+    jitter=0.0,
+    chunk_delay=0.0,
+    script=None,
+    base_config="config_example.json",
+    overrides=None,
+    max_iterations=20,
+    trace_memory=False,
+    supports_response_format=True,
+    sessions=0,
+    fail_rate=0.0,
+    tail_rate=0.0,
+    tail_latency=0.0,
+    secondary_latency=None,
+    model_latency=None,
+):
+    """
+    执行基准并返回报告字典
+    sessions为0时用同步主循环依次执行；大于0时在一个事件循环中用这么多个会话并发执行
+    fail_rate、tail_rate和tail_latency作用于主服务；指定secondary_latency时
+    另启动一个该延迟的备用服务，对冲请求发往备用服务；
+    model_latency为 {模型名: 延迟}，用于模拟分层路由中不同档位的模型
+    """
+    work_dir = tempfile.mkdtemp(prefix="cli_vision_bench_")
+    server = StubServer(
+        script=script,
+        latency=latency,
+        jitter=jitter,
+        chunk_delay=chunk_delay,
+        fail_rate=fail_rate,
+        supports_response_format=supports_response_format,
+        tail_rate=tail_rate,
+        tail_latency=tail_latency,
+        model_latency=model_latency,
+    ).start()
+    secondary = None
+    if secondary_latency is not None:
+        secondary = StubServer(
+            script=script,
+            latency=secondary_latency,
+            chunk_delay=chunk_delay,
+            model_latency=model_latency,
+            supports_response_format=supports_response_format,
+        ).start()
+
+    if trace_memory:
+        tracemalloc.start()
+
+    results = []
+    stage_samples = {}
+    totals = {}
+    try:
+        config_path = build_config(
+            base_config,
+            server.url,
+            work_dir,
+            frames_dir,
+            overrides,
+            secondary_url=secondary.url if secondary else None,
+        )
+        vl_model_cli.set_config_path(config_path)
+        session_list = [
+            vl_model_cli.AgentSession(config_path) for _ in range(max(1, sessions))
+        ]
+        for session in session_list:
+            error = session.refresh()
+            if error:
+                raise RuntimeError(error)
+            # 执行操作后切换到下一张回放截图（每个会话有自己的回放截图后端）
+            screen = session.capture_backend
+            # dry-run时不输出每个动作的日志
+            session.input_backend.log = lambda *args: None
+
+            def advance_screen(action, screen=screen):
+                if action in SCREEN_CHANGING_ACTIONS:
+                    screen.advance()
+
+            session.input_backend.listener = advance_screen
+
+        start = time.perf_counter()
+        if sessions:
+            results, backend_stats = asyncio.run(
+                run_sessions_async(session_list, tasks, max_iterations)
+            )
+        else:
+            for index in range(tasks):
+                results.append(
+                    session_list[0].execute_task(
+                        f"基准任务 {index + 1}", max_iterations=max_iterations
+                    )
+                )
+            backend_stats = collect_backend_stats(session_list)
+            session_list[0].close()
+        elapsed = time.perf_counter() - start
+        for task in results:
+            for name, values in task.metrics.samples.items():
+                stage_samples.setdefault(name, []).extend(values)
+            for name, value in task.metrics.totals.items():
+                totals[name] = totals.get(name, 0) + value
+    finally:
+        server.stop()
+        if secondary is not None:
+            secondary.stop()
+
+    traced_peak = None
+    if trace_memory:
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    # Linux下ru_maxrss单位为KB，macOS下为字节
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        max_rss *= 1024
+
+    steps = sum(task.iteration for task in results)
+    return {
+        "tasks": len(results),
+        "statuses": [task.status for task in results],
+        "steps": steps,
+        "elapsed": elapsed,
+        "steps_per_sec": steps / elapsed if elapsed else 0.0,
+        "model_requests": server.requests
+        + (secondary.requests if secondary else 0),
+        "zoom_requests": server.zoom_requests,
+        "model_names": server.model_requests,
+        "request_bytes": server.request_bytes,
+        "payload_bytes_per_request": server.request_bytes / max(1, server.requests),
+        "sessions": sessions,
+        **backend_stats,
+        "max_rss_bytes": max_rss,
+        "traced_peak_bytes": traced_peak,
+        "totals": totals,
+        "stages": {
+            name: {
+                "count": len(values),
+                "total": sum(values),
+                "p50": percentile(values, 0.5),
+                "p95": percentile(values, 0.95),
+            }
+            for name, values in stage_samples.items()
+        },
+        "work_dir": work_dir,
+    }
+
+
+# 汇总各会话的截图和输入统计（需在关闭会话前调用）
+def collect_backend_stats(session_list):
+    input_calls = Counter()
+    captures = 0
+    for session in session_list:
+        input_calls.update(session.input_backend.counts)
+        captures += getattr(session.capture_backend, "captures", 0)
+    return {
+        "input_calls": dict(input_calls),
+        "providers": merge_provider_stats(session_list),
+        "routing": merge_route_stats(session_list),
+        "capture_backend": session_list[0].capture_backend.name,
+        "captures": captures,
+    }
+
+
+# 汇总各会话的模型服务统计
+def merge_provider_stats(session_list):
+    """返回 {服务名: 请求、错误、对冲、胜出、取消次数}，未配置多个服务时返回None"""
+    merged = {}
+    for session in session_list:
+        for name, stats in (session.provider_stats() or {}).items():
+            entry = merged.setdefault(name, Counter())
+            entry.update(
+                {
+                    key: stats[key]
+                    for key in ("requests", "errors", "hedges", "wins", "cancelled")
+                }
+            )
+    return {name: dict(entry) for name, entry in merged.items()} or None
+
+
+# 汇总各会话的分层路由统计
+def merge_route_stats(session_list):
+    """返回 {"tiers": {层级: {steps, p50, p95}}, "escalations": {原因: 次数}}，未启用时返回None"""
+    routers = [session.router for session in session_list if session.router is not None]
+    if not routers:
+        return None
+    steps = Counter()
+    escalations = Counter()
+    latencies = {}
+    for router in routers:
+        steps.update(router.steps)
+        escalations.update(router.escalations)
+        for name, values in router.latencies.items():
+            latencies.setdefault(name, []).extend(values)
+    return {
+        "tiers": {
+            name: {
+                "steps": steps[name],
+                "p50": percentile(values, 0.5),
+                "p95": percentile(values, 0.95),
+            }
+            for name, values in latencies.items()
+        },
+        "escalations": dict(escalations),
+    }
+
+
+# 在一个事件循环中并发执行
+async def run_sessions_async(session_list, tasks, max_iterations):
+    """
+    各会话从共享队列中取任务，用异步主循环执行
+    返回 (按任务编号排序的TaskState列表, 截图和输入统计)
+    """
+    queue = asyncio.Queue()
+    for index in range(tasks):
+        queue.put_nowait(index)
+    results = {}
+
+    async def worker(session):
+        while not queue.empty():
+            index = queue.get_nowait()
+            results[index] = await session.execute_task_async(
+                f"基准任务 {index + 1}", max_iterations=max_iterations
+            )
+
+    try:
+        await asyncio.gather(*(worker(session) for session in session_list))
+        backend_stats = collect_backend_stats(session_list)
+    finally:
+        for session in session_list:
+            await session.aclose()
+    return [results[index] for index in sorted(results)], backend_stats
+
+
+def format_report(report):
+    lines = [
+        f"任务数: {report['tasks']}  状态: {report['statuses']}",
+        f"总步数: {report['steps']}  耗时: {report['elapsed']:.2f}s  "
+        f"吞吐: {report['steps_per_sec']:.2f} 步/秒",
+        f"模型请求: {report['model_requests']}  "
+        f"平均请求大小: {report['payload_bytes_per_request'] / 1024:.1f} KB",
+        f"截图后端: {report['capture_backend']}  "
+        f"截图次数: {report['captures']}  输入调用: {report['input_calls']}",
+        f"峰值RSS: {report['max_rss_bytes'] / 1024 / 1024:.1f} MB",
+    ]
+    if report["routing"]:
+        for name, stats in report["routing"]["tiers"].items():
+            lines.append(
+                f"模型层级 {name}: {stats['steps']} 步  单步耗时 p50 "
+                f"{stats['p50'] * 1000:.0f}ms  p95 {stats['p95'] * 1000:.0f}ms"
+            )
+        lines.append(f"升级原因: {report['routing']['escalations']}")
+    for name, stats in (report["providers"] or {}).items():
+        lines.append(
+            f"模型服务 {name}: 请求 {stats['requests']}  错误 {stats['errors']}  "
+            f"对冲 {stats['hedges']}  胜出 {stats['wins']}  取消 {stats['cancelled']}"
+        )
+    if report["traced_peak_bytes"] is not None:
+        lines.append(
+            f"Python分配峰值: {report['traced_peak_bytes'] / 1024 / 1024:.1f} MB"
+        )
+    lines.append(f"{'阶段':<20}{'次数':>6}{'p50(ms)':>10}{'p95(ms)':>10}{'总计(s)':>10}")
+    for name, stats in sorted(report["stages"].items(), key=lambda i: -i[1]["total"]):
+        lines.append(
+            f"{name:<20}{stats['count']:>6}{stats['p50'] * 1000:>10.1f}"
+            f"{stats['p95'] * 1000:>10.1f}{stats['total']:>10.2f}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="控制循环离线性能基准")
+    parser.add_argument("--frames", default="imgs/label", help="回放截图所在目录")
+    parser.add_argument("--tasks", type=int, default=3, help="执行的任务数")
+    parser.add_argument("--max-iterations", type=int, default=20, help="每个任务的最大迭代次数")
+    parser.add_argument("--latency", type=float, default=0.0, help="模拟模型的固定延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="模拟模型的随机附加延迟（秒）")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="流式输出每块间隔（秒）")
+    parser.add_argument("--script", default=None, help="模拟模型的响应脚本")
+    parser.add_argument("--base-config", default="config_example.json", help="基础配置")
+    parser.add_argument(
+        "--set",
+        default="{}",
+        help='覆盖配置项的JSON，如 \'{"ai_config": {"stream": true}}\'',
+    )
+    parser.add_argument("--trace-memory", action="store_true", help="用tracemalloc统计分配峰值")
+    parser.add_argument(
+        "--no-response-format",
+        action="store_true",
+        help="模拟服务拒绝response_format（测试结构化输出的回退）",
+    )
+    parser.add_argument(
+        "--sessions",
+        type=int,
+        default=0,
+        help="大于0时在一个事件循环中用这么多个会话并发执行（异步主循环）",
+    )
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="主服务随机返回500的比例")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="主服务长尾响应的比例")
+    parser.add_argument(
+        "--tail-latency", type=float, default=0.0, help="主服务长尾响应的附加延迟（秒）"
+    )
+    parser.add_argument(
+        "--secondary-latency",
+        type=float,
+        default=None,
+        help="另启动一个该延迟的备用服务，并配置为对冲请求的第二个模型服务",
+    )
+    parser.add_argument(
+        "--model-latency",
+        default="{}",
+        help='按模型名指定模拟服务的延迟（JSON），如 \'{"fast": 0.2, "strong": 1.0}\'',
+    )
+    parser.add_argument("--output", default=None, help="把报告写入JSON文件")
+    args = parser.parse_args()
+
+    report = run_benchmark(
+        args.frames,
+        tasks=args.tasks,
+        latency=args.latency,
+        jitter=args.jitter,
+        chunk_delay=args.chunk_delay,
+        script=load_script(args.script) if args.script else None,
+        base_config=args.base_config,
+        overrides=json.loads(args.set),
+        max_iterations=args.max_iterations,
+        trace_memory=args.trace_memory,
+        supports_response_format=not args.no_response_format,
+        sessions=args.sessions,
+        fail_rate=args.fail_rate,
+        tail_rate=args.tail_rate,
+        tail_latency=args.tail_latency,
+        secondary_latency=args.secondary_latency,
+        model_latency=json.loads(args.model_latency),
+    )
+    print("=" * 50)
+    print(format_report(report))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
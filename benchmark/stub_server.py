@@ -0,0 +1,367 @@
+"""
+模拟chat-completions接口的本地HTTP服务
+按脚本依次返回JSON操作，可配置延迟，支持stream=True的SSE输出
+请求带有json_schema类型的response_format时，按Schema补齐脚本中缺少的字段
+放大定位请求不消耗脚本，固定返回zoom_response
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from zoom_grounding import ZOOM_SYSTEM_PROMPT
+
+# 默认脚本：几步普通操作后返回任务完成
+DEFAULT_SCRIPT = [
+    {
+        "status": "in_progress",
+        "action": {"type": "click", "coordinates": [500, 300], "text": ""},
+        "target": "搜索框",
+        "description": "需要点击搜索框",
+    },
+    {
+        "status": "in_progress",
+        "action": {"type": "input", "coordinates": [500, 300], "text": "hello"},
+        "target": "搜索框",
+        "description": "在搜索框中输入内容",
+    },
+    {
+        "status": "in_progress",
+        "action": {"type": "scroll_down", "coordinates": [500, 600], "text": ""},
+        "target": "结果列表",
+        "description": "向下滚动查看结果",
+    },
+    {
+        "status": "completed",
+        "action": {"type": "wait", "coordinates": [0, 0], "text": ""},
+        "target": "",
+        "description": "任务已完成",
+    },
+]
+
+
+def load_script(path):
+    """从JSON数组或JSONL文件加载响应脚本，元素可以是对象或原始文本"""
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read().strip()
+    if content.startswith("["):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+def fill_schema_defaults(value, schema, defs=None):
+    """按JSON Schema补齐对象中缺少的必填字段（可为null的填null，其余填空值）"""
+    if defs is None:
+        defs = schema.get("$defs", {})
+    if "$ref" in schema:
+        schema = defs[schema["$ref"].rsplit("/", 1)[-1]]
+    if "anyOf" in schema:
+        if value is None:
+            return None
+        schema = schema["anyOf"][0]
+
+    schema_type = schema.get("type")
+    if schema_type == "object":
+        value = dict(value) if isinstance(value, dict) else {}
+        for key in schema.get("required", []):
+            prop = schema["properties"][key]
+            if key in value:
+                value[key] = fill_schema_defaults(value[key], prop, defs)
+            elif any(option.get("type") == "null" for option in prop.get("anyOf", [])):
+                value[key] = None
+            else:
+                value[key] = fill_schema_defaults(None, prop, defs)
+        return value
+    if schema_type == "array":
+        if not isinstance(value, list):
+            return []
+        return [fill_schema_defaults(item, schema.get("items", {}), defs) for item in value]
+    if value is not None:
+        return value
+    if "enum" in schema:
+        return schema["enum"][0]
+    return {"string": "", "boolean": False, "number": 0, "integer": 0}.get(
+        schema_type
+    )
+
+
+class StubServer:
+    """可在测试和基准中启动的模拟模型服务"""
+
+    def __init__(
+        self,
+        script=None,
+        latency=0.0,
+        jitter=0.0,
+        chunk_delay=0.0,
+        host="127.0.0.1",
+        port=0,
+        fail_rate=0.0,
+        supports_response_format=True,
+        zoom_response=None,
+        tail_rate=0.0,
+        tail_latency=0.0,
+        model_latency=None,
+        responder=None,
+    ):
+        self.script = script or DEFAULT_SCRIPT
+        # 可选的 responder(request) 按请求内容返回响应文本，返回None时按脚本顺序返回
+        self.responder = responder
+        self.latency = latency
+        self.jitter = jitter
+        self.chunk_delay = chunk_delay
+        self.fail_rate = fail_rate
+        # 以tail_rate的概率额外延迟tail_latency秒，模拟服务的长尾耗时
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        # {模型名: 固定延迟}，请求的模型在其中时代替latency（模拟快、慢两档模型）
+        self.model_latency = model_latency or {}
+        self.model_requests = {}
+        # 为False时拒绝带response_format的请求，模拟不支持结构化输出的服务
+        self.supports_response_format = supports_response_format
+        self.zoom_response = zoom_response or {"found": True, "coordinates": [500, 500]}
+        self.zoom_requests = 0
+        self.requests = 0
+        self.request_bytes = 0
+        self._lock = threading.Lock()
+        self._index = 0
+
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def next_response(self, response_format=None):
+        """按脚本顺序取下一条响应文本（循环使用）"""
+        with self._lock:
+            item = self.script[self._index % len(self.script)]
+            self._index += 1
+        if isinstance(item, str):
+            return item
+        if response_format and response_format.get("type") == "json_schema":
+            item = fill_schema_defaults(item, response_format["json_schema"]["schema"])
+        return json.dumps(item, ensure_ascii=False)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def handle(self):
+                # 客户端取消请求（如对冲请求中落后的一方）时连接会被提前关闭
+                try:
+                    super().handle()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length)
+                with server._lock:
+                    server.requests += 1
+                    server.request_bytes += length
+                try:
+                    request = json.loads(body)
+                except ValueError:
+                    self._send_json(400, {"error": {"message": "invalid json"}})
+                    return
+
+                model = request.get("model", "stub")
+                with server._lock:
+                    server.model_requests[model] = server.model_requests.get(model, 0) + 1
+                delay = server.model_latency.get(model, server.latency) + random.uniform(
+                    0, server.jitter
+                )
+                if server.tail_rate and random.random() < server.tail_rate:
+                    delay += server.tail_latency
+                if delay > 0:
+                    time.sleep(delay)
+
+                if server.fail_rate and random.random() < server.fail_rate:
+                    self._send_json(500, {"error": {"message": "stub failure"}})
+                    return
+
+                response_format = request.get("response_format")
+                if response_format and not server.supports_response_format:
+                    self._send_json(
+                        400,
+                        {
+                            "error": {
+                                "message": "response_format is not supported",
+                                "type": "invalid_request_error",
+                            }
+                        },
+                    )
+                    return
+
+                messages = request.get("messages") or [{}]
+                if messages[0].get("content") == ZOOM_SYSTEM_PROMPT:
+                    with server._lock:
+                        server.zoom_requests += 1
+                    text = json.dumps(server.zoom_response)
+                else:
+                    text = server.responder(request) if server.responder else None
+                    if text is None:
+                        text = server.next_response(response_format)
+                usage = {
+                    "prompt_tokens": length // 4,
+                    "completion_tokens": max(1, len(text) // 4),
+                    "total_tokens": length // 4 + max(1, len(text) // 4),
+                }
+                if request.get("stream"):
+                    self._send_stream(text, model, usage, request)
+                else:
+                    self._send_json(
+                        200,
+                        {
+                            "id": f"chatcmpl-{uuid.uuid4().hex}",
+                            "object": "chat.completion",
+                            "created": int(time.time()),
+                            "model": model,
+                            "choices": [
+                                {
+                                    "index": 0,
+                                    "message": {"role": "assistant", "content": text},
+                                    "finish_reason": "stop",
+                                }
+                            ],
+                            "usage": usage,
+                        },
+                    )
+
+            def _send_json(self, status, payload):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, text, model, usage, request):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+
+                completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+                def send(payload):
+                    line = f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+                    self.wfile.write(line.encode("utf-8"))
+                    self.wfile.flush()
+
+                chunk_size = 8
+                for start in range(0, len(text), chunk_size):
+                    send(
+                        {
+                            "id": completion_id,
+                            "object": "chat.completion.chunk",
+                            "created": int(time.time()),
+                            "model": model,
+                            "choices": [
+                                {
+                                    "index": 0,
+                                    "delta": {"content": text[start : start + chunk_size]},
+                                    "finish_reason": None,
+                                }
+                            ],
+                        }
+                    )
+                    if server.chunk_delay:
+                        time.sleep(server.chunk_delay)
+                if (request.get("stream_options") or {}).get("include_usage"):
+                    send(
+                        {
+                            "id": completion_id,
+                            "object": "chat.completion.chunk",
+                            "created": int(time.time()),
+                            "model": model,
+                            "choices": [],
+                            "usage": usage,
+                        }
+                    )
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动模拟的chat-completions服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--script", default=None, help="响应脚本（JSON数组或JSONL）")
+    parser.add_argument("--latency", type=float, default=0.0, help="固定延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="随机附加延迟上限（秒）")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="流式输出每块间隔（秒）")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="随机返回500的比例")
+    parser.add_argument(
+        "--model-latency",
+        default="{}",
+        help='按模型名指定的固定延迟（JSON），如 \'{"fast": 0.2, "strong": 1.0}\'',
+    )
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="长尾响应的比例")
+    parser.add_argument("--tail-latency", type=float, default=0.0, help="长尾响应的附加延迟（秒）")
+    parser.add_argument(
+        "--no-response-format",
+        action="store_true",
+        help="拒绝带response_format的请求（模拟不支持结构化输出的服务）",
+    )
+    args = parser.parse_args()
+
+    server = StubServer(
+        script=load_script(args.script) if args.script else None,
+        latency=args.latency,
+        jitter=args.jitter,
+        chunk_delay=args.chunk_delay,
+        host=args.host,
+        port=args.port,
+        fail_rate=args.fail_rate,
+        supports_response_format=not args.no_response_format,
+        tail_rate=args.tail_rate,
+        tail_latency=args.tail_latency,
+        model_latency=json.loads(args.model_latency),
+    )
+    print(f"模拟服务已启动: {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+截图后端
+统一的截图接口，在 screenshot_config.backend 中选择：
+- pyautogui: 原有实现（经过PIL，较慢）
+- mss: 基于mss的快速截图（Linux下走X11，可在Xvfb中使用）
+- replay: 回放磁盘上的PNG图片，用于测试和离线基准
+所有后端都支持 region=[left, top, width, height] 只截取屏幕的一部分
+"""
+
+import glob
+import os
+import threading
+
+import cv2
+import numpy as np
+
+from screen_diff import downscale_gray
+
+try:
+    import mss
+except ImportError:
+    mss = None
+
+
+class CaptureBackend:
+    """截图后端基类"""
+
+    name = "base"
+
+    def __init__(self, region=None):
+        # 截图区域 (left, top, width, height)，None表示整个屏幕
+        self.region = tuple(region) if region else None
+
+    @property
+    def origin(self):
+        """截图左上角在屏幕上的坐标"""
+        if self.region:
+            return self.region[0], self.region[1]
+        return 0, 0
+
+    def grab(self):
+        """
+        截图并返回BGR图像
+        每次返回新的数组：变化区域、稳定等待的基准、目标模板和轨迹都会跨截图持有帧
+        """
+        raise NotImplementedError
+
+    def grab_gray(self, max_edge=160):
+        """截取用于变化检测的灰度缩略图"""
+        return downscale_gray(self.grab(), max_edge)
+
+    def close(self):
+        pass
+
+
+class PyAutoGUIBackend(CaptureBackend):
+    """基于pyautogui.screenshot的截图（原有实现）"""
+
+    name = "pyautogui"
+
+    def __init__(self, region=None, screenshot=None):
+        super().__init__(region)
+        # 允许注入截图函数，默认在调用时解析，便于替换模块
+        self._screenshot = screenshot
+
+    def grab(self):
+        if self._screenshot is not None:
+            screenshot_func = self._screenshot
+        else:
+            import pyautogui
+
+            screenshot_func = pyautogui.screenshot
+        if self.region:
+            screenshot = screenshot_func(region=self.region)
+        else:
+            screenshot = screenshot_func()
+        return cv2.cvtColor(np.asarray(screenshot), cv2.COLOR_RGB2BGR)
+
+
+class MssBackend(CaptureBackend):
+    """
+    基于mss的快速截图
+    mss直接返回BGRA原始数据，转换为BGR时分配的数组即作为本帧的图像，不再额外复制
+    """
+
+    name = "mss"
+
+    def __init__(self, region=None, monitor=1):
+        if mss is None:
+            raise RuntimeError("未安装mss，无法使用mss截图后端（pip install mss）")
+        super().__init__(region)
+        self.monitor_index = monitor
+        # mss实例不能跨线程使用，每个线程各自创建
+        self._local = threading.local()
+
+    def _sct(self):
+        sct = getattr(self._local, "sct", None)
+        if sct is None:
+            sct = mss.mss()
+            self._local.sct = sct
+        return sct
+
+    def _monitor(self, sct):
+        if self.region:
+            left, top, width, height = self.region
+            return {"left": left, "top": top, "width": width, "height": height}
+        return sct.monitors[self.monitor_index]
+
+    @property
+    def origin(self):
+        if self.region:
+            return self.region[0], self.region[1]
+        monitor = self._sct().monitors[self.monitor_index]
+        return monitor["left"], monitor["top"]
+
+    def _grab_bgra(self):
+        sct = self._sct()
+        shot = sct.grab(self._monitor(sct))
+        return np.frombuffer(shot.raw, dtype=np.uint8).reshape(
+            shot.height, shot.width, 4
+        )
+
+    def grab(self):
+        return cv2.cvtColor(self._grab_bgra(), cv2.COLOR_BGRA2BGR)
+
+    def grab_gray(self, max_edge=160):
+        # 直接从BGRA转灰度，不经过全尺寸BGR缓冲区
+        gray = cv2.cvtColor(self._grab_bgra(), cv2.COLOR_BGRA2GRAY)
+        return downscale_gray(gray, max_edge)
+
+    def close(self):
+        sct = getattr(self._local, "sct", None)
+        if sct is not None:
+            sct.close()
+            self._local.sct = None
+
+
+class FileReplayBackend(CaptureBackend):
+    """
+    回放磁盘上的截图
+    advance="capture" 时每次grab切换到下一张；advance="manual" 时只在调用advance()后切换
+    """
+
+    name = "replay"
+
+    def __init__(self, path, region=None, advance="capture", loop=True):
+        super().__init__(region)
+        if os.path.isdir(path):
+            paths = sorted(glob.glob(os.path.join(path, "*.png")))
+        else:
+            paths = sorted(glob.glob(path))
+        if not paths:
+            raise ValueError(f"没有可回放的截图: {path}")
+        # 预先解码，避免把PNG解码时间计入截图耗时
+        self.images = [cv2.imread(p) for p in paths]
+        self.paths = paths
+        self.advance_mode = advance
+        self.loop = loop
+        self.index = 0
+        self.captures = 0
+        self._lock = threading.Lock()
+
+    @property
+    def origin(self):
+        # 回放时region只用于裁剪，坐标仍以图片为准
+        return 0, 0
+
+    def advance(self):
+        with self._lock:
+            if self.index + 1 < len(self.images) or self.loop:
+                self.index = (self.index + 1) % len(self.images)
+
+    def _current(self):
+        image = self.images[self.index]
+        if self.region:
+            left, top, width, height = self.region
+            image = image[top : top + height, left : left + width]
+        return image
+
+    def grab(self):
+        with self._lock:
+            self.captures += 1
+            image = self._current()
+        if self.advance_mode == "capture":
+            self.advance()
+        return image
+
+    def grab_gray(self, max_edge=160):
+        with self._lock:
+            image = self._current()
+        return downscale_gray(image, max_edge)
+
+
+def create_capture_backend(screenshot_config):
+    """根据screenshot_config创建截图后端"""
+    backend = screenshot_config.get("backend", "pyautogui")
+    region = screenshot_config.get("region")
+    if backend == "mss":
+        return MssBackend(region=region, monitor=screenshot_config.get("monitor", 1))
+    if backend == "replay":
+        return FileReplayBackend(
+            screenshot_config.get("replay_path", "imgs/label"),
+            region=region,
+            advance=screenshot_config.get("replay_advance", "capture"),
+        )
+    if backend != "pyautogui":
+        raise ValueError(f"未知的截图后端: {backend}")
+    return PyAutoGUIBackend(region=region)
@@ -3,13 +3,21 @@
 AI 智能控制系统 (命令行版本)
 """
 
+import asyncio
 import json
-import os
 import signal
 import sys
 import threading
 
-from vl_model_cli import auto_control_computer, set_coordinate_callback, set_config_path
+from vl_model_cli import (
+    AgentSession,
+    clear_action_cache,
+    clear_label_images,
+    get_artifact_writer,
+    set_config_path,
+    set_coordinate_callback,
+    set_stop_event,
+)
 
 # 全局控制变量
 running = False
@@ -17,8 +25,13 @@ stop_event = threading.Event()
 
 
 def signal_handler(signum, frame):
-    """信号处理器，用于优雅退出"""
+    """信号处理器：任务执行中按Ctrl+C只停止当前任务，其余情况退出程序"""
     global running
+    if running and signum == signal.SIGINT:
+        print("\n\n收到中断信号，正在停止AI执行...")
+        running = False
+        stop_event.set()
+        return
     print("\n\n收到退出信号，正在停止AI执行...")
     running = False
     stop_event.set()
@@ -49,9 +62,10 @@ def main():
     print("\n请选择要使用的模型配置：")
     print("1. 智谱 (zhipu)")
     print("2. 豆包 (doubao)")
+    print("3. 多服务对冲 (provider_config 中的多个服务)")
     
     while True:
-        choice = input("请输入选择 (1 或 2): ").strip()
+        choice = input("请输入选择 (1、2 或 3): ").strip()
         if choice == "1":
             config_path = "config_zhipu.json"
             print("已选择智谱配置")
@@ -60,31 +74,30 @@ def main():
             config_path = "config_doubao.json"
             print("已选择豆包配置")
             break
+        elif choice == "3":
+            config_path = "config_multi.json"
+            print("已选择多服务配置（首选服务超过p95耗时未返回时同时请求下一个服务）")
+            break
         else:
-            print("无效选择，请输入 1 或 2")
+            print("无效选择，请输入 1、2 或 3")
     
     # 设置配置路径
     set_config_path(config_path)
 
-    # 启动时清空label文件夹
-    label_dir = "imgs/label"
-    if os.path.exists(label_dir):
-        for file in os.listdir(label_dir):
-            if file.startswith("screen_label") and file.endswith(".png"):
-                file_path = os.path.join(label_dir, file)
-                try:
-                    os.remove(file_path)
-                    print(f"删除旧标记图片: {file}")
-                except Exception as e:
-                    print(f"删除文件失败 {file}: {e}")
-        print("已清空之前的标记图片")
-    else:
-        os.makedirs(label_dir, exist_ok=True)
-        print("创建label目录")
+    # 常驻会话：配置、系统提示和模型连接在多个任务之间复用
+    session = AgentSession(config_path)
+    # 常驻事件循环：异步客户端的连接在多个任务之间复用
+    loop = asyncio.new_event_loop()
+    # 停止事件置位时立即中止进行中的模型请求
+    set_stop_event(stop_event)
+
+    # 启动时在后台清空label文件夹（不可丢弃，保证先于新的标记图片执行）
+    get_artifact_writer().submit(clear_label_images, "imgs/label", droppable=False)
 
     print("\n使用说明:")
     print("- 输入您的需求，AI将自动控制电脑完成任务")
     print("- 输入 'quit' 或 'exit' 退出程序")
+    print("- 输入 'clear cache' 清空动作回放缓存")
     print("- 按 Ctrl+C 可以随时停止AI执行")
     print("-" * 50)
 
@@ -99,8 +112,14 @@ def main():
 
             if user_input.lower() in ["quit", "exit", "q"]:
                 print("程序退出")
+                loop.run_until_complete(session.aclose())
+                loop.close()
                 break
 
+            if user_input.lower() in ["clear cache", "清空缓存"]:
+                clear_action_cache()
+                continue
+
             # 开始AI执行
             print(f"\n开始执行任务: {user_input}")
             print("=" * 30)
@@ -108,30 +127,16 @@ def main():
             running = True
             stop_event.clear()
 
-            # 在新线程中执行AI控制
-            def run_ai():
-                global running
-                try:
-                    result = auto_control_computer(user_input)
-                    if running:
-                        print(f"\n任务完成: {result}")
-                except Exception as e:
-                    if running:
-                        print(f"\n执行错误: {e}")
-                finally:
-                    running = False
-
-            ai_thread = threading.Thread(target=run_ai, daemon=True)
-            ai_thread.start()
-
-            # 等待AI执行完成或用户中断
+            # 在事件循环中执行AI控制，Ctrl+C置位stop_event，进行中的模型请求会立即中止
             try:
-                while running and ai_thread.is_alive():
-                    ai_thread.join(timeout=0.1)
-            except KeyboardInterrupt:
-                print("\n用户中断执行")
+                result = loop.run_until_complete(session.run_task_async(user_input))
+                if running:
+                    print(f"\n任务完成: {result}")
+            except Exception as e:
+                if running:
+                    print(f"\n执行错误: {e}")
+            finally:
                 running = False
-                stop_event.set()
 
             print("=" * 30)
 
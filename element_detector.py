@@ -0,0 +1,162 @@
+"""
+界面元素检测
+用OpenCV（边缘、形态学、连通域）在内存中的截图上找出候选元素框，
+可在发送给模型的图片上绘制编号标记（set-of-marks），并把模型给出的坐标吸附到最近的元素中心
+检测结果按截图内容的哈希缓存，完全相同的画面不会重复检测
+"""
+
+import hashlib
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# 在图片上绘制元素编号时追加的系统提示
+MARKS_PROMPT = """
+
+## 元素编号
+
+截图上用红色方框和编号标出了检测到的界面元素。目标元素带有编号时，请在 action 中额外输出 mark 字段（该编号），系统会操作该元素的中心；没有合适编号时 mark 为 null，按 coordinates 操作。coordinates 仍需照常给出。
+"""
+
+
+def detect_elements(image, min_size=8, max_area_ratio=0.25, max_elements=60):
+    """
+    检测候选界面元素，返回按从上到下、从左到右排序的 [(x, y, w, h), ...]
+    min_size: 元素最小边长（像素）；max_area_ratio: 元素最大面积占整图比例
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    height, width = gray.shape[:2]
+
+    edges = cv2.Canny(gray, 50, 150)
+    # 横向闭运算把文字和图标的笔画连成块，再稍微膨胀合并相邻边缘
+    edges = cv2.morphologyEx(
+        edges, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (9, 3))
+    )
+    edges = cv2.dilate(edges, np.ones((3, 3), np.uint8))
+
+    count, _, stats, _ = cv2.connectedComponentsWithStats(edges, connectivity=8)
+    max_area = width * height * max_area_ratio
+    boxes = []
+    for index in range(1, count):
+        x, y, w, h, _ = stats[index]
+        if w < min_size or h < min_size or w * h > max_area:
+            continue
+        # 过细的线条（分隔线、边框）不是可点击元素
+        if w > 20 * h or h > 20 * w:
+            continue
+        boxes.append((int(x), int(y), int(w), int(h)))
+
+    boxes = _suppress_overlaps(boxes)
+    # 元素过多时优先保留面积较大的
+    if len(boxes) > max_elements:
+        boxes = sorted(boxes, key=lambda b: -b[2] * b[3])[:max_elements]
+    # 按行排序，行高容差为10像素
+    boxes.sort(key=lambda b: (b[1] // 10, b[0]))
+    return boxes
+
+
+def _suppress_overlaps(boxes, threshold=0.6):
+    """去掉与更大的框重叠超过threshold（相对较小框面积）的框"""
+    kept = []
+    for box in sorted(boxes, key=lambda b: -b[2] * b[3]):
+        x, y, w, h = box
+        overlapped = False
+        for kx, ky, kw, kh in kept:
+            ix = max(0, min(x + w, kx + kw) - max(x, kx))
+            iy = max(0, min(y + h, ky + kh) - max(y, ky))
+            if ix * iy > threshold * w * h:
+                overlapped = True
+                break
+        if not overlapped:
+            kept.append(box)
+    return kept
+
+
+def draw_marks(image, boxes, color=(0, 0, 255)):
+    """在图像副本上绘制元素框和编号（从1开始），返回标记后的图像"""
+    marked = image.copy()
+    for index, (x, y, w, h) in enumerate(boxes, start=1):
+        cv2.rectangle(marked, (x, y), (x + w, y + h), color, 1)
+        label = str(index)
+        (text_w, text_h), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.4, 1)
+        label_y = max(text_h + 2, y)
+        cv2.rectangle(
+            marked, (x, label_y - text_h - 2), (x + text_w + 2, label_y), color, -1
+        )
+        cv2.putText(
+            marked,
+            label,
+            (x + 1, label_y - 1),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.4,
+            (255, 255, 255),
+            1,
+            cv2.LINE_AA,
+        )
+    return marked
+
+
+def box_center(box):
+    x, y, w, h = box
+    return x + w / 2, y + h / 2
+
+
+def snap_to_element(x, y, boxes, max_distance=20, max_box_edge=120):
+    """
+    把坐标吸附到元素中心：优先选包含该点的最小元素，其次选距离不超过max_distance的最近元素
+    只考虑边长不超过max_box_edge的元素（窗口、面板等大区域的中心没有意义）
+    返回 (x, y, 元素编号)，没有合适元素时返回原坐标和None
+    """
+    candidates = [
+        (index, box)
+        for index, box in enumerate(boxes)
+        if max(box[2], box[3]) <= max_box_edge
+    ]
+    containing = [
+        (w * h, index)
+        for index, (bx, by, w, h) in candidates
+        if bx <= x <= bx + w and by <= y <= by + h
+    ]
+    if containing:
+        index = min(containing)[1]
+    else:
+        best = None
+        for index, box in candidates:
+            cx, cy = box_center(box)
+            distance = ((cx - x) ** 2 + (cy - y) ** 2) ** 0.5
+            if distance <= max_distance and (best is None or distance < best[0]):
+                best = (distance, index)
+        if best is None:
+            return x, y, None
+        index = best[1]
+    cx, cy = box_center(boxes[index])
+    return cx, cy, index + 1
+
+
+class ElementDetector:
+    """带LRU缓存的元素检测器，以截图内容的哈希和尺寸为键"""
+
+    def __init__(self, cache_size=32, **detect_options):
+        self.cache_size = cache_size
+        self.detect_options = detect_options
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def detect(self, image):
+        # 精确的内容哈希：感知哈希对新出现的小控件不敏感，会返回过期的元素框
+        image = np.ascontiguousarray(image)
+        key = (hashlib.blake2b(image.data, digest_size=16).digest(), image.shape)
+        boxes = self.cache.get(key)
+        if boxes is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return boxes
+
+        self.misses += 1
+        boxes = detect_elements(image, **self.detect_options)
+        self.cache[key] = boxes
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return boxes
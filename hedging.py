@@ -0,0 +1,481 @@
+"""
+多服务对冲请求
+同一个请求先发给排在首位的模型服务；超过该服务近期响应时间的p95仍未返回时，
+把相同请求发给下一个服务，取先返回的结果并取消其余请求；服务出错时立即转向下一个服务。
+每个服务的耗时和错误统计决定对冲阈值和服务的先后顺序
+
+HedgedClient / AsyncHedgedClient 提供与OpenAI客户端相同的 chat.completions.create 接口，
+流式请求以收到响应头（返回流对象）的时间计算耗时
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import httpx
+from openai import (
+    APIStatusError,
+    AsyncOpenAI,
+    DefaultAsyncHttpxClient,
+    DefaultHttpxClient,
+    OpenAI,
+)
+
+from metrics import percentile
+
+# 请求本身有问题时各服务都会拒绝，不转向其他服务（超时、冲突和限流除外）
+RETRYABLE_STATUS = {408, 409, 429}
+
+
+def is_retryable(error):
+    """服务端错误、连接错误和超时可以转向其他服务"""
+    if isinstance(error, APIStatusError):
+        return error.status_code >= 500 or error.status_code in RETRYABLE_STATUS
+    return True
+
+
+def provider_list(config):
+    """
+    返回配置中的模型服务列表
+    启用provider_config时每个服务未填写的字段继承api_config，否则只有api_config一个服务；
+    服务的models把请求中的模型名映射为该服务的模型名，api_config的模型名映射为服务的model_name
+    """
+    api_config = config["api_config"]
+    provider_config = config.get("provider_config", {})
+    if not provider_config.get("enabled", False) or not provider_config.get("providers"):
+        return [dict(api_config, name=api_config.get("name", "default"))]
+    providers = []
+    for index, provider in enumerate(provider_config["providers"]):
+        provider = dict(api_config, **provider)
+        provider.setdefault("name", f"provider-{index}")
+        provider["models"] = {
+            api_config.get("model_name"): provider.get("model_name"),
+            **provider.get("models", {}),
+        }
+        providers.append(provider)
+    return providers
+
+
+def _http_limits(provider):
+    return httpx.Limits(
+        max_connections=10,
+        max_keepalive_connections=4,
+        keepalive_expiry=provider.get("keepalive_expiry", 120),
+    )
+
+
+def make_client(provider, max_retries=2):
+    return OpenAI(
+        api_key=provider["api_key"],
+        base_url=provider["base_url"],
+        max_retries=provider.get("max_retries", max_retries),
+        http_client=DefaultHttpxClient(limits=_http_limits(provider)),
+    )
+
+
+def make_async_client(provider, max_retries=2):
+    return AsyncOpenAI(
+        api_key=provider["api_key"],
+        base_url=provider["base_url"],
+        max_retries=provider.get("max_retries", max_retries),
+        http_client=DefaultAsyncHttpxClient(limits=_http_limits(provider)),
+    )
+
+
+class ProviderStats:
+    """单个模型服务最近window次请求的耗时和结果"""
+
+    def __init__(self, name, index, window=50):
+        self.name = name
+        # 配置中的顺序，统计相同时按它排序
+        self.index = index
+        self.latencies = deque(maxlen=window)
+        # 最近请求是否成功
+        self.outcomes = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        # 作为对冲请求发出的次数、先返回的次数、被取消的次数
+        self.hedges = 0
+        self.wins = 0
+        self.cancelled = 0
+        self.consecutive_errors = 0
+        self.cooldown_until = 0.0
+
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return 1 - sum(self.outcomes) / len(self.outcomes)
+
+    def expected_latency(self):
+        """按重试次数折算的中位耗时；没有样本时返回None"""
+        if not self.latencies:
+            return None
+        return percentile(self.latencies, 0.5) / max(0.05, 1 - self.error_rate())
+
+    def summary(self):
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "hedges": self.hedges,
+            "wins": self.wins,
+            "cancelled": self.cancelled,
+            "error_rate": round(self.error_rate(), 3),
+            "p50": round(percentile(self.latencies, 0.5), 4),
+            "p95": round(percentile(self.latencies, 0.95), 4),
+        }
+
+
+class ProviderPool:
+    """多个模型服务的统计、排序和对冲阈值，同步和异步客户端共用"""
+
+    def __init__(
+        self,
+        providers,
+        quantile=0.95,
+        min_delay=0.2,
+        max_delay=10.0,
+        initial_delay=3.0,
+        min_samples=5,
+        window=50,
+        max_consecutive_errors=3,
+        cooldown=30.0,
+        log=print,
+    ):
+        self.providers = providers
+        # 对冲阈值取首选服务耗时的该分位数，限制在[min_delay, max_delay]内
+        self.quantile = quantile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        # 样本数不足min_samples时使用的阈值
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        # 连续出错达到该次数的服务在cooldown秒内排到最后
+        self.max_consecutive_errors = max_consecutive_errors
+        self.cooldown = cooldown
+        self.log = log
+        self.stats = {
+            provider["name"]: ProviderStats(provider["name"], index, window)
+            for index, provider in enumerate(providers)
+        }
+        self._lock = threading.Lock()
+
+    def ranked(self):
+        """
+        本次请求的服务顺序
+        首选服务为配置中第一个不在冷却中的服务（保持连接和计费稳定）；其余服务按折算耗时排序，
+        没有样本的服务保持配置顺序排在有样本的服务之后；冷却中的服务排在最后，冷却结束后恢复原位
+        """
+        now = time.monotonic()
+        with self._lock:
+            cooling = [
+                provider
+                for provider in self.providers
+                if self.stats[provider["name"]].cooldown_until > now
+            ]
+            healthy = [provider for provider in self.providers if provider not in cooling]
+
+            def key(provider):
+                stats = self.stats[provider["name"]]
+                expected = stats.expected_latency()
+                return (expected is None, expected or 0.0, stats.index)
+
+            cooling.sort(key=lambda provider: self.stats[provider["name"]].cooldown_until)
+            return healthy[:1] + sorted(healthy[1:], key=key) + cooling
+
+    def hedge_delay(self, provider):
+        """等待该服务多久后发出对冲请求"""
+        with self._lock:
+            latencies = self.stats[provider["name"]].latencies
+            if len(latencies) < self.min_samples:
+                return self.initial_delay
+            delay = percentile(latencies, self.quantile)
+        return min(self.max_delay, max(self.min_delay, delay))
+
+    def record_launch(self, provider, hedge):
+        with self._lock:
+            stats = self.stats[provider["name"]]
+            stats.requests += 1
+            if hedge:
+                stats.hedges += 1
+
+    def record_success(self, provider, latency, raced):
+        with self._lock:
+            stats = self.stats[provider["name"]]
+            stats.latencies.append(latency)
+            stats.outcomes.append(True)
+            stats.consecutive_errors = 0
+            stats.cooldown_until = 0.0
+            if raced:
+                stats.wins += 1
+
+    def record_error(self, provider, error):
+        with self._lock:
+            stats = self.stats[provider["name"]]
+            stats.errors += 1
+            stats.outcomes.append(False)
+            stats.consecutive_errors += 1
+            cooling = stats.consecutive_errors >= self.max_consecutive_errors
+            if cooling:
+                stats.cooldown_until = time.monotonic() + self.cooldown
+        self.log(f"⚠️  模型服务 {provider['name']} 请求失败: {error}")
+        if cooling:
+            self.log(f"🧊 模型服务 {provider['name']} 连续失败，{self.cooldown:.0f}s 内排到最后")
+
+    def record_cancel(self, provider, elapsed, outpaced):
+        """
+        请求被取消；outpaced为True（比先返回的请求发出得早）时它至少耗时elapsed，
+        作为耗时样本记录（只记录先返回的请求会低估慢服务的尾部耗时）
+        """
+        with self._lock:
+            stats = self.stats[provider["name"]]
+            stats.cancelled += 1
+            if outpaced:
+                stats.latencies.append(elapsed)
+
+    def summary(self):
+        with self._lock:
+            return {name: stats.summary() for name, stats in self.stats.items()}
+
+
+def create_pool(config, log=print):
+    """按provider_config创建服务池"""
+    provider_config = config.get("provider_config", {})
+    return ProviderPool(
+        provider_list(config),
+        quantile=provider_config.get("hedge_quantile", 0.95),
+        min_delay=provider_config.get("hedge_min_delay", 0.2),
+        max_delay=provider_config.get("hedge_max_delay", 10.0),
+        initial_delay=provider_config.get("hedge_initial_delay", 3.0),
+        min_samples=provider_config.get("min_samples", 5),
+        window=provider_config.get("window", 50),
+        max_consecutive_errors=provider_config.get("max_consecutive_errors", 3),
+        cooldown=provider_config.get("cooldown", 30.0),
+        log=log,
+    )
+
+
+class _HedgePlan:
+    """一次请求的发送顺序和对冲计时"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.order = pool.ranked()
+        self.primary = self.order[0]
+        self.next_index = 0
+        self.last_launch = None
+        # 是否有多个请求同时进行过（先返回的服务记为胜出）
+        self.raced = False
+
+    def has_next(self):
+        return self.next_index < len(self.order)
+
+    def launch(self, hedge=False):
+        provider = self.order[self.next_index]
+        self.next_index += 1
+        self.last_launch = time.monotonic()
+        self.pool.record_launch(provider, hedge)
+        if hedge:
+            self.raced = True
+            self.pool.log(
+                f"🔀 {self.primary['name']} 超过 "
+                f"{self.pool.hedge_delay(self.primary):.2f}s 未返回，同时请求 {provider['name']}"
+            )
+        return provider, self.last_launch
+
+    def timeout(self):
+        """距离下一次对冲的秒数，没有可用的服务时返回None（一直等待）"""
+        if not self.has_next():
+            return None
+        delay = self.pool.hedge_delay(self.primary)
+        return max(0.0, self.last_launch + delay - time.monotonic())
+
+
+def _request_options(provider, options):
+    """各服务使用自己的模型名（未映射的模型名原样发送）"""
+    model = provider.get("models", {}).get(options.get("model"))
+    if model:
+        options = dict(options, model=model)
+    return options
+
+
+class _Completions:
+    def __init__(self, create):
+        self.create = create
+
+
+class _Chat:
+    def __init__(self, create):
+        self.completions = _Completions(create)
+
+
+class HedgedClient:
+    """
+    同步对冲客户端
+    同步请求无法中途中止：被取消的请求在后台线程中继续到返回为止，结果被丢弃（流式响应会被关闭）
+    各服务的客户端默认不自动重试（max_retries=0），出错时直接转向下一个服务
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.clients = {
+            provider["name"]: make_client(provider, max_retries=0)
+            for provider in pool.providers
+        }
+        self.chat = _Chat(self._create)
+        self._executor = ThreadPoolExecutor(
+            max_workers=2 * len(self.clients), thread_name_prefix="hedged-request"
+        )
+
+    def _call(self, provider, options):
+        return self.clients[provider["name"]].chat.completions.create(
+            **_request_options(provider, options)
+        )
+
+    def _create(self, **options):
+        plan = _HedgePlan(self.pool)
+        pending = {}
+
+        def launch(hedge=False):
+            provider, started = plan.launch(hedge)
+            pending[self._executor.submit(self._call, provider, options)] = (
+                provider,
+                started,
+            )
+
+        launch()
+        last_error = None
+        # 没有请求成功（出错或外层被取消）时不记录被取消请求的耗时
+        winner_started = float("-inf")
+        try:
+            while pending:
+                done, _ = wait(pending, timeout=plan.timeout(), return_when=FIRST_COMPLETED)
+                if not done:
+                    launch(hedge=True)
+                    continue
+                for future in done:
+                    provider, started = pending.pop(future)
+                    try:
+                        response = future.result()
+                    except Exception as e:
+                        if not is_retryable(e):
+                            raise
+                        self.pool.record_error(provider, e)
+                        last_error = e
+                        # 出错时不等对冲阈值，立即转向下一个服务
+                        if plan.has_next():
+                            launch()
+                        continue
+                    self.pool.record_success(
+                        provider, time.monotonic() - started, plan.raced
+                    )
+                    winner_started = started
+                    return response
+            raise last_error
+        finally:
+            self._abandon(pending, winner_started)
+
+    def _abandon(self, pending, winner_started):
+        now = time.monotonic()
+        for future, (provider, started) in pending.items():
+            self.pool.record_cancel(provider, now - started, started < winner_started)
+            if not future.cancel():
+                future.add_done_callback(_close_result)
+        pending.clear()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        for client in self.clients.values():
+            client.close()
+
+
+def _close_result(future):
+    """关闭被放弃的请求返回的流式响应"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    close = getattr(future.result(), "close", None)
+    if close is not None:
+        close()
+
+
+class AsyncHedgedClient:
+    """异步对冲客户端，被取消的请求会立即中止HTTP连接"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.clients = {
+            provider["name"]: make_async_client(provider, max_retries=0)
+            for provider in pool.providers
+        }
+        self.chat = _Chat(self._create)
+
+    async def _call(self, provider, options):
+        return await self.clients[provider["name"]].chat.completions.create(
+            **_request_options(provider, options)
+        )
+
+    async def _create(self, **options):
+        plan = _HedgePlan(self.pool)
+        pending = {}
+
+        def launch(hedge=False):
+            provider, started = plan.launch(hedge)
+            pending[asyncio.ensure_future(self._call(provider, options))] = (
+                provider,
+                started,
+            )
+
+        launch()
+        last_error = None
+        # 没有请求成功（出错或外层被取消）时不记录被取消请求的耗时
+        winner_started = float("-inf")
+        try:
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending, timeout=plan.timeout(), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    launch(hedge=True)
+                    continue
+                for task in done:
+                    provider, started = pending.pop(task)
+                    try:
+                        response = task.result()
+                    except Exception as e:
+                        if not is_retryable(e):
+                            raise
+                        self.pool.record_error(provider, e)
+                        last_error = e
+                        if plan.has_next():
+                            launch()
+                        continue
+                    self.pool.record_success(
+                        provider, time.monotonic() - started, plan.raced
+                    )
+                    winner_started = started
+                    # 同时完成的其他请求返回的流式响应需要关闭
+                    for other in done:
+                        if other in pending:
+                            pending.pop(other)
+                            await _aclose_result(other)
+                    return response
+            raise last_error
+        finally:
+            # 外层被取消（任务停止）时也会中止全部请求
+            now = time.monotonic()
+            for task, (provider, started) in pending.items():
+                self.pool.record_cancel(provider, now - started, started < winner_started)
+                task.cancel()
+
+    async def close(self):
+        for client in self.clients.values():
+            await client.close()
+
+
+async def _aclose_result(task):
+    if task.cancelled() or task.exception() is not None:
+        return
+    close = getattr(task.result(), "close", None)
+    if close is not None:
+        await close()
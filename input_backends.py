@@ -0,0 +1,329 @@
+"""
+键鼠输入后端
+统一的输入接口，在 input_config.backend 中选择：
+- pyautogui: 实际操作鼠标键盘
+- record: 实际操作的同时记录每个动作
+- dry_run: 只记录动作，不操作系统（调试提示词、离线基准）
+操作之间的等待由时间配置（timing_profile）决定：human / fast / instant，默认human（与原有实现一致）
+文本默认经剪贴板粘贴；direct_typing开启时短的ASCII文本直接键入，
+开启中文输入法时键入会被输入法截获，因此默认关闭，确认没有输入法干扰时再开启
+"""
+
+import importlib
+import json
+import os
+import platform
+import time
+from collections import Counter, deque
+
+# 各时间配置下的等待时长（秒）
+# move/drag: 鼠标移动和拖拽的动画时长；pause: pyautogui每次调用后的停顿
+# before_type: 点击后输入前的等待；paste: 复制到剪贴板后到粘贴前的等待
+# mac_key: macOS粘贴时按键之间的等待；after_type: 输入后按回车前的等待
+# type_interval: 直接键入时每个字符的间隔
+TIMING_PROFILES = {
+    # 与原有实现一致
+    "human": {
+        "move_duration": 0.1,
+        "drag_duration": 1.0,
+        "pause": 0.1,
+        "before_type": 0.2,
+        "paste": 0.1,
+        "mac_key": 0.1,
+        "after_type": 0.5,
+        "type_interval": 0.0,
+    },
+    "fast": {
+        "move_duration": 0.0,
+        "drag_duration": 0.2,
+        "pause": 0.01,
+        "before_type": 0.05,
+        "paste": 0.02,
+        "mac_key": 0.02,
+        "after_type": 0.1,
+        "type_interval": 0.0,
+    },
+    "instant": {
+        "move_duration": 0.0,
+        "drag_duration": 0.0,
+        "pause": 0.0,
+        "before_type": 0.0,
+        "paste": 0.0,
+        "mac_key": 0.0,
+        "after_type": 0.0,
+        "type_interval": 0.0,
+    },
+}
+
+
+def build_timing(profile="human", overrides=None):
+    """返回时间配置，overrides中非None的值覆盖配置中的默认值"""
+    if profile not in TIMING_PROFILES:
+        raise ValueError(f"未知的时间配置: {profile}")
+    timing = dict(TIMING_PROFILES[profile])
+    for key, value in (overrides or {}).items():
+        if value is not None:
+            timing[key] = value
+    return timing
+
+
+def can_type_directly(text, max_chars=32):
+    """短的可打印ASCII文本可以直接键入，不经过剪贴板"""
+    return 0 < len(text) <= max_chars and text.isascii() and text.isprintable()
+
+
+class InputBackend:
+    """输入后端基类"""
+
+    name = "base"
+
+    def __init__(self, timing=None):
+        self.timing = timing or build_timing()
+
+    def wait(self, name):
+        """按时间配置等待"""
+        seconds = self.timing.get(name, 0)
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def move_to(self, x, y, duration=None):
+        raise NotImplementedError
+
+    def drag_to(self, x, y, duration=None):
+        raise NotImplementedError
+
+    def click(self):
+        raise NotImplementedError
+
+    def double_click(self):
+        raise NotImplementedError
+
+    def right_click(self):
+        raise NotImplementedError
+
+    def mouse_down(self):
+        raise NotImplementedError
+
+    def scroll(self, amount):
+        raise NotImplementedError
+
+    def hotkey(self, *keys):
+        raise NotImplementedError
+
+    def press(self, key):
+        raise NotImplementedError
+
+    def type_text(self, text):
+        """输入文本，返回实际使用的方式（"type"或"paste"）"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class PyAutoGUIInputBackend(InputBackend):
+    """通过pyautogui操作鼠标键盘，长文本或非ASCII文本经剪贴板粘贴"""
+
+    name = "pyautogui"
+
+    def __init__(
+        self,
+        timing=None,
+        failsafe=False,
+        direct_typing=False,
+        direct_typing_max_chars=32,
+        gui=None,
+        clipboard=None,
+    ):
+        super().__init__(timing)
+        self.failsafe = failsafe
+        # 短ASCII文本是否直接键入（默认关闭：开启中文输入法时键入会被输入法截获）
+        self.direct_typing = direct_typing
+        self.direct_typing_max_chars = direct_typing_max_chars
+        # 允许注入模块，默认在调用时导入（无图形界面时导入会失败）
+        self._gui_module = gui
+        self._clipboard_module = clipboard
+
+    def _gui(self):
+        gui = self._gui_module or importlib.import_module("pyautogui")
+        gui.PAUSE = self.timing["pause"]
+        gui.FAILSAFE = self.failsafe
+        return gui
+
+    def _clipboard(self):
+        return self._clipboard_module or importlib.import_module("pyperclip")
+
+    def move_to(self, x, y, duration=None):
+        if duration is None:
+            duration = self.timing["move_duration"]
+        self._gui().moveTo(x, y, duration=duration)
+
+    def drag_to(self, x, y, duration=None):
+        if duration is None:
+            duration = self.timing["drag_duration"]
+        self._gui().dragTo(x, y, duration=duration)
+
+    def click(self):
+        self._gui().click()
+
+    def double_click(self):
+        self._gui().doubleClick()
+
+    def right_click(self):
+        self._gui().rightClick()
+
+    def mouse_down(self):
+        self._gui().mouseDown()
+
+    def scroll(self, amount):
+        self._gui().scroll(amount)
+
+    def hotkey(self, *keys):
+        self._gui().hotkey(*keys)
+
+    def press(self, key):
+        self._gui().press(key)
+
+    def type_text(self, text):
+        gui = self._gui()
+        if self.direct_typing and can_type_directly(
+            text, self.direct_typing_max_chars
+        ):
+            gui.write(text, interval=self.timing["type_interval"])
+            return "type"
+
+        self._clipboard().copy(text)
+        self.wait("paste")
+        if platform.system() == "Darwin":
+            # macOS上使用更可靠的粘贴方法
+            gui.keyDown("command")
+            self.wait("mac_key")
+            gui.press("v")
+            self.wait("mac_key")
+            gui.keyUp("command")
+        else:
+            gui.hotkey("ctrl", "v")
+        return "paste"
+
+
+class RecordingInputBackend(InputBackend):
+    """
+    记录每个输入动作
+    inner为None时只记录不执行（dry-run），否则记录后交给inner执行
+    listener 在每个动作后以动作名调用，可用于驱动模拟屏幕
+    """
+
+    name = "dry_run"
+
+    def __init__(
+        self, inner=None, timing=None, record_path=None, max_records=1000, log=print
+    ):
+        if timing is None:
+            timing = inner.timing if inner is not None else build_timing("instant")
+        super().__init__(timing)
+        self.inner = inner
+        if inner is not None:
+            self.name = "record"
+        self.record_path = record_path
+        self.records = deque(maxlen=max_records)
+        self.counts = Counter()
+        self.listener = None
+        self.log = log
+        self._file = None
+
+    def _record(self, action, **fields):
+        record = {"time": time.time(), "action": action, **fields}
+        self.records.append(record)
+        self.counts[action] += 1
+        if self.inner is None:
+            self.log(f"🧪 [dry-run] {action} {fields if fields else ''}".rstrip())
+        if self.record_path:
+            if self._file is None:
+                output_dir = os.path.dirname(self.record_path)
+                if output_dir:
+                    os.makedirs(output_dir, exist_ok=True)
+                self._file = open(self.record_path, "a", encoding="utf-8")
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def _forward(self, action, *args, **fields):
+        self._record(action, **fields)
+        result = None
+        if self.inner is not None:
+            result = getattr(self.inner, action)(*args)
+        if self.listener is not None:
+            self.listener(action)
+        return result
+
+    def wait(self, name):
+        # dry-run时不真正等待
+        if self.inner is not None:
+            super().wait(name)
+
+    def move_to(self, x, y, duration=None):
+        self._forward("move_to", x, y, duration, x=x, y=y)
+
+    def drag_to(self, x, y, duration=None):
+        self._forward("drag_to", x, y, duration, x=x, y=y)
+
+    def click(self):
+        self._forward("click")
+
+    def double_click(self):
+        self._forward("double_click")
+
+    def right_click(self):
+        self._forward("right_click")
+
+    def mouse_down(self):
+        self._forward("mouse_down")
+
+    def scroll(self, amount):
+        self._forward("scroll", amount, amount=amount)
+
+    def hotkey(self, *keys):
+        self._forward("hotkey", *keys, keys=list(keys))
+
+    def press(self, key):
+        self._forward("press", key, key=key)
+
+    def type_text(self, text):
+        method = self._forward("type_text", text, text=text)
+        return method or "type"
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def create_input_backend(config, log=print):
+    """根据input_config和mouse_config创建输入后端"""
+    input_config = config.get("input_config", {})
+    mouse_config = config.get("mouse_config", {})
+    timing = build_timing(
+        input_config.get("timing_profile", "human"),
+        {
+            "move_duration": mouse_config.get("move_duration"),
+            "drag_duration": mouse_config.get("drag_duration"),
+        },
+    )
+    backend = input_config.get("backend", "pyautogui")
+    if backend == "dry_run":
+        return RecordingInputBackend(
+            timing=timing, record_path=input_config.get("record_path"), log=log
+        )
+    if backend not in ("pyautogui", "record"):
+        raise ValueError(f"未知的输入后端: {backend}")
+
+    gui_backend = PyAutoGUIInputBackend(
+        timing=timing,
+        failsafe=mouse_config.get("failsafe", False),
+        direct_typing=input_config.get("direct_typing", False),
+        direct_typing_max_chars=input_config.get("direct_typing_max_chars", 32),
+    )
+    if backend == "record":
+        return RecordingInputBackend(
+            inner=gui_backend, record_path=input_config.get("record_path"), log=log
+        )
+    return gui_backend
@@ -0,0 +1,204 @@
+"""
+分阶段耗时统计
+记录每次迭代中截图、缩放、编码、模型调用、解析、执行等阶段的耗时，
+输出JSONL明细以及每个任务结束时的p50/p95汇总（Prometheus文本格式）
+未启用时 span() 返回共享的空上下文，几乎没有额外开销
+"""
+
+import contextlib
+import json
+import math
+import os
+import time
+from collections import defaultdict
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+def percentile(values, q):
+    """最近秩法计算分位数，values为空时返回0"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, math.ceil(q * len(ordered)) - 1)
+    return ordered[index]
+
+
+def _escape_label(value):
+    """转义Prometheus标签值中的特殊字符"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Span:
+    """记录单个阶段耗时的上下文管理器"""
+
+    __slots__ = ("recorder", "name", "start")
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.recorder.add_duration(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class SpanRecorder:
+    """按迭代收集各阶段耗时和计数"""
+
+    def __init__(self, enabled=False, jsonl_path=None, labels=None):
+        self.enabled = enabled
+        self.jsonl_path = jsonl_path
+        self.labels = labels or {}
+        # 阶段名 -> 每次迭代的耗时列表
+        self.samples = defaultdict(list)
+        # 计数类指标（token数、请求字节数等）的累计值
+        self.totals = defaultdict(float)
+        self._step = None
+        self._file = None
+
+    def span(self, name):
+        """返回记录name阶段耗时的上下文管理器"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def add_duration(self, name, seconds):
+        if self._step is not None:
+            spans = self._step["spans"]
+            spans[name] = spans.get(name, 0.0) + seconds
+        else:
+            self.samples[name].append(seconds)
+
+    def add(self, name, value):
+        """累加计数类指标"""
+        if not self.enabled or value is None:
+            return
+        self.totals[name] += value
+        if self._step is not None:
+            self._step[name] = self._step.get(name, 0) + value
+
+    def start_step(self, iteration):
+        if not self.enabled:
+            return
+        self._step = {"iteration": iteration, "spans": {}}
+
+    def current_spans(self):
+        """当前迭代中已记录的各阶段耗时（未启用或不在迭代中时为空）"""
+        if self._step is None:
+            return {}
+        return {name: round(value, 6) for name, value in self._step["spans"].items()}
+
+    def end_step(self, **fields):
+        """结束当前迭代，写入一行JSONL明细"""
+        if not self.enabled or self._step is None:
+            return
+        step, self._step = self._step, None
+        step.update(fields)
+        for name, seconds in step["spans"].items():
+            self.samples[name].append(seconds)
+        step["spans"] = {
+            name: round(value, 6) for name, value in step["spans"].items()
+        }
+        self._write(dict(self.labels, type="step", **step))
+
+    def merge(self, samples, totals):
+        """并入其他记录器（如其他进程）的耗时样本和计数"""
+        for name, values in samples.items():
+            self.samples[name].extend(values)
+        for name, value in totals.items():
+            self.totals[name] += value
+
+    def summary(self):
+        """各阶段的次数、总耗时、p50、p95"""
+        return {
+            name: {
+                "count": len(values),
+                "total": sum(values),
+                "p50": percentile(values, 0.5),
+                "p95": percentile(values, 0.95),
+            }
+            for name, values in self.samples.items()
+        }
+
+    def prometheus_text(self, prefix="cli_vision"):
+        """Prometheus文本格式的汇总"""
+        label_text = "".join(
+            f',{key}="{_escape_label(value)}"' for key, value in self.labels.items()
+        )
+        lines = [f"# TYPE {prefix}_stage_seconds summary"]
+        for name, stats in sorted(self.summary().items()):
+            stage = f'stage="{name}"{label_text}'
+            lines.append(
+                f'{prefix}_stage_seconds{{{stage},quantile="0.5"}} {stats["p50"]:.6f}'
+            )
+            lines.append(
+                f'{prefix}_stage_seconds{{{stage},quantile="0.95"}} {stats["p95"]:.6f}'
+            )
+            lines.append(f"{prefix}_stage_seconds_sum{{{stage}}} {stats['total']:.6f}")
+            lines.append(f"{prefix}_stage_seconds_count{{{stage}}} {stats['count']}")
+        counter_labels = "{" + label_text.lstrip(",") + "}" if label_text else ""
+        for name, value in sorted(self.totals.items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total{counter_labels} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def format_summary(self):
+        """便于打印的汇总表"""
+        lines = [f"{'阶段':<20}{'次数':>6}{'p50(ms)':>10}{'p95(ms)':>10}{'总计(s)':>10}"]
+        for name, stats in sorted(
+            self.summary().items(), key=lambda item: -item[1]["total"]
+        ):
+            lines.append(
+                f"{name:<20}{stats['count']:>6}{stats['p50'] * 1000:>10.1f}"
+                f"{stats['p95'] * 1000:>10.1f}{stats['total']:>10.2f}"
+            )
+        for name, value in sorted(self.totals.items()):
+            lines.append(f"{name}: {value:g}")
+        return "\n".join(lines)
+
+    def finish(self, summary_path=None, **fields):
+        """任务结束：写入汇总行，可选写出Prometheus文本文件"""
+        if not self.enabled:
+            return
+        self._write(
+            dict(
+                self.labels,
+                type="summary",
+                stages=self.summary(),
+                totals=dict(self.totals),
+                **fields,
+            )
+        )
+        if summary_path:
+            output_dir = os.path.dirname(summary_path)
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+            with open(summary_path, "w", encoding="utf-8") as f:
+                f.write(self.prometheus_text())
+        self.close()
+
+    def _write(self, record):
+        if not self.jsonl_path:
+            return
+        if self._file is None:
+            output_dir = os.path.dirname(self.jsonl_path)
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+            self._file = open(self.jsonl_path, "a", encoding="utf-8")
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+# 未启用统计时使用的共享实例
+NULL_RECORDER = SpanRecorder(enabled=False)
@@ -0,0 +1,127 @@
+"""
+分层模型路由
+默认使用最快（最便宜）的模型层级；任务第一步、上一步响应无法解析、最近响应重复、
+或上一步操作后屏幕没有变化时升级到更强的层级，之后连续成功若干步再逐级降回。
+各层级的调用次数、升级原因和单步耗时按会话统计
+"""
+
+import re
+import threading
+from collections import Counter, deque
+
+from metrics import percentile
+
+# 升级原因（日志用）
+REASON_TEXT = {
+    "first_step": "首步",
+    "parse_failure": "响应无法解析",
+    "repetition": "响应重复",
+    "no_change": "操作后屏幕未变化",
+}
+
+
+class ModelRouter:
+    """
+    tiers 按能力从弱到强排列，每项为 {"name", "model_name", 可选 "max_tokens"}
+    任务级的当前层级保存在TaskState中，路由器只保存配置和统计
+    """
+
+    def __init__(
+        self,
+        tiers,
+        first_step=True,
+        parse_failure=True,
+        repetition=True,
+        no_change=True,
+        deescalate_after=1,
+        window=200,
+    ):
+        self.tiers = tiers
+        # 各升级条件是否启用
+        self.enabled_reasons = {
+            name
+            for name, enabled in (
+                ("first_step", first_step),
+                ("parse_failure", parse_failure),
+                ("repetition", repetition),
+                ("no_change", no_change),
+            )
+            if enabled
+        }
+        # 升级后连续成功多少步降回一级
+        self.deescalate_after = deescalate_after
+        self.steps = Counter()
+        self.escalations = Counter()
+        self.latencies = {tier["name"]: deque(maxlen=window) for tier in tiers}
+        self._lock = threading.Lock()
+
+    @property
+    def top(self):
+        return len(self.tiers) - 1
+
+    def select(self, task, reasons):
+        """
+        根据本步的升级原因更新任务的层级并返回本步使用的层级
+        没有升级原因说明上一步成功：连续成功deescalate_after步后降一级
+        """
+        reasons = [reason for reason in reasons if reason in self.enabled_reasons]
+        level = task.route_level
+        if reasons:
+            # 首步直接使用最强的层级，其余情况逐级升级
+            level = self.top if "first_step" in reasons else min(self.top, level + 1)
+            task.route_successes = 0
+        elif level > 0:
+            task.route_successes += 1
+            if task.route_successes >= self.deescalate_after:
+                level -= 1
+                task.route_successes = 0
+        task.route_level = level
+        tier = self.tiers[level]
+        with self._lock:
+            self.steps[tier["name"]] += 1
+            for reason in reasons:
+                self.escalations[reason] += 1
+        return tier, reasons
+
+    def record_latency(self, tier_name, latency):
+        with self._lock:
+            self.latencies[tier_name].append(latency)
+
+    def summary(self):
+        """{"tiers": {层级: {steps, p50, p95}}, "escalations": {原因: 次数}}"""
+        with self._lock:
+            return {
+                "tiers": {
+                    tier["name"]: {
+                        "steps": self.steps[tier["name"]],
+                        "p50": round(percentile(self.latencies[tier["name"]], 0.5), 4),
+                        "p95": round(percentile(self.latencies[tier["name"]], 0.95), 4),
+                    }
+                    for tier in self.tiers
+                },
+                "escalations": dict(self.escalations),
+            }
+
+
+def metric_name(tier_name):
+    """层级名转换为可用作指标名的形式"""
+    return re.sub(r"\W", "_", tier_name)
+
+
+def create_router(config):
+    """按routing_config创建路由器，未启用或层级少于两个时返回None"""
+    routing_config = config.get("routing_config", {})
+    tiers = routing_config.get("tiers", [])
+    if not routing_config.get("enabled", False) or len(tiers) < 2:
+        return None
+    tiers = [
+        dict(tier, name=tier.get("name") or tier["model_name"]) for tier in tiers
+    ]
+    return ModelRouter(
+        tiers,
+        first_step=routing_config.get("escalate_first_step", True),
+        parse_failure=routing_config.get("escalate_on_parse_failure", True),
+        repetition=routing_config.get("escalate_on_repetition", True),
+        no_change=routing_config.get("escalate_on_no_change", True),
+        deescalate_after=routing_config.get("deescalate_after", 1),
+    )
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+并行任务执行
+启动N个工作进程（spawn），每个进程通过DISPLAY绑定到自己的X显示（可由本程序启动Xvfb），
+使用独立的配置、产物目录和会话状态；任务从共享队列分发，结果由主进程统一追加写入结果JSONL，
+各进程的耗时统计汇总后输出。每个智能体大部分时间在等待模型响应，吞吐随进程数近似线性增长
+
+任务文件格式与 batch_runner 相同，已有结果的任务会被跳过（可断点续跑）
+
+用法:
+    python parallel_runner.py --config config.json --tasks tasks.jsonl \\
+        --results results.jsonl --workers 4 --xvfb
+"""
+
+import argparse
+import copy
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import subprocess
+import time
+
+import vl_model_cli
+from batch_runner import build_result, iter_tasks, load_finished_ids, run_item
+from metrics import SpanRecorder
+from vl_model_cli import AgentSession, set_config_path
+
+
+# 启动虚拟显示
+def start_xvfb(display, screen="1920x1080x24", timeout=10):
+    """启动Xvfb并等待其就绪，返回进程对象"""
+    if shutil.which("Xvfb") is None:
+        raise RuntimeError("未找到Xvfb，请先安装（如 apt install xvfb）")
+    process = subprocess.Popen(
+        ["Xvfb", display, "-screen", "0", screen, "-nolisten", "tcp"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    socket_path = f"/tmp/.X11-unix/X{display.lstrip(':').split('.')[0]}"
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(socket_path):
+        if process.poll() is not None:
+            raise RuntimeError(f"Xvfb {display} 启动失败（显示号可能已被占用）")
+        if time.monotonic() > deadline:
+            process.terminate()
+            raise RuntimeError(f"Xvfb {display} 启动超时")
+        time.sleep(0.05)
+    return process
+
+
+# 生成工作进程的配置
+def build_worker_config(config, worker_dir):
+    """
+    复制配置并把截图、标记图片、耗时统计、输入记录、轨迹和缓存改到工作进程自己的目录，
+    避免多个进程写同一个文件；已有的缓存文件复制过去作为初始内容
+    """
+    config = copy.deepcopy(config)
+    screenshot_config = config.setdefault("screenshot_config", {})
+    screenshot_config["input_path"] = os.path.join(worker_dir, "screen.png")
+    screenshot_config["output_path"] = os.path.join(worker_dir, "label")
+
+    metrics_config = config.get("metrics_config", {})
+    if metrics_config.get("enabled", False):
+        metrics_config["jsonl_path"] = os.path.join(worker_dir, "metrics.jsonl")
+        metrics_config["summary_path"] = os.path.join(worker_dir, "summary.prom")
+
+    input_config = config.get("input_config", {})
+    if input_config.get("record_path"):
+        input_config["record_path"] = os.path.join(worker_dir, "input.jsonl")
+
+    cache_config = config.get("action_cache_config", {})
+    if cache_config.get("enabled", False):
+        source = cache_config.get("path", "cache/action_cache.json")
+        path = os.path.join(worker_dir, "action_cache.json")
+        if os.path.exists(source) and not os.path.exists(path):
+            shutil.copyfile(source, path)
+        cache_config["path"] = path
+
+    trace_config = config.get("trace_config", {})
+    if trace_config.get("enabled", False):
+        trace_config["directory"] = os.path.join(worker_dir, "traces")
+
+    target_config = config.get("target_cache_config", {})
+    if target_config.get("enabled", False):
+        source = target_config.get("directory", "cache/targets")
+        directory = os.path.join(worker_dir, "targets")
+        if os.path.isdir(source) and not os.path.exists(directory):
+            shutil.copytree(source, directory)
+        target_config["directory"] = directory
+    return config
+
+
+# 工作进程入口
+def run_worker(index, config_path, task_queue, result_queue, max_iterations, time_limit):
+    """从队列取任务执行，直到取到None或被中断；每个结果连同耗时样本发回主进程"""
+    # DISPLAY在启动进程前写入环境变量，spawn的子进程重新导入本模块（及vl_model_cli）时已使用对应的显示
+    set_config_path(config_path)
+    session = AgentSession(config_path)
+    try:
+        while not vl_model_cli.should_exit:
+            item = task_queue.get()
+            if item is None:
+                break
+            task = run_item(session, item, max_iterations, time_limit)
+            # 用户中断的任务不记录结果，下次运行时重新执行
+            if task.status == "interrupted":
+                break
+            result = build_result(item, task)
+            result["worker"] = index
+            result["display"] = os.environ.get("DISPLAY")
+            result_queue.put(
+                (
+                    "result",
+                    index,
+                    result,
+                    {name: list(values) for name, values in task.metrics.samples.items()},
+                    dict(task.metrics.totals),
+                )
+            )
+    finally:
+        session.close()
+        result_queue.put(("done", index, None, None, None))
+
+
+def run_parallel(
+    config_path,
+    tasks_path,
+    results_path,
+    workers=2,
+    displays=None,
+    xvfb=False,
+    xvfb_base=99,
+    screen="1920x1080x24",
+    work_dir="parallel_runs",
+    max_iterations=None,
+    time_limit=None,
+):
+    """
+    并行执行任务文件中的任务，返回 (本次执行的任务数, 汇总的SpanRecorder)
+    displays: 每个工作进程使用的DISPLAY列表；xvfb为True时从 :xvfb_base 开始为每个进程启动Xvfb；
+    两者都未指定时所有进程共用当前DISPLAY（回放截图 + dry-run 输入时不需要显示）
+    """
+    with open(config_path, "r", encoding="utf-8") as f:
+        base_config = json.load(f)
+
+    finished = load_finished_ids(results_path)
+    if finished:
+        print(f"已有 {len(finished)} 个任务的结果，将跳过")
+    pending = [item for item in iter_tasks(tasks_path) if item["id"] not in finished]
+    merged = SpanRecorder(enabled=True, labels={"runner": "parallel"})
+    if not pending:
+        return 0, merged
+    workers = max(1, min(workers, len(pending)))
+
+    output_dir = os.path.dirname(results_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    xvfb_processes = []
+    processes = []
+    # spawn：子进程不继承父进程的X连接、线程和会话状态
+    context = multiprocessing.get_context("spawn")
+    task_queue = context.Queue()
+    result_queue = context.Queue()
+    count = 0
+    try:
+        if xvfb:
+            displays = [f":{xvfb_base + index}" for index in range(workers)]
+            for display in displays:
+                xvfb_processes.append(start_xvfb(display, screen))
+                print(f"🖥️  已启动 Xvfb {display}")
+        elif displays:
+            if len(displays) < workers:
+                raise ValueError(f"显示数量（{len(displays)}）少于工作进程数（{workers}）")
+        else:
+            displays = [os.environ.get("DISPLAY")] * workers
+
+        for item in pending:
+            task_queue.put(item)
+        for _ in range(workers):
+            task_queue.put(None)
+
+        original_display = os.environ.get("DISPLAY")
+        for index in range(workers):
+            worker_dir = os.path.join(work_dir, f"worker-{index}")
+            os.makedirs(worker_dir, exist_ok=True)
+            worker_config_path = os.path.join(worker_dir, "config.json")
+            with open(worker_config_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    build_worker_config(base_config, worker_dir),
+                    f,
+                    ensure_ascii=False,
+                    indent=2,
+                )
+            # 子进程在启动时复制当前环境变量
+            if displays[index]:
+                os.environ["DISPLAY"] = displays[index]
+            process = context.Process(
+                target=run_worker,
+                args=(
+                    index,
+                    worker_config_path,
+                    task_queue,
+                    result_queue,
+                    max_iterations,
+                    time_limit,
+                ),
+                name=f"agent-worker-{index}",
+            )
+            process.start()
+            processes.append(process)
+            print(f"🚀 工作进程 {index} 已启动（DISPLAY={displays[index]}）")
+        if original_display is None:
+            os.environ.pop("DISPLAY", None)
+        else:
+            os.environ["DISPLAY"] = original_display
+
+        done = set()
+        with open(results_path, "a", encoding="utf-8") as results_file:
+            while len(done) < workers:
+                try:
+                    kind, index, result, samples, totals = result_queue.get(timeout=0.5)
+                except queue.Empty:
+                    # 工作进程异常退出时不再等待它
+                    for index, process in enumerate(processes):
+                        if index not in done and not process.is_alive():
+                            print(f"⚠️  工作进程 {index} 异常退出（{process.exitcode}）")
+                            done.add(index)
+                    continue
+                if kind == "done":
+                    done.add(index)
+                    continue
+
+                results_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+                results_file.flush()
+                os.fsync(results_file.fileno())
+                merged.merge(samples, totals)
+                count += 1
+                print(
+                    f"[worker-{index}] 任务 {result['id']} 结束: {result['status']}，"
+                    f"{result['iterations']} 次迭代，耗时 {result['wall_time']:.1f}s"
+                )
+    finally:
+        for process in processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        for process in xvfb_processes:
+            process.terminate()
+            process.wait(timeout=5)
+
+    return count, merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在多个虚拟显示上并行执行任务")
+    parser.add_argument("--config", required=True, help="配置文件路径")
+    parser.add_argument("--tasks", required=True, help="任务JSONL文件")
+    parser.add_argument("--results", required=True, help="结果JSONL文件（追加写入）")
+    parser.add_argument("--workers", type=int, default=2, help="工作进程数")
+    parser.add_argument(
+        "--displays", default=None, help="逗号分隔的DISPLAY列表，如 :1,:2"
+    )
+    parser.add_argument("--xvfb", action="store_true", help="为每个工作进程启动Xvfb")
+    parser.add_argument("--xvfb-base", type=int, default=99, help="Xvfb起始显示号")
+    parser.add_argument("--screen", default="1920x1080x24", help="Xvfb屏幕尺寸和色深")
+    parser.add_argument("--work-dir", default="parallel_runs", help="各工作进程的产物目录")
+    parser.add_argument("--max-iterations", type=int, default=None, help="每个任务的最大迭代次数")
+    parser.add_argument("--time-limit", type=float, default=None, help="每个任务的时间上限（秒）")
+    parser.add_argument("--summary", default=None, help="汇总耗时统计写入的Prometheus文本文件")
+    args = parser.parse_args()
+
+    start = time.monotonic()
+    count, merged = run_parallel(
+        args.config,
+        args.tasks,
+        args.results,
+        workers=args.workers,
+        displays=args.displays.split(",") if args.displays else None,
+        xvfb=args.xvfb,
+        xvfb_base=args.xvfb_base,
+        screen=args.screen,
+        work_dir=args.work_dir,
+        max_iterations=args.max_iterations,
+        time_limit=args.time_limit,
+    )
+    elapsed = time.monotonic() - start
+    print("=" * 50)
+    print(
+        f"本次共执行 {count} 个任务，耗时 {elapsed:.1f}s，"
+        f"吞吐 {count / elapsed if elapsed else 0:.2f} 任务/秒"
+    )
+    if merged.samples or merged.totals:
+        print("📊 各阶段耗时汇总:\n" + merged.format_summary())
+    if args.summary:
+        output_dir = os.path.dirname(args.summary)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        with open(args.summary, "w", encoding="utf-8") as f:
+            f.write(merged.prometheus_text())
+
+
+if __name__ == "__main__":
+    main()
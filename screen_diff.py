@@ -0,0 +1,201 @@
+"""
+屏幕变化检测工具
+基于缩小后的灰度图比较相邻帧，用于等待界面稳定等场景
+"""
+
+import time
+
+import cv2
+import numpy as np
+
+
+def downscale_gray(image, max_edge=160):
+    """将BGR图像转换为缩小后的灰度图"""
+    if image.ndim == 3:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    else:
+        gray = image
+    height, width = gray.shape[:2]
+    edge = max(height, width)
+    if edge > max_edge:
+        factor = max_edge / edge
+        size = (max(1, int(width * factor)), max(1, int(height * factor)))
+        gray = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+    return gray
+
+
+def frame_difference(previous, current, pixel_threshold=8):
+    """
+    计算两张灰度缩略图的差异比例（0~1）
+    尺寸不一致时视为完全不同
+    """
+    if previous is None or current is None:
+        return 1.0
+    if previous.shape != current.shape:
+        return 1.0
+    diff = cv2.absdiff(previous, current)
+    changed = np.count_nonzero(diff > pixel_threshold)
+    return changed / diff.size
+
+
+def wait_for_screen_settle(
+    grab,
+    poll_interval=0.05,
+    stable_frames=2,
+    diff_threshold=0.002,
+    max_wait=3.0,
+    min_wait=0.0,
+):
+    """
+    轮询缩略图，直到连续stable_frames帧不再变化或达到max_wait
+    grab: 返回灰度缩略图的函数
+    返回 (是否稳定, 实际等待秒数)
+    """
+    start = time.monotonic()
+    if min_wait > 0:
+        time.sleep(min_wait)
+
+    previous = grab()
+    stable = 0
+    while True:
+        elapsed = time.monotonic() - start
+        if elapsed >= max_wait:
+            return False, elapsed
+        time.sleep(min(poll_interval, max(0.0, max_wait - elapsed)))
+        current = grab()
+        if frame_difference(previous, current) <= diff_threshold:
+            stable += 1
+            if stable >= stable_frames:
+                return True, time.monotonic() - start
+        else:
+            stable = 0
+        previous = current
+
+
+def wait_for_screen_change(
+    grab, reference, timeout=1.0, poll_interval=0.1, diff_threshold=0.002
+):
+    """
+    轮询缩略图，直到与reference相比发生变化或超时
+    返回 (是否变化, 实际等待秒数)
+    """
+    start = time.monotonic()
+    while True:
+        elapsed = time.monotonic() - start
+        if elapsed >= timeout:
+            return False, elapsed
+        time.sleep(min(poll_interval, max(0.0, timeout - elapsed)))
+        if frame_difference(reference, grab()) > diff_threshold:
+            return True, time.monotonic() - start
+
+
+def changed_regions(
+    previous,
+    current,
+    pixel_threshold=16,
+    analysis_edge=320,
+    padding=8,
+    min_area=16,
+    max_regions=4,
+):
+    """
+    计算两帧BGR图像之间发生变化的矩形区域
+    返回 [(x, y, w, h), ...]，坐标基于current图像；尺寸不一致时返回None
+    """
+    if previous is None or current is None or previous.shape != current.shape:
+        return None
+
+    height, width = current.shape[:2]
+    small_previous = downscale_gray(previous, analysis_edge)
+    small_current = downscale_gray(current, analysis_edge)
+    factor = width / small_current.shape[1]
+
+    diff = cv2.absdiff(small_previous, small_current)
+    _, mask = cv2.threshold(diff, pixel_threshold, 255, cv2.THRESH_BINARY)
+    # 膨胀以合并相邻的零散变化
+    mask = cv2.dilate(mask, np.ones((5, 5), np.uint8), iterations=2)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    boxes = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if w * h * factor * factor < min_area:
+            continue
+        x0 = max(0, int(x * factor) - padding)
+        y0 = max(0, int(y * factor) - padding)
+        x1 = min(width, int((x + w) * factor) + padding)
+        y1 = min(height, int((y + h) * factor) + padding)
+        boxes.append([x0, y0, x1, y1])
+
+    # 区域过多时合并为一个整体外接矩形
+    if len(boxes) > max_regions:
+        boxes = [
+            [
+                min(b[0] for b in boxes),
+                min(b[1] for b in boxes),
+                max(b[2] for b in boxes),
+                max(b[3] for b in boxes),
+            ]
+        ]
+
+    boxes.sort(key=lambda b: (b[1], b[0]))
+    return [(b[0], b[1], b[2] - b[0], b[3] - b[1]) for b in boxes]
+
+
+def detect_dialog(
+    previous,
+    current,
+    pixel_threshold=16,
+    min_area_ratio=0.02,
+    max_area_ratio=0.6,
+    min_fill=0.3,
+):
+    """
+    粗略判断current相对previous是否弹出了对话框（或菜单等浮层）
+    特征：最大的变化区域不贴屏幕边缘、面积适中，且区域内大部分像素都发生了变化
+    输入为尺寸相同的灰度缩略图或BGR图像；尺寸不一致时返回False
+    """
+    if previous is None or current is None or previous.shape != current.shape:
+        return False
+
+    regions = changed_regions(
+        previous, current, pixel_threshold=pixel_threshold, padding=0, max_regions=8
+    )
+    if not regions:
+        return False
+
+    height, width = current.shape[:2]
+    x, y, w, h = max(regions, key=lambda region: region[2] * region[3])
+    area_ratio = (w * h) / (width * height)
+    if not min_area_ratio <= area_ratio <= max_area_ratio:
+        return False
+    if x <= 0 or y <= 0 or x + w >= width or y + h >= height:
+        return False
+
+    # 仅转换为灰度，不缩放
+    diff = cv2.absdiff(
+        downscale_gray(previous[y : y + h, x : x + w], max(w, h)),
+        downscale_gray(current[y : y + h, x : x + w], max(w, h)),
+    )
+    return np.count_nonzero(diff > pixel_threshold) / diff.size >= min_fill
+
+
+def dhash(image, hash_size=16):
+    """
+    计算图像的差异哈希（感知哈希），返回整数
+    对轻微的缩放和压缩噪声不敏感，可用于判断两帧是否为同一画面
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    resized = cv2.resize(
+        gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA
+    )
+    bits = (resized[:, 1:] > resized[:, :-1]).flatten()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def hamming_distance(a, b):
+    """两个哈希值之间不同的位数"""
+    return bin(a ^ b).count("1")
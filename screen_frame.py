@@ -0,0 +1,113 @@
+"""
+屏幕帧对象
+一次截图只解码一次，缩放图、PNG字节、base64编码都保存在内存中复用
+"""
+
+import base64
+import time
+
+import cv2
+
+
+def encode_png_base64(image, png_compression=1):
+    """将BGR图像编码为PNG并返回base64字符串"""
+    params = [int(cv2.IMWRITE_PNG_COMPRESSION), png_compression]
+    success, buffer = cv2.imencode(".png", image, params)
+    if not success:
+        raise ValueError("PNG编码失败")
+    return base64.b64encode(buffer.tobytes()).decode("utf-8")
+
+
+class ScreenFrame:
+    """单次截图的内存表示"""
+
+    def __init__(
+        self, image, scale=1, full_image=None, png_compression=1, origin=(0, 0)
+    ):
+        # 发送给模型的（可能已缩放的）BGR图像
+        self.image = image
+        # 缩放比例：image尺寸 = 原始屏幕尺寸 * scale
+        self.scale = scale
+        # 原始分辨率图像（未缩放时与image为同一对象）
+        self.full_image = full_image if full_image is not None else image
+        self.png_compression = png_compression
+        # 截图区域左上角在屏幕上的坐标（区域截图时非零）
+        self.origin = origin
+        # 检测到的界面元素框（image坐标），以及绘制了编号标记的图像
+        self.elements = None
+        self.overlay = None
+        self.captured_at = time.time()
+
+        self._png_bytes = None
+        self._base64 = None
+        self._thumbnails = {}
+
+    @property
+    def width(self):
+        return self.image.shape[1]
+
+    @property
+    def height(self):
+        return self.image.shape[0]
+
+    def set_overlay(self, overlay):
+        """设置发送给模型的标记图像（尺寸与image相同），清除已缓存的编码"""
+        self.overlay = overlay
+        self._png_bytes = None
+        self._base64 = None
+        self._thumbnails = {}
+
+    def png_bytes(self):
+        """PNG编码结果（惰性计算并缓存），设置了标记图像时编码标记图像"""
+        if self._png_bytes is None:
+            image = self.overlay if self.overlay is not None else self.image
+            params = [int(cv2.IMWRITE_PNG_COMPRESSION), self.png_compression]
+            success, buffer = cv2.imencode(".png", image, params)
+            if not success:
+                raise ValueError("PNG编码失败")
+            self._png_bytes = buffer.tobytes()
+        return self._png_bytes
+
+    def base64(self):
+        """base64编码结果（惰性计算并缓存）"""
+        if self._base64 is None:
+            self._base64 = base64.b64encode(self.png_bytes()).decode("utf-8")
+        return self._base64
+
+    def data_url(self):
+        """用于image_url消息的data URL"""
+        return f"data:image/png;base64,{self.base64()}"
+
+    def thumbnail_base64(self, max_edge):
+        """按最长边缩小后的base64编码（按尺寸缓存），设置了标记图像时缩小标记图像"""
+        if max_edge not in self._thumbnails:
+            height, width = self.image.shape[:2]
+            image = self.overlay if self.overlay is not None else self.image
+            if max(height, width) > max_edge:
+                factor = max_edge / max(height, width)
+                image = cv2.resize(
+                    image, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA
+                )
+            self._thumbnails[max_edge] = encode_png_base64(
+                image, self.png_compression
+            )
+        return self._thumbnails[max_edge]
+
+    def crop_full(self, x, y, w, h):
+        """
+        按image坐标裁剪原始分辨率区域
+        返回 (裁剪图, 原始分辨率下的(left, top, width, height))
+        """
+        full_height, full_width = self.full_image.shape[:2]
+        left = max(0, int(x / self.scale))
+        top = max(0, int(y / self.scale))
+        right = min(full_width, int((x + w) / self.scale))
+        bottom = min(full_height, int((y + h) / self.scale))
+        crop = self.full_image[top:bottom, left:right]
+        return crop, (left, top, right - left, bottom - top)
+
+    def save(self, path):
+        """将已编码的PNG写入磁盘（调试用，可选）"""
+        with open(path, "wb") as f:
+            f.write(self.png_bytes())
+        return True
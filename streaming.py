@@ -0,0 +1,242 @@
+"""
+流式响应支持
+增量解析模型输出的JSON，status和action字段完整后即可提前执行操作，
+其余内容在后台线程（异步客户端时在事件循环）中继续读取，用于日志和历史记录
+"""
+
+import asyncio
+import json
+import threading
+
+
+class IncrementalJSONParser:
+    """
+    增量解析顶层JSON对象的字段
+    每个顶层字段的值完整后立即解析并放入fields，允许JSON前有```json等前缀
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.fields = {}
+        self.closed = False
+
+        self._pos = 0
+        self._depth = 0
+        self._started = False
+        self._in_string = False
+        self._escape = False
+        # 顶层状态：key / after_key / value / in_value / after_value
+        self._state = "key"
+        self._key_start = None
+        self._current_key = None
+        self._value_start = None
+        self._value_kind = None
+
+    def feed(self, chunk):
+        """追加一段文本，返回当前已完整解析的字段"""
+        self.buffer += chunk
+        while self._pos < len(self.buffer) and not self.closed:
+            self._step(self.buffer[self._pos], self._pos)
+            self._pos += 1
+        return self.fields
+
+    def has_fields(self, *names):
+        """指定字段是否都已完整解析"""
+        return all(name in self.fields for name in names)
+
+    def _complete_value(self, end):
+        """当前顶层字段的值在end处结束"""
+        raw = self.buffer[self._value_start : end].strip()
+        try:
+            self.fields[self._current_key] = json.loads(raw)
+        except ValueError:
+            pass
+        self._state = "after_value"
+        self._current_key = None
+        self._value_start = None
+        self._value_kind = None
+
+    def _step(self, ch, i):
+        if not self._started:
+            if ch == "{":
+                self._started = True
+                self._depth = 1
+            return
+
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif ch == "\\":
+                self._escape = True
+            elif ch == '"':
+                self._in_string = False
+                if self._depth == 1:
+                    if self._state == "key":
+                        self._current_key = json.loads(
+                            self.buffer[self._key_start : i + 1]
+                        )
+                        self._state = "after_key"
+                    elif self._state == "in_value" and self._value_kind == "string":
+                        self._complete_value(i + 1)
+            return
+
+        if self._depth == 1:
+            if self._state == "key":
+                if ch == '"':
+                    self._in_string = True
+                    self._key_start = i
+                elif ch == "}":
+                    self.closed = True
+                return
+            if self._state == "after_key":
+                if ch == ":":
+                    self._state = "value"
+                return
+            if self._state == "value":
+                if ch.isspace():
+                    return
+                self._value_start = i
+                self._state = "in_value"
+                if ch == '"':
+                    self._value_kind = "string"
+                    self._in_string = True
+                elif ch in "{[":
+                    self._value_kind = "container"
+                    self._depth += 1
+                else:
+                    self._value_kind = "primitive"
+                return
+            if self._state == "in_value" and self._value_kind == "primitive":
+                if ch in ",}":
+                    self._complete_value(i)
+                    if ch == ",":
+                        self._state = "key"
+                    else:
+                        self.closed = True
+                return
+            if self._state == "after_value":
+                if ch == ",":
+                    self._state = "key"
+                elif ch == "}":
+                    self.closed = True
+                return
+            return
+
+        # 嵌套层级内只需跟踪字符串和括号深度
+        if ch == '"':
+            self._in_string = True
+        elif ch in "{[":
+            self._depth += 1
+        elif ch in "}]":
+            self._depth -= 1
+            if self._depth == 1 and self._state == "in_value":
+                self._complete_value(i + 1)
+
+
+class StreamingCompletion:
+    """
+    在后台线程中读取流式响应
+    wait_fields() 等待指定字段解析完成（或流结束），wait_text() 等待完整文本
+    """
+
+    def __init__(self, stream, required_fields=("status", "action")):
+        self.stream = stream
+        self.required_fields = required_fields
+        self.parser = IncrementalJSONParser()
+        self.error = None
+        # 流的最后一个数据块可能携带token用量
+        self.usage = None
+
+        self._fields_ready = threading.Event()
+        self._done = threading.Event()
+        self._start()
+
+    @property
+    def text(self):
+        return self.parser.buffer
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._read, daemon=True)
+        self._thread.start()
+
+    def _handle_chunk(self, chunk):
+        if getattr(chunk, "usage", None) is not None:
+            self.usage = chunk.usage
+        if not chunk.choices:
+            return
+        delta = chunk.choices[0].delta
+        content = getattr(delta, "content", None)
+        if not content:
+            return
+        self.parser.feed(content)
+        if self.parser.has_fields(*self.required_fields):
+            self._fields_ready.set()
+
+    def _read(self):
+        try:
+            for chunk in self.stream:
+                self._handle_chunk(chunk)
+        except Exception as e:
+            self.error = e
+        finally:
+            self._fields_ready.set()
+            self._done.set()
+
+    def wait_fields(self, timeout=None):
+        """
+        等待必需字段解析完成
+        返回已解析的字段字典；流已结束但字段不完整时返回None
+        """
+        self._fields_ready.wait(timeout)
+        if self.parser.has_fields(*self.required_fields):
+            return dict(self.parser.fields)
+        return None
+
+    def wait_text(self, timeout=None):
+        """等待流结束并返回完整文本，读取出错时抛出异常"""
+        self._done.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.text
+
+    def close(self):
+        """提前关闭流（如任务已结束或用户中断）"""
+        try:
+            self.stream.close()
+        except Exception:
+            pass
+
+
+class AsyncStreamingCompletion(StreamingCompletion):
+    """
+    在事件循环中读取AsyncOpenAI的流式响应，必须在事件循环中创建
+    wait_fields() / wait_text() 与StreamingCompletion相同（可在执行器线程中等待），
+    close() 可从任意线程调用，会取消读取并关闭HTTP连接
+    """
+
+    def _start(self):
+        self._loop = asyncio.get_running_loop()
+        self._reader = self._loop.create_task(self._read_async())
+
+    async def _read_async(self):
+        try:
+            async for chunk in self.stream:
+                self._handle_chunk(chunk)
+        except asyncio.CancelledError:
+            self.error = RuntimeError("流式响应已关闭")
+        except Exception as e:
+            self.error = e
+        finally:
+            self._fields_ready.set()
+            self._done.set()
+            try:
+                await self.stream.close()
+            except Exception:
+                pass
+
+    def close(self):
+        try:
+            self._loop.call_soon_threadsafe(self._reader.cancel)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
@@ -0,0 +1,203 @@
+"""
+结构化输出
+由严格的pydantic模型生成JSON Schema，通过response_format约束模型输出，
+并用预先编译的TypeAdapter校验响应；不支持该参数的服务仍使用文本解析
+"""
+
+from functools import lru_cache
+from typing import List, Literal, Optional, Union
+
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    TypeAdapter,
+    ValidationError,
+    create_model,
+)
+
+ActionType = Literal[
+    "click",
+    "double_click",
+    "long_press",
+    "right_click",
+    "drag",
+    "scroll_up",
+    "scroll_down",
+    "input",
+    "hotkey",
+    "wait",
+]
+
+
+class StructuredAction(BaseModel):
+    """单个操作"""
+
+    model_config = ConfigDict(extra="forbid")
+
+    type: ActionType
+    # 单点 [x, y] 或拖拽 [[x1, y1], [x2, y2]]
+    coordinates: Union[List[float], List[List[float]]]
+    text: str
+    # 坐标基于第几个变化区域裁剪图（增量帧模式），整屏坐标时为null
+    region: Optional[int]
+
+
+# 启用放大定位时操作附加的字段
+GROUNDING_FIELDS = {
+    # 对坐标准确性的把握（0~1）
+    "confidence": (float, ...),
+    # 目标元素外接框 [x1, y1, x2, y2]（0~1000相对坐标），无具体目标时为null
+    "target_box": (Optional[List[float]], ...),
+}
+
+# 启用元素标记时操作附加的字段：目标元素的编号，没有编号时为null
+MARK_FIELDS = {"mark": (Optional[int], ...)}
+
+
+@lru_cache(maxsize=None)
+def _action_model(grounded=False, marked=False):
+    """按启用的功能生成操作模型"""
+    if not grounded and not marked:
+        return StructuredAction
+    fields = {}
+    if grounded:
+        fields.update(GROUNDING_FIELDS)
+    if marked:
+        fields.update(MARK_FIELDS)
+    return create_model("StructuredAction", __base__=StructuredAction, **fields)
+
+
+class StructuredGuard(BaseModel):
+    """多步计划的检查条件"""
+
+    model_config = ConfigDict(extra="forbid")
+
+    max_change: Optional[float]
+    stop_on_dialog: bool
+
+
+class ZoomResponse(BaseModel):
+    """放大定位的响应"""
+
+    model_config = ConfigDict(extra="forbid")
+
+    found: bool
+    coordinates: List[float]
+
+
+@lru_cache(maxsize=None)
+def _response_model(plan=False, grounded=False, marked=False):
+    """
+    生成响应模型，字段顺序与流式模式要求一致：status、action 在前
+    plan: 包含后续操作和检查条件；grounded: 操作带有confidence和target_box；
+    marked: 操作带有元素编号mark
+    """
+    action_model = _action_model(grounded, marked)
+    fields = {
+        "status": (Literal["completed", "in_progress", "failed"], ...),
+        "action": (action_model, ...),
+    }
+    if plan:
+        fields["next_actions"] = (List[action_model], ...)
+        fields["guard"] = (StructuredGuard, ...)
+    fields["target"] = (str, ...)
+    fields["description"] = (str, ...)
+    return create_model(
+        "StructuredResponse",
+        __config__=ConfigDict(extra="forbid"),
+        **fields,
+    )
+
+
+# 校验器按响应模型编译一次后复用，会话加载配置时通过warm_response_validator预先编译
+@lru_cache(maxsize=None)
+def _adapter(plan=False, grounded=False, marked=False):
+    return TypeAdapter(_response_model(plan, grounded, marked))
+
+
+def warm_response_validator(plan=False, grounded=False, marked=False):
+    """预先编译当前配置使用的响应校验器，避免第一次请求承担编译耗时"""
+    _adapter(plan, grounded, marked)
+
+
+_ZOOM_ADAPTER = TypeAdapter(ZoomResponse)
+
+
+def _strict_schema(schema):
+    """
+    转换为严格模式要求的格式：
+    所有对象禁止额外字段、所有字段必填，去掉title和default
+    """
+    if isinstance(schema, dict):
+        schema = {
+            key: _strict_schema(value)
+            for key, value in schema.items()
+            if key not in ("title", "default")
+        }
+        if schema.get("type") == "object" and "properties" in schema:
+            schema["additionalProperties"] = False
+            schema["required"] = list(schema["properties"])
+        return schema
+    if isinstance(schema, list):
+        return [_strict_schema(item) for item in schema]
+    return schema
+
+
+def _response_format(name, model):
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": name,
+            "strict": True,
+            "schema": _strict_schema(model.model_json_schema()),
+        },
+    }
+
+
+def build_response_format(plan=False, grounded=False, marked=False):
+    """生成chat.completions的response_format参数"""
+    return _response_format("gui_action", _response_model(plan, grounded, marked))
+
+
+def build_zoom_response_format():
+    """放大定位请求的response_format参数"""
+    return _response_format("zoom_grounding", ZoomResponse)
+
+
+def _drop_none(data):
+    return {key: value for key, value in data.items() if value is not None}
+
+
+def validate_structured_response(
+    response_text, plan=False, grounded=False, marked=False
+):
+    """
+    校验结构化响应，返回可传给AIResponse的字段字典
+    响应不符合Schema时返回None
+    """
+    try:
+        response = _adapter(plan, grounded, marked).validate_json(response_text)
+    except ValidationError:
+        return None
+
+    fields = {
+        "status": response.status,
+        "description": response.description,
+        "target": response.target,
+        "action": _drop_none(response.action.model_dump()),
+    }
+    if plan:
+        fields["next_actions"] = [
+            _drop_none(action.model_dump()) for action in response.next_actions
+        ]
+        fields["guard"] = _drop_none(response.guard.model_dump())
+    return fields
+
+
+def validate_zoom_response(response_text):
+    """校验放大定位响应，返回 (found, coordinates)，不符合Schema时返回None"""
+    try:
+        response = _ZOOM_ADAPTER.validate_json(response_text)
+    except ValidationError:
+        return None
+    return response.found, response.coordinates
@@ -0,0 +1,292 @@
+"""
+目标模板缓存
+点击成功后，以归一化的target为键，把点击点附近的一小块原始分辨率图像保存到磁盘索引中；
+模型再次给出已知的target时，在图像金字塔上用cv2.matchTemplate由粗到细找到目标的当前位置，
+用像素级的匹配结果代替模型在缩小截图上估计的坐标；脚本化步骤命中缓存时可以完全跳过模型调用
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+import weakref
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# 按目标定位的单点操作（滚动位置与目标无关，不参与缓存）
+TARGET_ACTIONS = {"click", "double_click", "right_click", "long_press", "input"}
+
+
+def normalize_target(target):
+    """归一化目标描述：去掉首尾空白和引号，合并连续空白，转小写"""
+    if not isinstance(target, str):
+        return ""
+    target = re.sub(r"\s+", " ", target).strip().strip("\"'“”‘’「」《》").strip()
+    return target.lower()
+
+
+def to_gray(image):
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+
+def build_pyramid(gray, levels):
+    """返回 [原图, 1/2, 1/4, ...] 共levels+1层灰度图"""
+    pyramid = [gray]
+    for _ in range(levels):
+        pyramid.append(cv2.pyrDown(pyramid[-1]))
+    return pyramid
+
+
+class TargetCache:
+    """
+    目标模板缓存
+    directory 下保存 index.json 和每个目标的PNG模板，超出max_entries时淘汰最久未使用的目标
+    """
+
+    def __init__(
+        self,
+        directory="cache/targets",
+        max_entries=200,
+        patch_edge=64,
+        pyramid_levels=2,
+        match_threshold=0.9,
+        min_margin=0.05,
+        min_std=8.0,
+        candidates=3,
+        log=print,
+    ):
+        self.directory = directory
+        self.max_entries = max_entries
+        # 模板边长（原始分辨率像素）
+        self.patch_edge = patch_edge
+        # 粗匹配所在的金字塔层数（每层缩小一半）
+        self.pyramid_levels = pyramid_levels
+        # 精匹配的最低归一化相关系数
+        self.match_threshold = match_threshold
+        # 最佳匹配需要比其他位置高出的相关系数（画面上有多个相同元素时放弃）
+        self.min_margin = min_margin
+        # 模板灰度标准差下限（纯色区域无法可靠匹配）
+        self.min_std = min_std
+        # 粗匹配后进入精匹配的候选位置数
+        self.candidates = candidates
+        self.log = log
+        self.entries = OrderedDict()
+        # 已解码的模板金字塔，按目标缓存
+        self._patches = {}
+        # 最近一次定位所用截图的金字塔，按截图来源对象（弱引用）复用
+        self._screen = None
+        self.load()
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, "index.json")
+
+    @staticmethod
+    def _file_name(key):
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16] + ".png"
+
+    def load(self):
+        """从磁盘加载索引，文件不存在或损坏时从空缓存开始"""
+        self.entries.clear()
+        self._patches.clear()
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            entries = sorted(data.get("entries", []), key=lambda e: e["last_used"])
+            for entry in entries:
+                self.entries[entry["target"]] = entry
+        except Exception as e:
+            self.log(f"加载目标模板缓存失败: {e}")
+            self.entries.clear()
+
+    def save(self):
+        """写入索引（先写临时文件再替换，避免中途崩溃损坏索引）"""
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"entries": list(self.entries.values())}, f, ensure_ascii=False
+            )
+        os.replace(tmp_path, self.index_path)
+
+    def __contains__(self, target):
+        return normalize_target(target) in self.entries
+
+    def _patch_pyramid(self, key):
+        """读取目标模板的金字塔，模板文件丢失时删除该目标"""
+        pyramid = self._patches.get(key)
+        if pyramid is None:
+            entry = self.entries[key]
+            patch = cv2.imread(
+                os.path.join(self.directory, entry["file"]), cv2.IMREAD_GRAYSCALE
+            )
+            if patch is None:
+                self.remove(key)
+                return None
+            pyramid = build_pyramid(patch, self.pyramid_levels)
+            self._patches[key] = pyramid
+        return pyramid
+
+    def _screen_pyramid(self, image, source=None):
+        # 截图缓冲区可能被复用，数组对象相同不代表内容相同，只按来源对象判断是否同一帧
+        if source is not None and self._screen is not None and self._screen[0]() is source:
+            return self._screen[1]
+        pyramid = build_pyramid(to_gray(image), self.pyramid_levels)
+        self._screen = (weakref.ref(source), pyramid) if source is not None else None
+        return pyramid
+
+    def store(self, target, image, x, y):
+        """
+        以 (x, y)（image像素坐标）为中心截取模板并保存，返回是否保存
+        目标描述为空、模板区域过小或过于单调时不保存
+        """
+        key = normalize_target(target)
+        if not key:
+            return False
+        height, width = image.shape[:2]
+        half = self.patch_edge // 2
+        left = int(min(max(0, x - half), max(0, width - self.patch_edge)))
+        top = int(min(max(0, y - half), max(0, height - self.patch_edge)))
+        patch = to_gray(image[top : top + self.patch_edge, left : left + self.patch_edge])
+        if min(patch.shape[:2]) < self.patch_edge or patch.std() < self.min_std:
+            return False
+
+        file_name = self._file_name(key)
+        os.makedirs(self.directory, exist_ok=True)
+        if not cv2.imwrite(os.path.join(self.directory, file_name), patch):
+            return False
+        previous = self.entries.pop(key, {})
+        self.entries[key] = {
+            "target": key,
+            "file": file_name,
+            # 点击点在模板中的位置
+            "offset": [x - left, y - top],
+            "last_used": time.time(),
+            "hits": previous.get("hits", 0),
+        }
+        self._patches[key] = build_pyramid(patch, self.pyramid_levels)
+        while len(self.entries) > self.max_entries:
+            self.remove(next(iter(self.entries)))
+        return True
+
+    def locate(self, target, image, source=None):
+        """
+        在image（BGR或灰度，原始分辨率）中查找目标
+        source: image所属的帧对象（如ScreenFrame），同一帧多次定位时复用金字塔；
+        未提供时每次重新构建
+        返回 (x, y, 相关系数)，未缓存、未找到或匹配不唯一时返回None
+        """
+        key = normalize_target(target)
+        if key not in self.entries:
+            return None
+        patch_pyramid = self._patch_pyramid(key)
+        if patch_pyramid is None:
+            return None
+        screen_pyramid = self._screen_pyramid(image, source)
+        screen = screen_pyramid[0]
+        patch = patch_pyramid[0]
+        patch_h, patch_w = patch.shape[:2]
+        if screen.shape[0] < patch_h or screen.shape[1] < patch_w:
+            return None
+
+        # 粗匹配：在金字塔顶层全图搜索（缩小后模板边长不少于8像素）
+        level = self.pyramid_levels
+        while level > 0 and min(patch_pyramid[level].shape[:2]) < 8:
+            level -= 1
+        result = cv2.matchTemplate(
+            screen_pyramid[level], patch_pyramid[level], cv2.TM_CCOEFF_NORMED
+        )
+        coarse_h, coarse_w = patch_pyramid[level].shape[:2]
+        factor = 2**level
+        margin = 2 * factor
+
+        # 精匹配：对粗匹配的前几个峰值，在原始分辨率下附近的小窗口内搜索
+        # 缩小后相似的元素（列表行、同类按钮）得分接近，唯一性按精匹配得分判断
+        matches = []
+        for _ in range(self.candidates):
+            _, coarse_score, _, (coarse_x, coarse_y) = cv2.minMaxLoc(result)
+            if not np.isfinite(coarse_score) or coarse_score < 0:
+                break
+            left = max(0, coarse_x * factor - margin)
+            top = max(0, coarse_y * factor - margin)
+            window = screen[
+                top : top + patch_h + 2 * margin, left : left + patch_w + 2 * margin
+            ]
+            _, score, _, (match_x, match_y) = cv2.minMaxLoc(
+                cv2.matchTemplate(window, patch, cv2.TM_CCOEFF_NORMED)
+            )
+            if np.isfinite(score):
+                matches.append((score, left + match_x, top + match_y))
+            # 排除该峰值附近一个模板大小的范围
+            result[
+                max(0, coarse_y - coarse_h // 2) : coarse_y + coarse_h // 2 + 1,
+                max(0, coarse_x - coarse_w // 2) : coarse_x + coarse_w // 2 + 1,
+            ] = -1
+        if not matches:
+            return None
+        matches.sort(reverse=True)
+        score, match_x, match_y = matches[0]
+        if score < self.match_threshold:
+            return None
+        # 同一元素在相邻峰值中被重复找到时不算作次佳匹配
+        for other_score, other_x, other_y in matches[1:]:
+            if abs(other_x - match_x) < patch_w / 2 and abs(other_y - match_y) < patch_h / 2:
+                continue
+            if score - other_score < self.min_margin:
+                return None
+            break
+
+        entry = self.entries[key]
+        self.entries.move_to_end(key)
+        entry["last_used"] = time.time()
+        entry["hits"] = entry.get("hits", 0) + 1
+        offset_x, offset_y = entry["offset"]
+        return match_x + offset_x, match_y + offset_y, float(score)
+
+    def remove(self, target):
+        """删除目标及其模板文件，返回是否存在"""
+        key = normalize_target(target)
+        entry = self.entries.pop(key, None)
+        self._patches.pop(key, None)
+        if entry is None:
+            return False
+        try:
+            os.remove(os.path.join(self.directory, entry["file"]))
+        except OSError:
+            pass
+        return True
+
+    def clear(self):
+        """清空全部目标，返回删除的目标数"""
+        count = len(self.entries)
+        for key in list(self.entries):
+            self.remove(key)
+        return count
+
+
+def main():
+    """命令行入口：查看或清空目标模板缓存"""
+    parser = argparse.ArgumentParser(description="目标模板缓存管理")
+    parser.add_argument("command", choices=["clear", "stats"], help="要执行的命令")
+    parser.add_argument("--dir", default="cache/targets", help="缓存目录")
+    args = parser.parse_args()
+
+    cache = TargetCache(args.dir)
+    if args.command == "clear":
+        count = cache.clear()
+        cache.save()
+        print(f"已清除 {count} 个目标")
+    else:
+        print(f"目标数: {len(cache.entries)}")
+        for entry in reversed(cache.entries.values()):
+            print(f"  {entry['target']}: 命中 {entry.get('hits', 0)} 次")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+from benchmark.run_benchmark import run_benchmark
+from model_router import ModelRouter
+from vl_model_cli import TaskState, parse_ai_response
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CLICK = {
+    "status": "in_progress",
+    "action": {"type": "click", "coordinates": [500, 300], "text": ""},
+    "target": "按钮",
+    "description": "点击按钮",
+}
+
+
+@pytest.mark.parametrize("text", ["", "抱歉，我无法完成", "{bad json", "```json\nnope\n```"])
+def test_unparseable_response_sets_parse_failed(text):
+    response = parse_ai_response(text)
+    assert response.parse_failed
+    assert response.action["type"] == "wait"
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        '{"status": "in_progress", "action": {"type": "click", "coordinates": [1, 2]}}',
+        '{"status": "completed"}',
+        "action: click, coordinates: [1, 2]",
+    ],
+)
+def test_parsed_response_is_not_a_failure(text):
+    assert not parse_ai_response(text).parse_failed
+
+
+def test_router_escalates_on_parse_failure_and_steps_back_down():
+    router = ModelRouter(
+        [{"name": "fast", "model_name": "f"}, {"name": "strong", "model_name": "s"}]
+    )
+    task = TaskState("任务")
+    assert router.select(task, [])[0]["name"] == "fast"
+    tier, reasons = router.select(task, ["parse_failure"])
+    assert (tier["name"], reasons) == ("strong", ["parse_failure"])
+    assert router.select(task, [])[0]["name"] == "fast"
+
+
+def test_unparseable_output_routes_next_step_to_strong_model():
+    report = run_benchmark(
+        os.path.join(ROOT, "imgs", "label"),
+        tasks=1,
+        script=["这不是JSON", CLICK, CLICK],
+        base_config=os.path.join(ROOT, "config_example.json"),
+        max_iterations=3,
+        overrides={
+            "routing_config": {
+                "enabled": True,
+                "tiers": [
+                    {"name": "fast", "model_name": "fast"},
+                    {"name": "strong", "model_name": "strong"},
+                ],
+                "escalate_first_step": False,
+                "escalate_on_repetition": False,
+                "escalate_on_no_change": False,
+            },
+            "skip_config": {"enabled": False},
+            "settle_config": {"enabled": False},
+        },
+    )
+    assert report["model_names"] == {"fast": 2, "strong": 1}
+    assert report["routing"]["escalations"] == {"parse_failure": 1}
@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from streaming import IncrementalJSONParser
+
+RESPONSE = {
+    "status": "in_progress",
+    "action": {
+        "type": "drag",
+        "coordinates": [[100, 200], [300, 400]],
+        "text": "含有\"引号\"和 } 括号的文本",
+        "extra": {"nested": [1, {"deep": "]"}]},
+    },
+    "target": "滑块",
+    "description": "拖动滑块",
+}
+
+
+def feed_in_chunks(text, size):
+    parser = IncrementalJSONParser()
+    for start in range(0, len(text), size):
+        parser.feed(text[start : start + size])
+    return parser
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1000])
+def test_fields_survive_any_chunk_boundary(size):
+    text = "```json\n" + json.dumps(RESPONSE, ensure_ascii=False) + "\n```"
+    parser = feed_in_chunks(text, size)
+    assert parser.fields == RESPONSE
+    assert parser.closed
+
+
+def test_escaped_quotes_do_not_end_string_value():
+    parser = IncrementalJSONParser()
+    parser.feed('{"description": "按下 \\"确')
+    assert "description" not in parser.fields
+    parser.feed('定\\" 按钮\\\\", "status"')
+    assert parser.fields["description"] == '按下 "确定" 按钮\\'
+    assert not parser.has_fields("status")
+
+
+def test_nested_action_completes_before_object_ends():
+    parser = IncrementalJSONParser()
+    parser.feed('{"status": "in_progress", "action": {"type": "click", "coordinates": [5')
+    assert parser.has_fields("status")
+    assert not parser.has_fields("action")
+    parser.feed('00, 300], "text": "{["}, "description": "未结束')
+    assert parser.fields["action"] == {
+        "type": "click",
+        "coordinates": [500, 300],
+        "text": "{[",
+    }
+    assert not parser.closed
+
+
+def test_primitive_values_complete_on_delimiter():
+    parser = IncrementalJSONParser()
+    parser.feed('{"confidence": 0.9')
+    assert "confidence" not in parser.fields
+    parser.feed(', "done": true}')
+    assert parser.fields == {"confidence": 0.9, "done": True}
+    assert parser.closed
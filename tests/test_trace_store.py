@@ -0,0 +1,36 @@
+import numpy as np
+
+from trace_store import TraceReader, TraceWriter
+
+
+def test_trace_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    first = rng.integers(0, 256, (120, 160, 3), dtype=np.uint8)
+    # 小范围变化保存为差值帧
+    second = first.copy()
+    second[10:20, 10:30] = 255
+    # 完全不同的画面保存为新的关键帧
+    third = 255 - first
+
+    path = str(tmp_path / "trace")
+    writer = TraceWriter(path, delta_threshold=0.1)
+    writer.start(task="点击确定")
+    ids = [writer.add_frame(image) for image in (first, second, first, third)]
+    for index, frame_id in enumerate(ids, start=1):
+        writer.add_step({"iteration": index, "action": {"type": "click"}}, frame_id)
+    writer.close(status="completed")
+
+    assert writer.stats["duplicates"] == 1
+    assert writer.stats["deltas"] == 1
+    assert writer.stats["keyframes"] == 2
+
+    with TraceReader(path + ".seg") as reader:
+        assert reader.task() == {"task": "点击确定"}
+        steps = reader.steps()
+        assert [step["iteration"] for step in steps] == [1, 2, 3, 4]
+        assert steps[0]["frame"] == steps[2]["frame"]
+        for step, image in zip(steps, (first, second, first, third)):
+            assert np.array_equal(reader.frame(step["frame"]), image)
+        result = reader.result()
+        assert result["status"] == "completed"
+        assert result["stats"]["frames"] == 4
@@ -0,0 +1,320 @@
+"""
+任务轨迹存储
+每个任务的截图帧和每一步的消息、响应、操作、映射后的坐标和耗时追加写入一个段文件（.seg），
+另有定长记录的索引文件（.idx）记录每条记录的位置；读取时用mmap映射段文件按索引取记录。
+
+- 帧按内容哈希去重，同一帧只保存一次
+- 与当前关键帧相近的帧保存为相对关键帧的差值（未变化的像素为0），zlib压缩后通常只有几十KB
+- 哈希、差值和压缩在后台产物线程中进行，控制循环只提交任务
+
+用法:
+    python trace_store.py info traces/20240101-120000-1234-1
+    python trace_store.py export traces/20240101-120000-1234-1 out_dir
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+
+import cv2
+import numpy as np
+
+from screen_diff import downscale_gray, frame_difference
+
+SEGMENT_MAGIC = b"CVTSEG01"
+INDEX_MAGIC = b"CVTIDX01"
+# 索引记录：段文件中的偏移、长度、记录类型、帧哈希（非帧记录为全0）
+INDEX_ENTRY = struct.Struct("<QIB3x16s")
+# 帧记录头：高、宽、通道数；差值帧另有关键帧哈希
+FRAME_HEADER = struct.Struct("<III")
+DELTA_HEADER = struct.Struct("<III16s")
+
+KIND_KEYFRAME = 1
+KIND_DELTA = 2
+KIND_STEP = 3
+KIND_TASK = 4
+KIND_RESULT = 5
+
+_counter = itertools.count(1)
+
+
+def new_trace_path(directory):
+    """生成新的轨迹路径（不含扩展名），多个进程同时写同一目录时也不会重名"""
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_counter)}"
+    return os.path.join(directory, name)
+
+
+def compact_messages(messages):
+    """
+    复制消息并把图片data URL替换为占位说明（帧单独保存），
+    系统提示只在任务记录中保存一次
+    """
+    compacted = []
+    for message in messages:
+        content = message.get("content")
+        if message.get("role") == "system":
+            message = dict(message, content="<system_prompt>")
+        elif isinstance(content, list):
+            parts = []
+            for part in content:
+                if part.get("type") == "image_url":
+                    url = part.get("image_url", {}).get("url", "")
+                    part = {"type": "image_url", "image_url": {"url": f"<{len(url)} bytes>"}}
+                parts.append(part)
+            message = dict(message, content=parts)
+        compacted.append(message)
+    return compacted
+
+
+class TraceWriter:
+    """
+    单个任务的轨迹写入器
+    submit: 执行写入任务的函数（如后台产物写入器的submit），任务按提交顺序执行；
+    默认在调用线程中直接执行
+    """
+
+    def __init__(
+        self, path, delta_threshold=0.1, compression=1, thumbnail_edge=160, submit=None
+    ):
+        self.path = path
+        # 缩略图差异比例不超过该值时保存为差值帧，否则作为新的关键帧
+        self.delta_threshold = delta_threshold
+        self.compression = compression
+        self.thumbnail_edge = thumbnail_edge
+        self.submit = submit or (lambda func, *args: func(*args))
+        self.stats = {"frames": 0, "duplicates": 0, "keyframes": 0, "deltas": 0, "bytes": 0}
+
+        # 以下状态只在写入任务中访问（按顺序执行，无需加锁）
+        self._frame_ids = itertools.count(1)
+        self._frame_keys = {}
+        self._stored = set()
+        self._keyframe = None
+        self._segment = None
+        self._index = None
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._segment = open(self.path + ".seg", "wb")
+        self._segment.write(SEGMENT_MAGIC)
+        self._index = open(self.path + ".idx", "wb")
+        self._index.write(INDEX_MAGIC)
+
+    def _append(self, kind, payload, key=bytes(16)):
+        if self._segment is None:
+            self._open()
+        offset = self._segment.tell()
+        self._segment.write(payload)
+        self._index.write(INDEX_ENTRY.pack(offset, len(payload), kind, key))
+        self.stats["bytes"] += len(payload) + INDEX_ENTRY.size
+
+    def _append_json(self, kind, record):
+        payload = json.dumps(record, ensure_ascii=False, default=str).encode("utf-8")
+        self._append(kind, zlib.compress(payload, self.compression))
+        # 段文件先于索引落盘，读取时索引只会指向完整的记录
+        self._segment.flush()
+        self._index.flush()
+
+    def start(self, **fields):
+        """任务开始时的说明（任务内容、配置摘要等）"""
+        self.submit(self._append_json, KIND_TASK, fields)
+
+    def add_frame(self, image, thumbnail=None):
+        """提交一帧，返回在本轨迹中的编号（step记录中引用该编号）"""
+        frame_id = next(self._frame_ids)
+        self.submit(self._write_frame, frame_id, image, thumbnail)
+        return frame_id
+
+    def _write_frame(self, frame_id, image, thumbnail):
+        image = np.ascontiguousarray(image)
+        key = hashlib.blake2b(image.data, digest_size=16).digest()
+        self._frame_keys[frame_id] = key
+        self.stats["frames"] += 1
+        if key in self._stored:
+            self.stats["duplicates"] += 1
+            return
+        self._stored.add(key)
+
+        if thumbnail is None:
+            thumbnail = downscale_gray(image, self.thumbnail_edge)
+        height, width = image.shape[:2]
+        channels = image.shape[2] if image.ndim == 3 else 1
+        keyframe = self._keyframe
+        if (
+            keyframe is not None
+            and keyframe[1].shape == image.shape
+            and frame_difference(keyframe[2], thumbnail) <= self.delta_threshold
+        ):
+            # uint8减法按256取模，读取时加回关键帧即可还原
+            delta = np.subtract(image, keyframe[1])
+            payload = DELTA_HEADER.pack(height, width, channels, keyframe[0])
+            self._append(
+                KIND_DELTA, payload + zlib.compress(delta.data, self.compression), key
+            )
+            self.stats["deltas"] += 1
+        else:
+            payload = FRAME_HEADER.pack(height, width, channels)
+            self._append(
+                KIND_KEYFRAME, payload + zlib.compress(image.data, self.compression), key
+            )
+            self._keyframe = (key, image, thumbnail)
+            self.stats["keyframes"] += 1
+
+    def add_step(self, record, frame_id=None):
+        """提交一步的记录，frame_id为add_frame返回的编号"""
+        self.submit(self._write_step, record, frame_id)
+
+    def _write_step(self, record, frame_id):
+        key = self._frame_keys.pop(frame_id, None)
+        if key is not None:
+            record = dict(record, frame=key.hex())
+        self._append_json(KIND_STEP, record)
+
+    def close(self, **fields):
+        """写入任务结果并关闭文件"""
+        self.submit(self._close, fields)
+
+    def _close(self, fields):
+        self._append_json(KIND_RESULT, dict(fields, stats=self.stats))
+        self._segment.close()
+        self._index.close()
+        self._keyframe = None
+
+
+class TraceReader:
+    """用mmap读取轨迹，按索引取记录，帧按需解码"""
+
+    def __init__(self, path):
+        if path.endswith((".seg", ".idx")):
+            path = path[:-4]
+        self.path = path
+        with open(path + ".idx", "rb") as f:
+            data = f.read()
+        if data[: len(INDEX_MAGIC)] != INDEX_MAGIC:
+            raise ValueError(f"不是轨迹索引文件: {path}.idx")
+        body = data[len(INDEX_MAGIC) :]
+        body = body[: len(body) - len(body) % INDEX_ENTRY.size]
+
+        self._file = open(path + ".seg", "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[: len(SEGMENT_MAGIC)] != SEGMENT_MAGIC:
+            raise ValueError(f"不是轨迹段文件: {path}.seg")
+        # 写入中断时丢弃指向不完整记录的索引
+        self.entries = [
+            entry
+            for entry in INDEX_ENTRY.iter_unpack(body)
+            if entry[0] + entry[1] <= size
+        ]
+        self._frames = {
+            entry[3].hex(): entry
+            for entry in self.entries
+            if entry[2] in (KIND_KEYFRAME, KIND_DELTA)
+        }
+        self._decoded = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self._decoded.clear()
+        self._map.close()
+        self._file.close()
+
+    def _payload(self, entry):
+        offset, length = entry[0], entry[1]
+        return memoryview(self._map)[offset : offset + length]
+
+    def records(self, kind):
+        """指定类型的JSON记录"""
+        for entry in self.entries:
+            if entry[2] == kind:
+                yield json.loads(zlib.decompress(self._payload(entry)))
+
+    def task(self):
+        return next(self.records(KIND_TASK), None)
+
+    def steps(self):
+        return list(self.records(KIND_STEP))
+
+    def result(self):
+        return next(self.records(KIND_RESULT), None)
+
+    @property
+    def frame_keys(self):
+        return list(self._frames)
+
+    def frame(self, key):
+        """按哈希（十六进制）解码一帧，最近用到的关键帧保留在内存中"""
+        if key in self._decoded:
+            return self._decoded[key]
+        entry = self._frames[key]
+        payload = self._payload(entry)
+        if entry[2] == KIND_KEYFRAME:
+            height, width, channels = FRAME_HEADER.unpack_from(payload)
+            data = zlib.decompress(payload[FRAME_HEADER.size :])
+            image = np.frombuffer(data, np.uint8).reshape(
+                (height, width, channels) if channels > 1 else (height, width)
+            )
+            # 只缓存最近的关键帧，差值帧都基于它还原
+            self._decoded = {key: image}
+            return image
+        height, width, channels, base_key = DELTA_HEADER.unpack_from(payload)
+        base = self.frame(base_key.hex())
+        delta = np.frombuffer(
+            zlib.decompress(payload[DELTA_HEADER.size :]), np.uint8
+        ).reshape(base.shape)
+        return np.add(base, delta)
+
+
+def main():
+    """命令行入口：查看轨迹摘要，或导出每一步的标记截图和记录"""
+    parser = argparse.ArgumentParser(description="任务轨迹查看")
+    parser.add_argument("command", choices=["info", "export"], help="要执行的命令")
+    parser.add_argument("trace", help="轨迹路径（不含扩展名，或.seg/.idx文件）")
+    parser.add_argument("output", nargs="?", default=None, help="export的输出目录")
+    args = parser.parse_args()
+
+    with TraceReader(args.trace) as reader:
+        steps = reader.steps()
+        if args.command == "info":
+            task = reader.task() or {}
+            result = reader.result() or {}
+            print(f"任务: {task.get('task')}")
+            print(f"结果: {result.get('status')}  {result.get('result')}")
+            print(f"步数: {len(steps)}  不同的帧: {len(reader.frame_keys)}")
+            print(f"写入统计: {result.get('stats')}")
+            for step in steps:
+                print(
+                    f"  第 {step.get('iteration')} 步: {step.get('action', {}).get('type')} "
+                    f"{step.get('mapped')}  {step.get('latency', 0) * 1000:.0f}ms"
+                )
+            return
+
+        output = args.output or args.trace + "_export"
+        os.makedirs(output, exist_ok=True)
+        with open(os.path.join(output, "steps.jsonl"), "w", encoding="utf-8") as f:
+            for step in steps:
+                f.write(json.dumps(step, ensure_ascii=False) + "\n")
+        for step in steps:
+            if step.get("frame") is None:
+                continue
+            image = reader.frame(step["frame"]).copy()
+            for x, y in step.get("marks") or []:
+                cv2.circle(image, (x, y), 12, (0, 0, 255), 3)
+            cv2.imwrite(os.path.join(output, f"step{step['iteration']}.png"), image)
+        print(f"已导出 {len(steps)} 步到 {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,38 +3,89 @@ AI 智能控制系统 (命令行版本核心模块)
 完全照搬GUI版本逻辑
 """
 
+import asyncio
 import base64
 import json
 import os
 import platform
 import re
 import signal
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
-import numpy as np
-import pyautogui
-import pyperclip
-from openai import OpenAI
+
+try:
+    import pyautogui
+except Exception:
+    # 无图形界面（如未设置DISPLAY的Linux）时导入会失败，离线基准等场景会替换为模拟实现
+    pyautogui = None
+from openai import BadRequestError, UnprocessableEntityError
 from pydantic import BaseModel
 
+from action_cache import ActionCache
+from artifact_writer import ArtifactWriter
+from capture_backends import PyAutoGUIBackend, create_capture_backend
+from input_backends import PyAutoGUIInputBackend, create_input_backend
+from hedging import (
+    AsyncHedgedClient,
+    HedgedClient,
+    create_pool,
+    make_async_client,
+    make_client,
+    provider_list,
+)
+from element_detector import (
+    MARKS_PROMPT,
+    ElementDetector,
+    box_center,
+    draw_marks,
+    snap_to_element,
+)
+from metrics import NULL_RECORDER, SpanRecorder
+from model_router import REASON_TEXT, create_router, metric_name
+from screen_diff import (
+    changed_regions,
+    detect_dialog,
+    dhash,
+    downscale_gray,
+    frame_difference,
+    wait_for_screen_change,
+    wait_for_screen_settle,
+)
+from screen_frame import ScreenFrame, encode_png_base64
+from streaming import AsyncStreamingCompletion, StreamingCompletion
+from target_cache import TARGET_ACTIONS, TargetCache
+from trace_store import TraceWriter, compact_messages, new_trace_path
+from structured_output import (
+    build_response_format,
+    build_zoom_response_format,
+    validate_structured_response,
+    warm_response_validator,
+)
+from zoom_grounding import (
+    GROUNDING_PROMPT,
+    build_zoom_messages,
+    parse_zoom_response,
+    zoom_crop_box,
+    zoom_reason,
+)
+
 # 全局退出标志
 should_exit = False
 
+# 外部停止事件（如命令行界面的stop_event），置位后当前任务尽快停止
+stop_event = None
+
 # 全局回调函数，用于通知主程序AI输出的坐标
 coordinate_callback = None
 
-# 全局上下文历史记录（保存最近3次）
-conversation_history = []
-
-# 保存用户原始输入
-original_user_input = ""
-
 # 全局配置路径
 config_file_path = None
 
-# 记录最近的AI响应，用于检测重复
-recent_responses = []
+# 后台产物写入器（按需创建）
+artifact_writer = None
 
 current_os = platform.system()
 
@@ -56,6 +107,29 @@ def set_coordinate_callback(callback):
     coordinate_callback = callback
 
 
+# 设置外部停止事件
+def set_stop_event(event):
+    """event为threading.Event，置位后主循环在下一次检查时停止，异步主循环会立即取消进行中的请求"""
+    global stop_event
+    stop_event = event
+
+
+# 获取后台产物写入器
+def get_artifact_writer():
+    global artifact_writer
+    if artifact_writer is None:
+        artifact_config = {}
+        config = load_config() if config_file_path else None
+        if config:
+            artifact_config = config.get("artifact_config", {})
+        artifact_writer = ArtifactWriter(
+            max_pending=artifact_config.get("max_pending", 8),
+            policy=artifact_config.get("policy", "drop_oldest"),
+            log=log_print,
+        )
+    return artifact_writer
+
+
 # 信号处理函数
 def signal_handler(sig, frame):
     global should_exit
@@ -89,42 +163,148 @@ def load_config(config_path=None):
         return None
 
 
-# 截图函数
-def capture_screen_and_save(
-    save_path="imgs/screen.png", optimize_for_speed=True, max_png=1280
-):
-    """截图并保存"""
-    # 创建输出目录
-    output_dir = os.path.dirname(save_path)
-    if output_dir and not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+# 默认截图后端（pyautogui，调用时才解析模块，便于替换为模拟实现）
+default_capture_backend = PyAutoGUIBackend(
+    screenshot=lambda **kwargs: pyautogui.screenshot(**kwargs)
+)
+
+
+# 默认输入后端（与原有实现相同的时间配置）
+default_input_backend = PyAutoGUIInputBackend()
 
+
+# 截图函数（内存版本）
+def capture_frame(
+    optimize_for_speed=True, max_png=1280, spans=NULL_RECORDER, backend=None
+):
+    """截图并返回内存中的ScreenFrame，失败时返回None"""
+    backend = backend or default_capture_backend
     try:
         # 截图
-        screenshot = pyautogui.screenshot()
-        screenshot_np = np.array(screenshot)
-        screenshot_bgr = cv2.cvtColor(screenshot_np, cv2.COLOR_RGB2BGR)
+        with spans.span("screenshot"):
+            full_bgr = backend.grab()
+        screenshot_bgr = full_bgr
 
         scale = 1
         if optimize_for_speed:
-            height, width, _ = screenshot_bgr.shape
+            height, width, _ = full_bgr.shape
             max_edge = max(height, width)
             if max_edge > max_png:
                 scale = max_png / max_edge
-                screenshot_bgr = cv2.resize(screenshot_bgr, None, fx=scale, fy=scale)
+                with spans.span("resize"):
+                    # INTER_AREA缩小时不产生摩尔纹，小字更清晰
+                    screenshot_bgr = cv2.resize(
+                        full_bgr,
+                        (round(width * scale), round(height * scale)),
+                        interpolation=cv2.INTER_AREA,
+                    )
 
-        # 保存
-        save_params = (
-            [int(cv2.IMWRITE_PNG_COMPRESSION), 1] if optimize_for_speed else []
+        png_compression = 1 if optimize_for_speed else 3
+        return ScreenFrame(
+            screenshot_bgr,
+            scale=scale,
+            full_image=full_bgr,
+            png_compression=png_compression,
+            origin=backend.origin,
         )
-        success = cv2.imwrite(save_path, screenshot_bgr, save_params)
+    except Exception as e:
+        log_print(f"截图失败: {e}")
+        return None
+
+
+# 截取用于变化检测的灰度缩略图
+def grab_screen_thumbnail(max_edge=160, backend=None):
+    """截取屏幕并返回缩小后的灰度图，用于判断界面是否稳定"""
+    return (backend or default_capture_backend).grab_gray(max_edge)
+
+
+# 创建界面稳定等待函数
+def make_settle_waiter(config, backend=None):
+    """
+    根据settle_config创建等待函数，未启用时返回None
+    返回的函数接受可选的max_wait参数，用于覆盖配置的上限
+    """
+    settle_config = config.get("settle_config", {})
+    if not settle_config.get("enabled", False):
+        return None
+
+    thumbnail_edge = settle_config.get("thumbnail_edge", 160)
+
+    def settle(max_wait=None):
+        try:
+            settled, elapsed = wait_for_screen_settle(
+                lambda: grab_screen_thumbnail(thumbnail_edge, backend),
+                poll_interval=settle_config.get("poll_interval", 0.05),
+                stable_frames=settle_config.get("stable_frames", 2),
+                diff_threshold=settle_config.get("diff_threshold", 0.002),
+                max_wait=max_wait
+                if max_wait is not None
+                else settle_config.get("max_wait", 3.0),
+                min_wait=settle_config.get("min_wait", 0.0),
+            )
+        except Exception as e:
+            log_print(f"等待界面稳定失败: {e}")
+            return False
+        if settled:
+            log_print(f"⏱️  界面已稳定 ({elapsed * 1000:.0f}ms)")
+        else:
+            log_print(f"⏱️  界面未稳定，达到等待上限 ({elapsed:.1f}s)")
+        return settled
+
+    return settle
+
+
+# 截图函数
+def capture_screen_and_save(
+    save_path="imgs/screen.png", optimize_for_speed=True, max_png=1280
+):
+    """截图并保存"""
+    # 创建输出目录
+    output_dir = os.path.dirname(save_path)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    frame = capture_frame(optimize_for_speed=optimize_for_speed, max_png=max_png)
+    if frame is None:
+        return False, 1
 
-        return success, scale
+    try:
+        success = frame.save(save_path)
+        return success, frame.scale
     except Exception as e:
         log_print(f"截图失败: {e}")
         return False, 1
 
 
+# 保存帧到磁盘
+def save_frame(frame, save_path):
+    """将内存中的帧写入磁盘（供后台写入器调用）"""
+    output_dir = os.path.dirname(save_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    return frame.save(save_path)
+
+
+# 清空标记图片目录
+def clear_label_images(label_dir="imgs/label"):
+    """删除目录中旧的标记图片，目录不存在时创建"""
+    if not os.path.exists(label_dir):
+        os.makedirs(label_dir, exist_ok=True)
+        log_print("创建label目录")
+        return 0
+
+    count = 0
+    for file in os.listdir(label_dir):
+        if file.startswith("screen_label") and file.endswith(".png"):
+            try:
+                os.remove(os.path.join(label_dir, file))
+                count += 1
+            except Exception as e:
+                log_print(f"删除文件失败 {file}: {e}")
+    log_print(f"已清空之前的标记图片（{count} 个）")
+    return count
+
+
 # 坐标标记函数
 def mark_coordinate_on_image(
     coordinates,
@@ -133,9 +313,10 @@ def mark_coordinate_on_image(
     point_radius=10,
     point_color=(0, 0, 255),
     thickness=-1,
+    image=None,
 ):
-    """在图片上标记坐标点"""
-    if input_path is None:
+    """在图片上标记坐标点，传入image时直接使用内存中的图像"""
+    if input_path is None and image is None:
         input_path = "imgs/screen.png"
     if output_path is None:
         output_path = "imgs/label/screen_label.png"
@@ -146,8 +327,11 @@ def mark_coordinate_on_image(
         os.makedirs(output_dir)
 
     try:
-        # 读取图片
-        img = cv2.imread(input_path)
+        # 读取图片（内存图像需复制，避免污染发送给模型的帧）
+        if image is not None:
+            img = image.copy()
+        else:
+            img = cv2.imread(input_path)
         if img is None:
             log_print(f"无法读取图片: {input_path}")
             return False
@@ -185,10 +369,13 @@ def mark_coordinate_on_image(
 
 
 # 坐标映射（完全照搬GUI版本）
-def map_coordinates(x, y, scale, img_width=None, img_height=None):
+def map_coordinates(
+    x, y, scale, img_width=None, img_height=None, offset_x=0, offset_y=0
+):
     """
     将坐标映射到实际屏幕上
     完全照搬GUI版本的逻辑
+    offset_x/offset_y: 坐标所在子图（如变化区域裁剪图）在图像中的左上角偏移
     """
     # 确保坐标值在合理范围内
     x = max(-100000, min(100000, x))
@@ -204,6 +391,10 @@ def map_coordinates(x, y, scale, img_width=None, img_height=None):
         x_abs = x
         y_abs = y
 
+    # 加上子图偏移
+    x_abs += offset_x
+    y_abs += offset_y
+
     # 应用缩放比例映射到实际屏幕
     x_r = x_abs / scale
     y_r = y_abs / scale
@@ -223,12 +414,21 @@ def move_mouse_to_coordinates(
     scale=1,
     img_width=None,
     img_height=None,
-    duration=0.1,
+    duration=None,
+    settle=None,
+    offset_x=0,
+    offset_y=0,
+    input_backend=None,
 ):
     """
     移动鼠标到指定坐标并执行操作
     完全照搬GUI版本的逻辑
+    duration: 鼠标移动时长，None时使用输入后端的时间配置
+    settle: 可选的界面稳定等待函数，提供时替代固定的等待时间
+    offset_x/offset_y: 坐标基于裁剪图时，裁剪图在图像中的偏移
+    input_backend: 执行键鼠操作的后端，None时使用默认的pyautogui后端
     """
+    backend = input_backend or default_input_backend
 
     # 验证坐标有效性的辅助函数
     def validate_coordinate(coord):
@@ -269,7 +469,7 @@ def move_mouse_to_coordinates(
                 keys = ["win" if key == "meta" else key for key in keys]
 
             log_print(f"执行热键操作: {'+'.join(keys)}")
-            pyautogui.hotkey(*keys)
+            backend.hotkey(*keys)
             action_str = f"执行热键操作: {'+'.join(keys)}" + "\n"
         else:
             log_print("热键操作但未提供快捷键信息")
@@ -282,12 +482,14 @@ def move_mouse_to_coordinates(
 
         # 映射坐标
         start_x, start_y = map_coordinates(
-            start_x, start_y, scale, img_width, img_height
+            start_x, start_y, scale, img_width, img_height, offset_x, offset_y
+        )
+        end_x, end_y = map_coordinates(
+            end_x, end_y, scale, img_width, img_height, offset_x, offset_y
         )
-        end_x, end_y = map_coordinates(end_x, end_y, scale, img_width, img_height)
 
-        pyautogui.moveTo(start_x, start_y, duration=duration)
-        pyautogui.dragTo(end_x, end_y, duration=duration * 10)
+        backend.move_to(start_x, start_y, duration=duration)
+        backend.drag_to(end_x, end_y, None if duration is None else duration * 10)
         log_print(f"已完成拖拽操作: ({start_x}, {start_y}) -> ({end_x}, {end_y})")
         action_str = (
             action_str
@@ -301,10 +503,12 @@ def move_mouse_to_coordinates(
         x, y = coordinates
 
         # 映射坐标
-        x, y = map_coordinates(x, y, scale, img_width, img_height)
+        x, y = map_coordinates(
+            x, y, scale, img_width, img_height, offset_x, offset_y
+        )
 
         # 移动鼠标
-        pyautogui.moveTo(x, y, duration=duration)
+        backend.move_to(x, y, duration=duration)
         log_print(f"🖱️  移动到坐标: ({x:.0f}, {y:.0f})")
         action_str = f"鼠标已移动到坐标: ({x}, {y})" + "\n"
 
@@ -313,58 +517,230 @@ def move_mouse_to_coordinates(
 
         # 执行相应操作
         if action == "click":
-            pyautogui.click()
+            backend.click()
             log_print(f"👆 点击完成")
             action_str = action_str + f"已点击 ({x}, {y})" + "\n"
         elif action == "double_click":
-            pyautogui.doubleClick()
+            backend.double_click()
             log_print(f"已双击 ({x}, {y})")
             action_str = action_str + f"已双击 ({x}, {y})" + "\n"
         elif action == "long_press":
-            pyautogui.mouseDown()
+            backend.mouse_down()
             log_print(f"已长按 ({x}, {y})")
             action_str = action_str + f"已长按 ({x}, {y})" + "\n"
         elif action == "right_click":
-            pyautogui.rightClick()
+            backend.right_click()
             log_print(f"已右键点击 ({x}, {y})")
             action_str = action_str + f"已右键点击 ({x}, {y})" + "\n"
         elif action == "scroll_up":
-            pyautogui.scroll(500)
+            backend.scroll(500)
             log_print(f"已向上滚动 ({x}, {y})")
             action_str = action_str + f"已向上滚动 ({x}, {y})" + "\n"
         elif action == "scroll_down":
-            pyautogui.scroll(-500)
+            backend.scroll(-500)
             log_print(f"已向下滚动 ({x}, {y})")
             action_str = action_str + f"已向下滚动 ({x}, {y})" + "\n"
         else:
             log_print(f"未知操作: {action}")
 
-    time.sleep(0.2)
+    if settle:
+        settle()
+    else:
+        backend.wait("before_type")
     if type_information != "" and action != "hotkey":
-        pyperclip.copy(type_information)
-
-        # 根据操作系统执行粘贴（照搬GUI版本逻辑）
-        current_os = platform.system()
-        time.sleep(0.1)
-        if current_os == "Darwin":  # macOS
-            # macOS上使用更可靠的粘贴方法
-            time.sleep(0.2)
-            pyautogui.keyDown("command")
-            time.sleep(0.1)
-            pyautogui.press("v")
-            time.sleep(0.1)
-            pyautogui.keyUp("command")
-        else:  # Windows和其他系统
-            pyautogui.hotkey("ctrl", "v")
-
-        log_print(f"⌨️  粘贴文本: {type_information}")
-        time.sleep(0.5)
-        pyautogui.press("enter")
-        action_str = action_str + f"已粘贴文本: {type_information}" + "\n"
+        # 短ASCII文本直接键入，其余经剪贴板粘贴（照搬GUI版本逻辑）
+        method = backend.type_text(type_information)
+
+        if method == "type":
+            log_print(f"⌨️  键入文本: {type_information}")
+        else:
+            log_print(f"⌨️  粘贴文本: {type_information}")
+        if settle:
+            settle()
+        else:
+            backend.wait("after_type")
+        backend.press("enter")
+        action_str = action_str + f"已输入文本: {type_information}" + "\n"
 
     return action_str, mapped_coordinates
 
 
+# 按界面元素修正坐标
+def resolve_element_coordinates(action, coordinates, frame, som_config):
+    """
+    action带有有效的元素编号时返回该元素中心，否则按配置把单点坐标吸附到附近元素的中心
+    输入输出均为基于frame的0~1000相对坐标
+    """
+    boxes = frame.elements
+    mark = action.get("mark")
+    if isinstance(mark, int) and 1 <= mark <= len(boxes):
+        center_x, center_y = box_center(boxes[mark - 1])
+        log_print(f"🔢 使用元素编号 {mark}")
+    elif (
+        som_config.get("snap", True)
+        and isinstance(coordinates, list)
+        and len(coordinates) >= 2
+        and all(isinstance(value, (int, float)) for value in coordinates[:2])
+    ):
+        x = coordinates[0] / 1000 * frame.width
+        y = coordinates[1] / 1000 * frame.height
+        center_x, center_y, index = snap_to_element(
+            x,
+            y,
+            boxes,
+            max_distance=som_config.get("snap_distance", 20),
+            max_box_edge=som_config.get("snap_max_box_edge", 120),
+        )
+        if index is None:
+            return coordinates
+        log_print(f"🧲 坐标吸附到元素 {index}")
+    else:
+        return coordinates
+    return [center_x / frame.width * 1000, center_y / frame.height * 1000]
+
+
+# 构建变化区域增量消息
+def build_delta_content(previous_frame, frame, delta_config):
+    """
+    对比上一帧与当前帧，生成"整屏缩略图 + 变化区域原始分辨率裁剪"的消息内容
+    返回 (content列表, 区域列表)，不适合增量发送时返回 (None, None)
+    区域列表中每项为原始分辨率下的 (left, top, width, height)
+    """
+    if previous_frame is None:
+        return None, None
+
+    regions = changed_regions(
+        previous_frame.image,
+        frame.image,
+        pixel_threshold=delta_config.get("pixel_threshold", 16),
+        padding=delta_config.get("padding", 8),
+        max_regions=delta_config.get("max_regions", 4),
+    )
+    if regions is None:
+        return None, None
+
+    # 变化面积过大时直接发送整帧
+    changed_area = sum(w * h for _, _, w, h in regions)
+    if changed_area > frame.width * frame.height * delta_config.get(
+        "max_changed_ratio", 0.4
+    ):
+        return None, None
+
+    crops = [frame.crop_full(*region) for region in regions]
+    crops = [(crop, box) for crop, box in crops if crop.size > 0]
+
+    # 裁剪图总像素超过整帧时增量发送没有收益
+    if sum(crop.shape[0] * crop.shape[1] for crop, _ in crops) > (
+        frame.width * frame.height
+    ):
+        return None, None
+
+    full_height, full_width = frame.full_image.shape[:2]
+    thumbnail = frame.thumbnail_base64(delta_config.get("thumbnail_max_edge", 640))
+    content = [
+        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{thumbnail}"}}
+    ]
+
+    if crops:
+        lines = ["第1张图片为整个屏幕的低分辨率缩略图，之后依次为发生变化区域的原始分辨率裁剪图："]
+        for index, (crop, (left, top, width, height)) in enumerate(crops, start=1):
+            x1 = round(left / full_width * 1000)
+            y1 = round(top / full_height * 1000)
+            x2 = round((left + width) / full_width * 1000)
+            y2 = round((top + height) / full_height * 1000)
+            lines.append(f"区域{index}：位于整屏坐标 [{x1}, {y1}] 至 [{x2}, {y2}]")
+            content.append(
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": "data:image/png;base64,"
+                        + encode_png_base64(crop, frame.png_compression)
+                    },
+                }
+            )
+        lines.append(
+            "坐标默认基于整个屏幕的0-1000网格；"
+            "如果坐标是基于某个区域裁剪图给出的，请在action中加入 \"region\": 区域编号，"
+            "此时coordinates为该裁剪图自身的0-1000网格坐标。"
+        )
+    else:
+        lines = ["屏幕与上一张截图相比没有明显变化，以下为整个屏幕的低分辨率缩略图。"]
+    # 界面元素编号只绘制在缩略图上，mark按整屏元素解析
+    if frame.overlay is not None:
+        lines.append("界面元素编号标记绘制在缩略图上，使用mark时不要同时填写region。")
+
+    content.insert(0, {"type": "text", "text": "\n".join(lines)})
+    return content, [box for _, box in crops]
+
+
+# 压缩历史消息中的截图
+def compact_user_message(message, frame, history_config):
+    """
+    按history_config.image_policy压缩历史用户消息中的图片
+    - full: 保留原图
+    - thumbnail: 所有图片替换为一张整屏缩略图
+    - drop: 去掉图片，只保留文字
+    """
+    policy = history_config.get("image_policy", "thumbnail")
+    if policy == "full":
+        return message
+
+    text_parts = [part for part in message["content"] if part.get("type") == "text"]
+    if policy == "drop":
+        return {
+            "role": message["role"],
+            "content": text_parts + [{"type": "text", "text": "（历史截图已省略）"}],
+        }
+
+    thumbnail = frame.thumbnail_base64(history_config.get("thumbnail_max_edge", 320))
+    # 增量帧的区域说明对缩略图不再适用，只保留第一段任务文字
+    return {
+        "role": message["role"],
+        "content": text_parts[:1]
+        + [
+            {
+                "type": "image_url",
+                "image_url": {"url": f"data:image/png;base64,{thumbnail}"},
+            }
+        ],
+    }
+
+
+# 记录一轮对话到历史上下文
+def record_history(task, user_message, frame, ai_response_text, history_config):
+    """保存本轮对话，并处理重复响应检测和历史长度限制"""
+    history_turns = history_config.get("max_turns", 3)
+
+    # 图片按策略压缩，模型的描述和操作文字作为记忆保留
+    try:
+        history_user_message = compact_user_message(
+            user_message, frame, history_config
+        )
+    except Exception as e:
+        log_print(f"压缩历史截图失败: {e}")
+        history_user_message = user_message
+    history_item = {
+        "user_message": history_user_message,
+        "assistant_message": {"role": "assistant", "content": ai_response_text},
+    }
+    task.conversation_history.append(history_item)
+
+    # 检测连续三次相同响应
+    task.recent_responses.append(ai_response_text)
+    if len(task.recent_responses) > 3:
+        task.recent_responses.pop(0)
+
+    # 如果最近三次响应相同，清空历史记录
+    if len(task.recent_responses) == 3 and len(set(task.recent_responses)) == 1:
+        log_print("🔄 检测到连续三次相同响应，清空历史记录重新开始")
+        task.conversation_history.clear()
+        task.recent_responses.clear()
+
+    # 只保留最近几次记录
+    while len(task.conversation_history) > history_turns:
+        task.conversation_history.pop(0)
+
+
 # 编码图片为base64
 def encode_image(image_path):
     """将图片编码为base64格式"""
@@ -382,6 +758,9 @@ class AIResponse(BaseModel):
     description: str = ""
     target: str = ""
     action: dict = {}
+    # 多步计划：action之后依次执行的操作，以及执行时的检查条件
+    next_actions: list = []
+    guard: dict = {}
 
     # 兼容旧格式字段
     current_status: str = ""
@@ -390,7 +769,20 @@ class AIResponse(BaseModel):
     coordinates: list = []
     type_information: str = ""
 
+    # 响应无法解析（没有JSON、文本中也找不到操作，或解析出错），此时action为默认的wait
+    parse_failed: bool = False
+
     def __init__(self, **data):
+        # 以actions列表给出全部操作时，第一个作为action，其余作为后续操作
+        actions = data.pop("actions", None)
+        if isinstance(actions, list) and actions and not data.get("action"):
+            data["action"] = actions[0]
+            data["next_actions"] = actions[1:]
+        if not isinstance(data.get("next_actions", []), list):
+            data["next_actions"] = []
+        if not isinstance(data.get("guard", {}), dict):
+            data["guard"] = {}
+
         # 处理action字段的类型转换
         if "action" in data and isinstance(data["action"], str):
             # 如果action是字符串，转换为字典格式
@@ -473,10 +865,14 @@ def parse_ai_response(response_text):
             text = text_match.group(1) if text_match else ""
 
         return AIResponse(
+            parse_failed=not response_data and action_match is None,
             status=response_data.get("status", "in_progress"),
             description=response_data.get("description", ""),
             target=response_data.get("target", ""),
             action=response_data.get("action", {}),
+            actions=response_data.get("actions"),
+            next_actions=response_data.get("next_actions", []),
+            guard=response_data.get("guard", {}),
             current_status=current_status,
             whether_completed=whether_completed,
             element_info=element_info,
@@ -487,43 +883,61 @@ def parse_ai_response(response_text):
     except Exception as e:
         log_print(f"解析AI响应失败: {e}")
         log_print(f"响应内容: {response_text}")
-        return AIResponse(action="wait", coordinate=[], coordinates=[], text="")
-
-
-# 主控制函数
-def auto_control_computer(user_content):
-    """自动控制电脑的主函数"""
-    global should_exit, original_user_input
+        return AIResponse(
+            action="wait", coordinate=[], coordinates=[], text="", parse_failed=True
+        )
 
-    # 保存用户原始输入
-    original_user_input = user_content
 
-    # 加载配置
+# 清空动作缓存
+def clear_action_cache(task=None):
+    """清空动作录制回放缓存，传入task时只清除该任务"""
     config = load_config()
     if not config:
-        return "配置加载失败"
+        return 0
+    cache_config = config.get("action_cache_config", {})
+    action_cache = ActionCache(
+        cache_config.get("path", "cache/action_cache.json"), log=log_print
+    )
+    count = action_cache.invalidate(task=task)
+    action_cache.save()
+    log_print(f"已清除 {count} 条动作缓存")
+    return count
 
-    # 获取配置参数
-    api_key = config["api_config"]["api_key"]
-    base_url = config["api_config"]["base_url"]
-    model_name = config["api_config"]["model_name"]
-    max_iterations = config["execution_config"]["max_visual_model_iterations"]
 
-    if not api_key:
-        return "API密钥未配置"
+# 记录token用量
+def record_usage(metrics, usage):
+    """把模型返回的usage记录到耗时统计中"""
+    if usage is None or not metrics.enabled:
+        return
+    metrics.add("prompt_tokens", getattr(usage, "prompt_tokens", None))
+    metrics.add("completion_tokens", getattr(usage, "completion_tokens", None))
 
-    # 初始化OpenAI客户端
-    client = OpenAI(api_key=api_key, base_url=base_url)
 
-    # 读取系统提示（使用新版本prompt）
-    system_prompt_file = (
-        "get_next_action_AI_mac_new.md"
-        if current_os == "Darwin"
-        else "get_next_action_AI_new.md"
-    )
+# 流式模式追加的系统提示
+STREAM_FIELD_ORDER_PROMPT = """
+
+## 字段顺序
 
+请严格按照 status、action、target、description 的顺序输出JSON字段，系统会在 action 输出完整后立即执行操作。
+"""
+
+
+# 启用多步计划时追加的系统提示
+PLAN_PROMPT = """
+
+## 多步操作（可选，本节优先于"单步聚焦"约束）
+
+当接下来的几步操作完全确定、无需查看新的截图时（例如规则7：点击输入框、全选、删除、再输入），可以在 action 之外增加 next_actions 字段，按顺序列出 action 之后的操作（每项格式与 action 相同，最多 {max_next} 项，坐标均基于当前截图）。
+系统会在本地依次执行，并在每步之间检查屏幕：屏幕变化过大或弹出对话框时，会停止执行剩余操作并重新截图。
+可选的 guard 字段用于收紧检查条件，例如 "guard": {{"max_change": 0.2, "stop_on_dialog": true}}，max_change 为相对当前截图允许变化的像素比例。
+不确定后续界面会如何变化时，不要输出 next_actions。
+"""
+
+
+# 读取系统提示文件
+def load_system_prompt(system_prompt_file):
+    """尝试多种编码读取系统提示文件，失败时返回None"""
     try:
-        # 尝试多种编码方式读取文件
         encodings = ["utf-8", "utf-8-sig", "gbk", "latin1"]
         system_prompt = None
 
@@ -540,69 +954,680 @@ def auto_control_computer(user_content):
 
         if system_prompt is None:
             log_print("无法读取系统提示文件")
-            return "系统提示文件读取失败"
+            return None
 
         # 清理可能的无效字符
-        system_prompt = system_prompt.encode("utf-8", errors="ignore").decode("utf-8")
+        return system_prompt.encode("utf-8", errors="ignore").decode("utf-8")
 
     except Exception as e:
         log_print(f"读取系统提示文件失败: {e}")
-        return "系统提示文件读取失败"
+        return None
 
-    log_print(f"开始执行任务: {user_content}")
-    log_print(f"最大迭代次数: {max_iterations}")
 
-    iteration = 0
+# 获取文件修改时间
+def _file_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
 
-    while iteration < max_iterations and not should_exit:
-        iteration += 1
-        log_print(f"\n🔄 === 第 {iteration} 次迭代 ===")
 
-        # 截图
-        log_print("📸 正在截取屏幕...")
-        success, scale = capture_screen_and_save(
-            save_path=config["screenshot_config"]["input_path"],
-            optimize_for_speed=config["screenshot_config"]["optimize_for_speed"],
-            max_png=config["screenshot_config"]["max_png"],
+# 单个任务的状态
+class TaskState:
+    """单个任务独立持有的状态，任务之间互不影响"""
+
+    def __init__(self, user_content):
+        # 用户原始输入
+        self.user_content = user_content
+        # 上下文历史记录
+        self.conversation_history = []
+        # 最近的AI响应，用于检测重复
+        self.recent_responses = []
+        self.iteration = 0
+
+        # 屏幕未变化跳过模型调用
+        self.last_sent_thumbnail = None
+        self.last_sent_frame = None
+        self.consecutive_skips = 0
+
+        # 动作缓存：已做出决策的步数、待验证的步骤、已验证的步骤
+        self.step_index = 0
+        self.cache_bypass_step = None
+        self.pending_check = None
+        self.verified_steps = []
+        # 待验证的目标点击：屏幕变化后把点击点附近的图像存为该目标的模板
+        self.pending_target = None
+
+        # 分层模型路由：当前层级、降级前的连续成功步数、本步使用的层级
+        self.route_level = 0
+        self.route_successes = 0
+        self.route_tier = None
+        # 已调用模型的步数、上一步执行的操作类型、上一步响应是否无法解析（决定是否升级模型）
+        self.model_calls = 0
+        self.last_action_type = None
+        self.parse_failed = False
+
+        # 多步计划中止时，提示模型下一轮按单步决策
+        self.plan_note = None
+        self.plan_single_step = False
+
+        # 分阶段耗时统计（未启用时为空实现）
+        self.metrics = NULL_RECORDER
+        # 轨迹写入器（未启用时为None）和本步待写入的轨迹记录
+        self.trace = None
+        self.trace_step = None
+
+        # 执行限制与结果统计
+        self.max_iterations = None
+        self.time_limit = None
+        self.deadline = None
+        self.status = "running"
+        self.result = None
+        self.started_at = None
+        self.wall_time = 0.0
+        self.step_latencies = []
+        # 任务被取消（异步主循环）后，执行器线程中尚未执行的操作不再执行
+        self.cancel_event = threading.Event()
+
+
+# 常驻会话
+class AgentSession:
+    """
+    跨任务复用的会话
+    配置和系统提示只在文件修改后重新加载，OpenAI客户端及其连接池在任务之间保持
+    """
+
+    def __init__(self, config_path=None, prompt_path=None):
+        self.config_path = config_path
+        # 指定时代替按系统选择的提示文件（如离线评估新版本的提示）
+        self.prompt_path = prompt_path
+        self.config = None
+        self.system_prompt = None
+        self.client = None
+        # 异步客户端绑定创建它的事件循环，事件循环变化时重新创建
+        self.async_client = None
+        self._async_client_key = None
+        # 异步主循环中截图、编码和执行操作所用的线程池
+        self._executor = None
+        # 配置了多个模型服务时的服务统计（对冲阈值和服务顺序），同步和异步客户端共用
+        self.provider_pool = None
+        self._providers = None
+        self.action_cache = None
+        self.element_detector = None
+        self.target_cache = None
+        self.router = None
+        self.capture_backend = None
+        self.input_backend = None
+        self.settle = None
+        # 当前模型服务是否支持response_format（请求被拒绝后置为False）
+        self.structured_supported = True
+
+        self._config_mtime = None
+        self._prompt_path = None
+        self._prompt_mtime = None
+        self._client_key = None
+        self._cache_key = None
+        self._som_key = None
+        self._target_key = None
+        self._routing_key = None
+        self._capture_key = None
+        self._input_key = None
+
+    # 按需重新加载配置和系统提示
+    def refresh(self):
+        """文件有修改时重新加载，返回错误信息，成功时返回None"""
+        path = self.config_path or config_file_path
+        if path is None:
+            log_print("未设置配置文件路径")
+            return "配置加载失败"
+
+        mtime = _file_mtime(path)
+        if self.config is None or mtime != self._config_mtime:
+            config = load_config(path)
+            if not config:
+                return "配置加载失败"
+            self.config = config
+            self._config_mtime = mtime
+            self._prompt_mtime = None
+
+            # 截图后端配置不变时复用（保留其缓冲区和X连接）
+            screenshot_config = config["screenshot_config"]
+            capture_key = json.dumps(
+                [
+                    screenshot_config.get(key)
+                    for key in (
+                        "backend",
+                        "region",
+                        "monitor",
+                        "replay_path",
+                        "replay_advance",
+                    )
+                ]
+            )
+            if self.capture_backend is None or capture_key != self._capture_key:
+                try:
+                    backend = create_capture_backend(screenshot_config)
+                except Exception as e:
+                    log_print(f"创建截图后端失败: {e}")
+                    return "截图后端创建失败"
+                if self.capture_backend is not None:
+                    self.capture_backend.close()
+                self.capture_backend = backend
+                self._capture_key = capture_key
+                log_print(f"🖥️  截图后端: {backend.name}")
+            self.settle = make_settle_waiter(config, self.capture_backend)
+
+            # 输入后端
+            input_key = json.dumps(
+                [config.get("input_config", {}), config.get("mouse_config", {})],
+                sort_keys=True,
+            )
+            if self.input_backend is None or input_key != self._input_key:
+                try:
+                    backend = create_input_backend(config, log=log_print)
+                except Exception as e:
+                    log_print(f"创建输入后端失败: {e}")
+                    return "输入后端创建失败"
+                if self.input_backend is not None:
+                    self.input_backend.close()
+                self.input_backend = backend
+                self._input_key = input_key
+                log_print(f"⌨️  输入后端: {backend.name}")
+
+        config = self.config
+        providers = provider_list(config)
+        if not all(provider.get("api_key") for provider in providers):
+            return "API密钥未配置"
+
+        # 读取系统提示（使用新版本prompt）
+        prompt_path = self.prompt_path or (
+            "get_next_action_AI_mac_new.md"
+            if current_os == "Darwin"
+            else "get_next_action_AI_new.md"
+        )
+        prompt_mtime = _file_mtime(prompt_path)
+        if (
+            self.system_prompt is None
+            or prompt_path != self._prompt_path
+            or prompt_mtime != self._prompt_mtime
+        ):
+            system_prompt = load_system_prompt(prompt_path)
+            if system_prompt is None:
+                return "系统提示文件读取失败"
+            # 流式模式下要求模型先输出status和action，以便尽早执行操作
+            if config.get("ai_config", {}).get("stream", False):
+                system_prompt += STREAM_FIELD_ORDER_PROMPT
+            # 启用多步计划时说明next_actions格式
+            plan_config = config.get("plan_config", {})
+            if plan_config.get("enabled", False):
+                system_prompt += PLAN_PROMPT.format(
+                    max_next=max(1, plan_config.get("max_actions", 4) - 1)
+                )
+            # 启用放大定位时要求输出置信度和目标外接框
+            if config.get("zoom_config", {}).get("enabled", False):
+                system_prompt += GROUNDING_PROMPT
+            # 在截图上绘制元素编号时说明mark字段
+            som_config = config.get("som_config", {})
+            if som_config.get("enabled", False) and som_config.get("overlay", True):
+                system_prompt += MARKS_PROMPT
+            self.system_prompt = system_prompt
+            self._prompt_path = prompt_path
+            self._prompt_mtime = prompt_mtime
+
+        # API配置不变时复用客户端（保持长连接，省去TCP/TLS握手）
+        client_key = json.dumps(
+            [providers, config.get("provider_config", {})], sort_keys=True
         )
+        if self.client is None or client_key != self._client_key:
+            if self.client is not None:
+                self.client.close()
+            if len(providers) > 1:
+                # 多个模型服务：超过首选服务的p95耗时未返回时对冲请求下一个服务
+                self.provider_pool = create_pool(config, log=log_print)
+                self.client = HedgedClient(self.provider_pool)
+                log_print(
+                    "🔀 模型服务: "
+                    + " → ".join(provider["name"] for provider in providers)
+                )
+            else:
+                self.provider_pool = None
+                self.client = make_client(providers[0])
+            self._providers = providers
+            self._client_key = client_key
+            self.structured_supported = True
+            self.async_client = None
+
+        # 动作缓存配置不变时复用
+        cache_config = config.get("action_cache_config", {})
+        cache_key = json.dumps(cache_config, sort_keys=True)
+        if cache_key != self._cache_key:
+            self.action_cache = None
+            if cache_config.get("enabled", False):
+                self.action_cache = ActionCache(
+                    cache_config.get("path", "cache/action_cache.json"),
+                    max_entries=cache_config.get("max_entries", 500),
+                    max_distance=cache_config.get("max_distance", 10),
+                    log=log_print,
+                )
+            self._cache_key = cache_key
+
+        # 元素检测器配置不变时复用（保留检测结果缓存）
+        som_config = config.get("som_config", {})
+        som_key = json.dumps(som_config, sort_keys=True)
+        if som_key != self._som_key:
+            self.element_detector = None
+            if som_config.get("enabled", False):
+                self.element_detector = ElementDetector(
+                    cache_size=som_config.get("cache_size", 32),
+                    min_size=som_config.get("min_size", 8),
+                    max_elements=som_config.get("max_elements", 60),
+                )
+            self._som_key = som_key
+
+        # 目标模板缓存配置不变时复用（保留已解码的模板）
+        target_config = config.get("target_cache_config", {})
+        target_key = json.dumps(target_config, sort_keys=True)
+        if target_key != self._target_key:
+            self.target_cache = None
+            if target_config.get("enabled", False):
+                self.target_cache = TargetCache(
+                    target_config.get("directory", "cache/targets"),
+                    max_entries=target_config.get("max_entries", 200),
+                    patch_edge=target_config.get("patch_edge", 64),
+                    pyramid_levels=target_config.get("pyramid_levels", 2),
+                    match_threshold=target_config.get("match_threshold", 0.9),
+                    min_margin=target_config.get("min_margin", 0.05),
+                    log=log_print,
+                )
+            self._target_key = target_key
 
-        if not success:
-            log_print("❌ 截图失败")
-            continue
+        # 分层模型路由配置不变时复用（保留各层级的统计）
+        routing_config = config.get("routing_config", {})
+        routing_key = json.dumps(routing_config, sort_keys=True)
+        if routing_key != self._routing_key:
+            self.router = create_router(config)
+            self._routing_key = routing_key
 
-        # 获取图片尺寸用于坐标映射
-        screenshot_path = config["screenshot_config"]["input_path"]
-        img = cv2.imread(screenshot_path)
-        if img is not None:
-            img_height, img_width = img.shape[:2]
-        else:
-            img_width = img_height = None
+        # 启用结构化输出时预先编译响应校验器（已编译过的直接复用）
+        if self._structured_output_active():
+            warm_response_validator(**self._schema_features())
+
+        return None
+
+    def close(self):
+        """关闭客户端连接池、线程池和截图、输入后端"""
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+        # 异步客户端需要在事件循环中关闭（见aclose），这里只释放引用
+        self.async_client = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self.capture_backend is not None:
+            self.capture_backend.close()
+            self.capture_backend = None
+        if self.input_backend is not None:
+            self.input_backend.close()
+            self.input_backend = None
+
+    # 各模型服务的请求统计
+    def provider_stats(self):
+        """配置了多个模型服务时返回 {服务名: 统计}，否则返回None"""
+        if self.provider_pool is None:
+            return None
+        return self.provider_pool.summary()
+
+    # 各模型层级的统计
+    def route_stats(self):
+        """启用分层模型路由时返回各层级的步数、耗时和升级原因，否则返回None"""
+        if self.router is None:
+            return None
+        return self.router.summary()
+
+    async def aclose(self):
+        """在事件循环中关闭异步客户端，再关闭其余资源"""
+        if self.async_client is not None:
+            try:
+                await self.async_client.close()
+            except Exception as e:
+                # 客户端由其他（已关闭的）事件循环创建时无法在此关闭
+                log_print(f"关闭异步客户端失败: {e}")
+        self.close()
+
+    # 执行一个任务
+    def run_task(self, user_content, max_iterations=None, time_limit=None):
+        """执行一个任务，返回结果描述"""
+        return self.execute_task(user_content, max_iterations, time_limit).result
+
+    def execute_task(self, user_content, max_iterations=None, time_limit=None):
+        """
+        执行一个任务，返回包含结果、状态和耗时统计的TaskState
+        max_iterations/time_limit 未指定时使用配置中的值
+        """
+        task = TaskState(user_content)
+        start = time.monotonic()
+        try:
+            if self._begin_task(task, start, max_iterations, time_limit):
+                task.result = self._run_task(task)
+            return task
+        finally:
+            self._end_task(task, start)
+            # 任务结束时写完所有后台产物
+            if artifact_writer is not None:
+                artifact_writer.flush(timeout=10)
+
+    # 执行一个任务（异步）
+    async def run_task_async(self, user_content, max_iterations=None, time_limit=None):
+        """在事件循环中执行一个任务，返回结果描述"""
+        task = await self.execute_task_async(user_content, max_iterations, time_limit)
+        return task.result
+
+    async def execute_task_async(
+        self, user_content, max_iterations=None, time_limit=None
+    ):
+        """
+        在事件循环中执行一个任务，返回TaskState
+        模型请求使用AsyncOpenAI，截图、编码和执行操作在会话的线程池中运行，
+        一个事件循环可以同时驱动多个会话（每个会话使用自己的截图和输入后端）
+        任务被取消或停止事件置位时，进行中的HTTP请求和等待会立即中止
+        """
+        task = TaskState(user_content)
+        start = time.monotonic()
+        try:
+            if not self._begin_task(task, start, max_iterations, time_limit):
+                return task
+            runner = asyncio.ensure_future(self._run_task_async(task))
+            watcher = asyncio.ensure_future(self._wait_for_stop(task))
+            try:
+                await asyncio.wait(
+                    {runner, watcher}, return_when=asyncio.FIRST_COMPLETED
+                )
+            except asyncio.CancelledError:
+                runner.cancel()
+                self._interrupt(task)
+                raise
+            finally:
+                watcher.cancel()
+            if runner.done():
+                task.result = runner.result()
+            else:
+                # 停止事件置位：取消主循环，中止进行中的请求
+                runner.cancel()
+                await asyncio.wait({runner})
+                self._interrupt(task)
+            return task
+        finally:
+            self._end_task(task, start)
+            if artifact_writer is not None:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, artifact_writer.flush, 10
+                )
+
+    # 等待停止事件（threading.Event无法直接await，按短间隔轮询）
+    async def _wait_for_stop(self, task, poll_interval=0.01):
+        while not self._stopped(task):
+            await asyncio.sleep(poll_interval)
+
+    # 任务开始：加载配置并设置执行限制，配置有误时返回False
+    def _begin_task(self, task, start, max_iterations=None, time_limit=None):
+        task.started_at = time.time()
+        error = self.refresh()
+        if error:
+            task.status = "error"
+            task.result = error
+            return False
+
+        task.max_iterations = (
+            max_iterations
+            or self.config["execution_config"]["max_visual_model_iterations"]
+        )
+        task.time_limit = time_limit or self.config["execution_config"].get(
+            "task_time_limit"
+        )
+        if task.time_limit:
+            task.deadline = start + task.time_limit
+        task.metrics = self._create_metrics(task)
+        task.trace = self._create_trace(task)
+        return True
+
+    # 任务结束：记录耗时并写出统计、轨迹和缓存
+    def _end_task(self, task, start):
+        task.wall_time = time.monotonic() - start
+        self._finish_metrics(task)
+        if task.trace is not None:
+            task.trace.close(
+                status=task.status,
+                result=task.result,
+                iterations=task.iteration,
+                wall_time=round(task.wall_time, 6),
+            )
+        self._save_target_cache()
+
+    # 创建任务轨迹
+    def _create_trace(self, task):
+        trace_config = self.config.get("trace_config", {})
+        if not trace_config.get("enabled", False):
+            return None
+        trace = TraceWriter(
+            new_trace_path(trace_config.get("directory", "traces")),
+            delta_threshold=trace_config.get("delta_threshold", 0.1),
+            compression=trace_config.get("compression", 1),
+            thumbnail_edge=self.config.get("skip_config", {}).get("thumbnail_edge", 160),
+            # 轨迹按顺序写入，队列满时也不能丢弃
+            submit=lambda func, *args: get_artifact_writer().submit(
+                func, *args, droppable=False
+            ),
+        )
+        trace.start(
+            task=task.user_content,
+            started_at=task.started_at,
+            model=self.config["api_config"].get("model_name"),
+            system_prompt=self.system_prompt,
+        )
+        log_print(f"🧾 任务轨迹: {trace.path}")
+        return trace
+
+    # 补充本步的轨迹记录
+    def _trace(self, task, **fields):
+        if task.trace_step is not None:
+            task.trace_step.update(fields)
+
+    # 创建分阶段耗时统计
+    def _create_metrics(self, task):
+        metrics_config = self.config.get("metrics_config", {})
+        if not metrics_config.get("enabled", False):
+            return NULL_RECORDER
+        return SpanRecorder(
+            enabled=True,
+            jsonl_path=metrics_config.get("jsonl_path", "metrics/metrics.jsonl"),
+            labels={"task": task.user_content},
+        )
+
+    # 输出本次任务的耗时汇总
+    def _finish_metrics(self, task):
+        if not task.metrics.enabled:
+            return
+        metrics_config = self.config.get("metrics_config", {})
+        try:
+            log_print("📊 各阶段耗时汇总:\n" + task.metrics.format_summary())
+            task.metrics.finish(
+                summary_path=metrics_config.get("summary_path"),
+                status=task.status,
+                iterations=task.iteration,
+                wall_time=round(task.wall_time, 6),
+            )
+        except Exception as e:
+            log_print(f"写入耗时统计失败: {e}")
+
+    # 截图并检查是否需要跳过本次模型调用
+    def _capture(self, task):
+        """
+        截图并处理上一步的验证和屏幕未变化跳过
+        返回 (frame, 缩略图)，截图失败或等待期间任务结束时返回 (None, None)
+        """
+        config = self.config
+        skip_config = config.get("skip_config", {})
+        skip_threshold = skip_config.get("diff_threshold", 0.002)
+        thumbnail_edge = skip_config.get("thumbnail_edge", 160)
+
+        # 屏幕未变化时在本次迭代内退避等待后重新截图，跳过不计入迭代次数，由max_consecutive_skips限制
+        while True:
+            # 截图（保存在内存中，不再经过磁盘往返）
+            log_print("📸 正在截取屏幕...")
+            frame = capture_frame(
+                optimize_for_speed=config["screenshot_config"]["optimize_for_speed"],
+                max_png=config["screenshot_config"]["max_png"],
+                spans=task.metrics,
+                backend=self.capture_backend,
+            )
+
+            if frame is None:
+                log_print("❌ 截图失败")
+                return None, None
+
+            current_thumbnail = downscale_gray(frame.image, thumbnail_edge)
+
+            # 验证上一步操作是否产生了可见效果
+            if task.pending_check is not None:
+                verify_threshold = config.get("action_cache_config", {}).get(
+                    "verify_threshold", 0.002
+                )
+                changed = (
+                    frame_difference(task.pending_check["thumbnail"], current_thumbnail)
+                    > verify_threshold
+                )
+                step, fingerprint, response_text = task.pending_check["entry"]
+                if changed and not task.pending_check["from_cache"]:
+                    task.verified_steps.append(task.pending_check["entry"])
+                elif not changed and task.pending_check["from_cache"]:
+                    log_print("⚠️  缓存回放的操作未产生可见变化，该步骤改用模型决策")
+                    self.action_cache.invalidate(task.user_content, step, fingerprint)
+                    self.action_cache.save()
+                    task.cache_bypass_step = step
+                    task.step_index = step
+                task.pending_check = None
+
+            # 目标点击产生了可见变化时更新该目标的模板；模板定位的点击无效时删除模板
+            if task.pending_target is not None:
+                pending = task.pending_target
+                task.pending_target = None
+                verify_threshold = config.get("target_cache_config", {}).get(
+                    "verify_threshold", 0.002
+                )
+                changed = (
+                    frame_difference(pending["thumbnail"], current_thumbnail)
+                    > verify_threshold
+                )
+                self._verify_target(task, pending, changed)
+
+            # 屏幕与上次发送给模型时不同（或已达到连续跳过上限）：交给模型决策
+            if not (
+                skip_config.get("enabled", False)
+                and task.last_sent_thumbnail is not None
+                and task.consecutive_skips
+                < skip_config.get("max_consecutive_skips", 3)
+                and frame_difference(task.last_sent_thumbnail, current_thumbnail)
+                <= skip_threshold
+            ):
+                break
+
+            # 屏幕与上次发送给模型时相同：本地退避等待，不调用模型
+            task.consecutive_skips += 1
+            backoff = min(
+                skip_config.get("backoff_initial", 0.2)
+                * (2 ** (task.consecutive_skips - 1)),
+                skip_config.get("backoff_max", 1.0),
+            )
+            log_print(
+                f"⏭️  屏幕未变化，跳过模型调用（连续第 {task.consecutive_skips} 次），"
+                f"等待最多 {backoff:.1f}s"
+            )
+            task.metrics.add("skipped_calls", 1)
+            try:
+                with task.metrics.span("skip_wait"):
+                    changed, waited = wait_for_screen_change(
+                        lambda: grab_screen_thumbnail(
+                            thumbnail_edge, self.capture_backend
+                        ),
+                        task.last_sent_thumbnail,
+                        timeout=backoff,
+                        poll_interval=skip_config.get("poll_interval", 0.1),
+                        diff_threshold=skip_threshold,
+                    )
+                if changed:
+                    log_print(f"👀 检测到屏幕变化 ({waited * 1000:.0f}ms)")
+            except Exception as e:
+                log_print(f"等待屏幕变化失败: {e}")
+                time.sleep(backoff)
+
+            # 等待期间任务被停止或到达时间上限时交回主循环处理
+            if self._stopped(task) or (
+                task.deadline is not None and time.monotonic() >= task.deadline
+            ):
+                return None, None
+
+        # 可选：保存截图到磁盘用于调试
+        if config["screenshot_config"].get("save_to_disk", False):
+            get_artifact_writer().submit(
+                save_frame, frame, config["screenshot_config"]["input_path"]
+            )
+
+        return frame, current_thumbnail
+
+    # 构建发送给模型的消息
+    def build_messages(self, task, frame):
+        """
+        构建消息列表，返回 (messages, 当前用户消息, 增量帧区域列表)
+        图片编码失败时返回 (None, None, None)
+        """
+        config = self.config
+
+        # 检测界面元素，按配置在发送的图片上绘制编号
+        if self.element_detector is not None:
+            try:
+                with task.metrics.span("detect"):
+                    frame.elements = self.element_detector.detect(frame.image)
+                    if config.get("som_config", {}).get("overlay", True):
+                        frame.set_overlay(draw_marks(frame.image, frame.elements))
+            except Exception as e:
+                log_print(f"界面元素检测失败: {e}")
 
         # 编码图片
-        base64_image = encode_image(screenshot_path)
+        try:
+            with task.metrics.span("png_encode"):
+                frame.png_bytes()
+            with task.metrics.span("base64"):
+                base64_image = frame.base64()
+        except Exception as e:
+            log_print(f"图片编码失败: {e}")
+            base64_image = None
 
         if not base64_image:
             log_print("❌ 图片编码失败")
-            continue
-
-        log_print("🔍 正在调用AI模型分析...")
+            return None, None, None
 
         # 清理用户输入中的无效字符
-        clean_user_content = user_content.encode("utf-8", errors="ignore").decode(
-            "utf-8"
-        )
+        clean_user_content = task.user_content.encode(
+            "utf-8", errors="ignore"
+        ).decode("utf-8")
 
-        # 构建消息列表，包含最近3次的上下文
-        messages = [{"role": "system", "content": system_prompt}]
+        # 构建消息列表，包含最近几次的上下文
+        messages = [{"role": "system", "content": self.system_prompt}]
 
-        # 添加历史上下文（最近3次）
-        for history_item in conversation_history[-3:]:
+        # 添加历史上下文（历史截图已按策略压缩）
+        history_turns = config.get("history_config", {}).get("max_turns", 3)
+        recent_history = (
+            task.conversation_history[-history_turns:] if history_turns > 0 else []
+        )
+        for history_item in recent_history:
             messages.append(history_item["user_message"])
             messages.append(history_item["assistant_message"])
 
         # 添加当前用户消息
-        if iteration == 1:
-            # 第一次迭代：发送完整的用户指令
+        delta_regions = None
+        if task.last_sent_frame is None:
+            # 第一次发送：发送完整的用户指令
             current_user_message = {
                 "role": "user",
                 "content": [
@@ -615,131 +1640,1203 @@ def auto_control_computer(user_content):
             }
         else:
             # 后续迭代：包含原始任务目标 + 当前状态
-            current_user_message = {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": f"继续执行任务：<{original_user_input}>。\n 这是当前屏幕状态：",
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/png;base64,{base64_image}"},
-                    },
-                ],
-            }
+            delta_config = config.get("delta_config", {})
+            delta_content = None
+            if delta_config.get("enabled", False):
+                try:
+                    with task.metrics.span("delta"):
+                        delta_content, delta_regions = build_delta_content(
+                            task.last_sent_frame, frame, delta_config
+                        )
+                except Exception as e:
+                    log_print(f"生成增量帧失败: {e}")
+                    delta_content, delta_regions = (None, None)
+
+            task_text = f"继续执行任务：<{task.user_content}>。\n 这是当前屏幕状态："
+            if task.plan_note:
+                task_text = f"{task.plan_note}\n{task_text}"
+                task.plan_note = None
+            if delta_content is not None:
+                log_print(f"🧩 发送增量帧：{len(delta_regions)} 个变化区域")
+                current_user_message = {
+                    "role": "user",
+                    "content": [{"type": "text", "text": task_text}] + delta_content,
+                }
+            else:
+                current_user_message = {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": task_text},
+                        {
+                            "type": "image_url",
+                            "image_url": {"url": f"data:image/png;base64,{base64_image}"},
+                        },
+                    ],
+                }
         messages.append(current_user_message)
+        return messages, current_user_message, delta_regions
+
+    # 计算操作坐标及其映射参数
+    def _action_mapping(
+        self, frame, ai_response, delta_regions=None, zoom_box=None, matched_point=None
+    ):
+        """
+        返回 (坐标, 映射参数)，映射参数为map_coordinates的scale、img_width、img_height、
+        offset_x、offset_y；不执行任何操作，离线评估也用它计算预测的屏幕坐标
+        """
+        action_type = ai_response.action.get("type", "wait")
+        coordinates = ai_response.action.get("coordinates", [])
+        scale = frame.scale
+        config = self.config
+
+        # 区域截图时，截图左上角在屏幕上的位置（按缩放后的图像像素计）
+        origin_x, origin_y = frame.origin
+        map_scale, map_width, map_height = scale, frame.width, frame.height
+        offset_x, offset_y = origin_x * scale, origin_y * scale
+        full_frame_coordinates = True
+        # 坐标基于变化区域裁剪图时，按裁剪图在原始分辨率下的位置映射
+        region_index = ai_response.action.get("region")
+        if delta_regions and isinstance(region_index, int):
+            if 1 <= region_index <= len(delta_regions):
+                crop_left, crop_top, map_width, map_height = delta_regions[
+                    region_index - 1
+                ]
+                offset_x, offset_y = crop_left + origin_x, crop_top + origin_y
+                map_scale = 1
+                full_frame_coordinates = False
+            else:
+                log_print(f"⚠️  无效的区域编号: {region_index}，按整屏坐标处理")
+        # 坐标基于放大定位的裁剪图：裁剪图坐标 -> 原始分辨率 -> 屏幕
+        if zoom_box is not None:
+            crop_left, crop_top, map_width, map_height = zoom_box
+            offset_x, offset_y = crop_left + origin_x, crop_top + origin_y
+            map_scale = 1
+            full_frame_coordinates = False
+        # 模板匹配的位置已是原始分辨率像素，只需加上截图区域的偏移
+        if matched_point is not None:
+            coordinates = list(matched_point)
+            map_width = map_height = None
+            offset_x, offset_y = origin_x, origin_y
+            map_scale = 1
+            full_frame_coordinates = False
+        # 整屏坐标时按元素编号取元素中心，或吸附到附近的元素
+        if frame.elements and full_frame_coordinates and action_type != "wait":
+            coordinates = resolve_element_coordinates(
+                ai_response.action,
+                coordinates,
+                frame,
+                config.get("som_config", {}),
+            )
+
+        return coordinates, {
+            "scale": map_scale,
+            "img_width": map_width,
+            "img_height": map_height,
+            "offset_x": offset_x,
+            "offset_y": offset_y,
+        }
+
+    # 执行AI给出的操作
+    def execute_action(
+        self,
+        task,
+        frame,
+        ai_response,
+        delta_regions=None,
+        zoom_box=None,
+        matched_point=None,
+        plan_step=None,
+    ):
+        """
+        执行解析后的操作，返回映射后的屏幕坐标（无操作时返回None）
+        zoom_box: 坐标基于放大定位的裁剪图时，裁剪图在原始分辨率下的位置
+        matched_point: 模板匹配得到的目标位置（原始分辨率像素），提供时代替模型坐标
+        plan_step: 多步计划中后续操作的序号，用于区分同一次迭代的标记图片
+        """
+        config = self.config
+        label_dir = config["screenshot_config"].get("output_path", "imgs/label")
+        scale = frame.scale
+
+        # 显示AI分析结果
+        log_print(f"🎯 AI分析: {ai_response.description}")
+        log_print(f"🔧 执行操作: {ai_response.action.get('type', 'unknown')}")
+        if ai_response.action.get("coordinates"):
+            log_print(f"📍 目标坐标: {ai_response.action['coordinates']}")
+
+        # 执行操作（使用新格式）
+        action_type = ai_response.action.get("type", "wait")
+        text = ai_response.action.get("text", "")
+
+        coordinates, mapping = self._action_mapping(
+            frame, ai_response, delta_regions, zoom_box, matched_point
+        )
+        origin_x, origin_y = frame.origin
+
+        if not (coordinates and len(coordinates) >= 2 and action_type != "wait"):
+            log_print("⚠️  未提供有效坐标或操作")
+            if self.settle:
+                self.settle(max_wait=1)
+            else:
+                time.sleep(1)
+            return None
+
+        action_str, mapped_coordinates = move_mouse_to_coordinates(
+            coordinates,
+            action_type,
+            text,
+            settle=self.settle,
+            input_backend=self.input_backend,
+            **mapping,
+        )
+
+        # 标记坐标点（照搬GUI版本逻辑）
+        if mapped_coordinates:
+            if isinstance(mapped_coordinates[0], list):
+                # 拖拽坐标 [[x1, y1], [x2, y2]]
+                image_coordinates = []
+                for coord in mapped_coordinates:
+                    img_x = int((coord[0] - origin_x) * scale)
+                    img_y = int((coord[1] - origin_y) * scale)
+                    image_coordinates.append([img_x, img_y])
+            else:
+                # 单点坐标 [x, y]
+                img_x = int((mapped_coordinates[0] - origin_x) * scale)
+                img_y = int((mapped_coordinates[1] - origin_y) * scale)
+                image_coordinates = [img_x, img_y]
+
+            if task.trace is not None:
+                # 轨迹中已有截图，只记录标记位置（trace_store export 时再绘制）
+                self._trace(
+                    task,
+                    marks=image_coordinates
+                    if isinstance(image_coordinates[0], list)
+                    else [image_coordinates],
+                )
+            else:
+                # 生成标记图片（在后台线程中渲染和写入）
+                output_filename = f"screen_label{task.iteration}.png"
+                if plan_step is not None:
+                    output_filename = f"screen_label{task.iteration}_{plan_step}.png"
+                output_path = os.path.join(label_dir, output_filename)
+                get_artifact_writer().submit(
+                    mark_coordinate_on_image,
+                    image_coordinates,
+                    output_path=output_path,
+                    image=frame.image,
+                )
+
+        # 通知坐标回调
+        if coordinate_callback and mapped_coordinates:
+            if isinstance(mapped_coordinates[0], list):
+                coordinate_callback(mapped_coordinates[0][0], mapped_coordinates[0][1])
+            else:
+                coordinate_callback(mapped_coordinates[0], mapped_coordinates[1])
+
+        # 等待界面稳定后再进入下一次截图
+        if self.settle:
+            with task.metrics.span("settle"):
+                self.settle()
+
+        return mapped_coordinates
+
+    # 是否使用结构化输出
+    def _structured_output_active(self):
+        ai_config = self.config.get("ai_config", {})
+        return ai_config.get("structured_output", False) and self.structured_supported
+
+    # 结构化输出Schema中需要包含的可选字段
+    def _schema_features(self):
+        config = self.config
+        som_config = config.get("som_config", {})
+        return {
+            "plan": config.get("plan_config", {}).get("enabled", False),
+            "grounded": config.get("zoom_config", {}).get("enabled", False),
+            "marked": som_config.get("enabled", False)
+            and som_config.get("overlay", True),
+        }
+
+    # 模型请求参数
+    def _completion_options(self, tier=None):
+        """tier为分层路由选出的模型层级，可覆盖模型名和max_tokens"""
+        ai_config = self.config.get("ai_config", {})
+        tier = tier or {}
+        options = {
+            "model": tier.get("model_name") or self.config["api_config"]["model_name"],
+            "max_tokens": tier.get("max_tokens") or ai_config.get("max_tokens", 1000),
+            "temperature": 0.1,
+        }
+        if self._structured_output_active():
+            options["response_format"] = build_response_format(
+                **self._schema_features()
+            )
+            # 结构化输出没有多余文本，只需要容纳Schema中的字段
+            plan = self.config.get("plan_config", {}).get("enabled", False)
+            options["max_tokens"] = ai_config.get(
+                "structured_max_tokens", 600 if plan else 300
+            )
+        return options
+
+    # 调用模型
+    def _create_completion(self, messages, options=None, **kwargs):
+        """
+        发送请求，options默认为主循环的请求参数
+        服务拒绝response_format时改用普通请求，并在本会话中不再使用
+        """
+        request_options = options or self._completion_options()
+        try:
+            return self.client.chat.completions.create(
+                messages=messages, **request_options, **kwargs
+            )
+        except (BadRequestError, UnprocessableEntityError) as e:
+            if "response_format" not in request_options:
+                raise
+            return self.client.chat.completions.create(
+                messages=messages, **self._fallback_options(e, options), **kwargs
+            )
 
+    # 调用模型（异步，任务取消时立即中止HTTP请求）
+    async def _create_completion_async(self, messages, options=None, **kwargs):
+        request_options = options or self._completion_options()
+        client = self._get_async_client()
         try:
-            response = client.chat.completions.create(
-                model=model_name, messages=messages, max_tokens=1000, temperature=0.1
+            return await client.chat.completions.create(
+                messages=messages, **request_options, **kwargs
+            )
+        except (BadRequestError, UnprocessableEntityError) as e:
+            if "response_format" not in request_options:
+                raise
+            return await client.chat.completions.create(
+                messages=messages, **self._fallback_options(e, options), **kwargs
             )
 
-            ai_response_text = response.choices[0].message.content
-            # 清理AI响应中的无效字符
-            ai_response_text = ai_response_text.encode("utf-8", errors="ignore").decode(
-                "utf-8"
+    # 服务不支持结构化输出时的请求参数
+    def _fallback_options(self, error, options):
+        log_print(f"⚠️  模型服务不支持结构化输出，改用文本解析: {error}")
+        self.structured_supported = False
+        if options is None:
+            return self._completion_options()
+        return {key: value for key, value in options.items() if key != "response_format"}
+
+    # 获取当前事件循环的异步客户端
+    def _get_async_client(self):
+        loop = asyncio.get_running_loop()
+        if self.async_client is None or self._async_client_key != (
+            self._client_key,
+            loop,
+        ):
+            if self.provider_pool is not None:
+                self.async_client = AsyncHedgedClient(self.provider_pool)
+            else:
+                self.async_client = make_async_client(self._providers[0])
+            self._async_client_key = (self._client_key, loop)
+        return self.async_client
+
+    # 异步主循环使用的线程池
+    def _get_executor(self):
+        if self._executor is None:
+            # 一个会话同时只有一次迭代；多一个线程留给已取消但仍在收尾的操作
+            self._executor = ThreadPoolExecutor(
+                max_workers=2, thread_name_prefix="agent-session"
             )
-            log_print(f"🤖 AI原始响应:\n{ai_response_text}")
+        return self._executor
+
+    # 解析模型响应
+    def _parse_response(self, task, response_text):
+        """结构化输出时先按Schema校验，不符合时再使用文本解析"""
+        if self._structured_output_active():
+            fields = validate_structured_response(
+                response_text, **self._schema_features()
+            )
+            if fields is not None:
+                return AIResponse(**fields)
+            log_print("⚠️  响应不符合结构化Schema，改用文本解析")
+            task.metrics.add("parse_fallbacks", 1)
+        return parse_ai_response(response_text)
+
+    # 放大定位
+    def _zoom_refine(self, task, frame, ai_response, model=None):
+        """
+        目标很小或置信度低时，裁剪原始分辨率区域请求精确坐标
+        成功时更新ai_response中的坐标（改为裁剪图内的相对坐标），
+        返回裁剪区域在原始分辨率下的 (left, top, width, height)；未放大时返回None
+        model: 本步分层路由选出的模型，默认使用api_config中的模型
+        """
+        request = self._zoom_request(task, frame, ai_response, model)
+        if request is None:
+            return None
+        messages, options, box = request
+        try:
+            response = self._create_completion(messages, options=options)
+        except Exception as e:
+            log_print(f"放大定位失败，使用原坐标: {e}")
+            return None
+        return self._apply_zoom(task, ai_response, response, box)
+
+    # 放大定位（异步，任务取消时与主请求一样立即中止）
+    async def _zoom_refine_async(self, task, frame, ai_response, model=None):
+        loop = asyncio.get_running_loop()
+        request = await loop.run_in_executor(
+            self._get_executor(), self._zoom_request, task, frame, ai_response, model
+        )
+        if request is None:
+            return None
+        messages, options, box = request
+        try:
+            response = await self._create_completion_async(messages, options=options)
+        except Exception as e:
+            log_print(f"放大定位失败，使用原坐标: {e}")
+            return None
+        return self._apply_zoom(task, ai_response, response, box)
+
+    # 裁剪并编码放大定位的请求
+    def _zoom_request(self, task, frame, ai_response, model=None):
+        """需要放大时返回 (消息, 请求参数, 裁剪区域)，否则返回None"""
+        zoom_config = self.config.get("zoom_config", {})
+        reason = zoom_reason(ai_response.action, frame, zoom_config)
+        if reason is None:
+            return None
+
+        log_print(f"🔎 放大定位（{reason}）")
+        try:
+            crop, box = frame.crop_full(
+                *zoom_crop_box(ai_response.action, frame, zoom_config)
+            )
+            if crop.size == 0:
+                return None
+            crop_base64 = encode_png_base64(crop, frame.png_compression)
+        except Exception as e:
+            log_print(f"放大定位失败，使用原坐标: {e}")
+            return None
+        options = {
+            "model": model or self.config["api_config"]["model_name"],
+            "max_tokens": zoom_config.get("max_tokens", 100),
+            "temperature": 0.1,
+        }
+        if self._structured_output_active():
+            options["response_format"] = build_zoom_response_format()
+        task.metrics.add("zoom_requests", 1)
+        messages = build_zoom_messages(
+            crop_base64, ai_response.target, ai_response.description
+        )
+        return messages, options, box
 
-            # 保存到历史记录
-            history_item = {
-                "user_message": current_user_message,
-                "assistant_message": {"role": "assistant", "content": ai_response_text},
-            }
-            conversation_history.append(history_item)
-
-            # 检测连续三次相同响应
-            recent_responses.append(ai_response_text)
-            if len(recent_responses) > 3:
-                recent_responses.pop(0)
-            
-            # 如果最近三次响应相同，清空历史记录
-            if len(recent_responses) == 3 and len(set(recent_responses)) == 1:
-                log_print("🔄 检测到连续三次相同响应，清空历史记录重新开始")
-                conversation_history.clear()
-                recent_responses.clear()
-
-            # 只保留最近3次记录
-            if len(conversation_history) > 3:
-                conversation_history.pop(0)
+    # 按放大定位的响应更新坐标
+    def _apply_zoom(self, task, ai_response, response, box):
+        try:
+            record_usage(task.metrics, response.usage)
+            coordinates = parse_zoom_response(response.choices[0].message.content)
+        except Exception as e:
+            log_print(f"放大定位失败，使用原坐标: {e}")
+            return None
+
+        if coordinates is None:
+            log_print("⚠️  放大区域中未找到目标，使用原坐标")
+            return None
+        log_print(f"🎯 放大定位坐标: {coordinates}（区域 {box}）")
+        ai_response.action = dict(ai_response.action, coordinates=coordinates)
+        return box
+
+    # 按目标模板定位
+    def _match_target(self, task, frame, ai_response):
+        """
+        目标已有模板时在原始分辨率截图上匹配，返回原始分辨率下的 (x, y)
+        未缓存、未找到或匹配不唯一时返回None，继续使用模型给出的坐标
+        """
+        target = ai_response.target
+        if ai_response.action.get("type") not in TARGET_ACTIONS or not target:
+            return None
+        if target not in self.target_cache:
+            return None
+        try:
+            match = self.target_cache.locate(target, frame.full_image, source=frame)
+        except Exception as e:
+            log_print(f"模板匹配失败: {e}")
+            return None
+        if match is None:
+            log_print(f"⚠️  未能在屏幕上唯一匹配目标「{target}」，使用模型坐标")
+            task.metrics.add("target_misses", 1)
+            return None
+        x, y, score = match
+        log_print(f"🧩 模板匹配定位「{target}」: ({x:.0f}, {y:.0f})，相关系数 {score:.3f}")
+        task.metrics.add("target_matches", 1)
+        return x, y
+
+    # 记录待验证的目标点击
+    def _pending_target(self, frame, ai_response, mapped_coordinates, thumbnail, matched):
+        if (
+            ai_response.action.get("type") not in TARGET_ACTIONS
+            or not ai_response.target
+            or not mapped_coordinates
+            or isinstance(mapped_coordinates[0], list)
+        ):
+            return None
+        # 屏幕坐标 -> 原始分辨率截图中的像素坐标
+        origin_x, origin_y = frame.origin
+        return {
+            "target": ai_response.target,
+            "frame": frame,
+            "point": (
+                mapped_coordinates[0] - origin_x,
+                mapped_coordinates[1] - origin_y,
+            ),
+            "thumbnail": thumbnail,
+            "matched": matched,
+        }
+
+    # 按点击效果更新目标模板
+    def _verify_target(self, task, pending, changed):
+        target_cache = self.target_cache
+        if target_cache is None:
+            return
+        target = pending["target"]
+        if changed:
+            x, y = pending["point"]
+            try:
+                if target_cache.store(target, pending["frame"].full_image, x, y):
+                    task.metrics.add("target_stores", 1)
+            except Exception as e:
+                log_print(f"保存目标模板失败: {e}")
+        elif pending["matched"]:
+            log_print(f"⚠️  按模板定位的点击未产生可见变化，删除目标「{target}」的模板")
+            target_cache.remove(target)
+
+    # 保存目标模板索引
+    def _save_target_cache(self):
+        if self.target_cache is None:
+            return
+        try:
+            self.target_cache.save()
+        except Exception as e:
+            log_print(f"保存目标模板缓存失败: {e}")
+
+    # 脚本化步骤：按缓存的目标模板直接执行，不调用模型
+    def execute_target_step(self, target, action_type="click", text=""):
+        """
+        在当前屏幕上按模板定位target并执行操作，返回TaskState
+        成功时status为completed；目标未缓存、未找到或操作后屏幕没有变化时status为cache_miss，
+        调用方应改为通过execute_task由模型完成该步骤
+        """
+        task = TaskState(f"{action_type} {target}")
+        task.started_at = time.time()
+        start = time.monotonic()
+        try:
+            error = self.refresh()
+            if error:
+                task.status = "error"
+                task.result = error
+                return task
+            if self.target_cache is None or target not in self.target_cache:
+                task.status = "cache_miss"
+                task.result = "目标未缓存"
+                return task
+
+            config = self.config
+            thumbnail_edge = config.get("skip_config", {}).get("thumbnail_edge", 160)
+            task.metrics = self._create_metrics(task)
+            task.iteration = 1
+            task.metrics.start_step(task.iteration)
+            frame = capture_frame(
+                optimize_for_speed=config["screenshot_config"]["optimize_for_speed"],
+                max_png=config["screenshot_config"]["max_png"],
+                spans=task.metrics,
+                backend=self.capture_backend,
+            )
+            if frame is None:
+                task.status = "error"
+                task.result = "截图失败"
+                return task
+
+            ai_response = AIResponse(
+                status="in_progress",
+                description=f"脚本步骤：{target}",
+                target=target,
+                action={"type": action_type, "text": text},
+            )
+            with task.metrics.span("template_match"):
+                matched_point = self._match_target(task, frame, ai_response)
+            if matched_point is None:
+                task.status = "cache_miss"
+                task.result = "屏幕上未找到目标"
+                return task
+
+            thumbnail = downscale_gray(frame.image, thumbnail_edge)
+            with task.metrics.span("action"):
+                mapped_coordinates = self.execute_action(
+                    task, frame, ai_response, matched_point=matched_point
+                )
+            # 与主循环相同，按操作是否产生可见变化决定更新还是删除模板
+            pending = self._pending_target(
+                frame, ai_response, mapped_coordinates, thumbnail, True
+            )
+            if pending is None:
+                task.status = "cache_miss"
+                task.result = "操作无效"
+                return task
+            changed = (
+                frame_difference(
+                    thumbnail, grab_screen_thumbnail(thumbnail_edge, self.capture_backend)
+                )
+                > config.get("target_cache_config", {}).get("verify_threshold", 0.002)
+            )
+            self._verify_target(task, pending, changed)
+            if changed:
+                log_print(f"✅ 脚本步骤完成（未调用模型）: {target}")
+                task.status = "completed"
+                task.result = "任务完成"
+            else:
+                task.status = "cache_miss"
+                task.result = "操作未产生可见变化"
+            return task
+        finally:
+            task.wall_time = time.monotonic() - start
+            if task.iteration:
+                task.step_latencies.append(task.wall_time)
+                task.metrics.end_step(latency=round(task.wall_time, 6))
+            self._finish_metrics(task)
+            self._save_target_cache()
+
+    # 执行多步计划中的后续操作
+    def _run_plan(self, task, frame, ai_response, delta_regions=None):
+        """
+        依次执行ai_response.next_actions，每步之前截取缩略图检查屏幕
+        返回实际执行的后续操作数；检查未通过时停止，下一轮回到单步决策
+        """
+        plan_config = self.config.get("plan_config", {})
+        next_actions = [
+            action
+            for action in ai_response.next_actions
+            if isinstance(action, dict) and action.get("type")
+        ][: max(0, plan_config.get("max_actions", 4) - 1)]
+        if not next_actions:
+            return 0
+
+        # 模型给出的检查条件只能收紧配置中的条件
+        guard = ai_response.guard
+        max_change = plan_config.get("max_change", 0.3)
+        if isinstance(guard.get("max_change"), (int, float)):
+            max_change = min(max_change, guard["max_change"])
+        stop_on_dialog = plan_config.get("stop_on_dialog", True) or bool(
+            guard.get("stop_on_dialog")
+        )
 
-            # 解析并执行操作
-            ai_response = parse_ai_response(ai_response_text)
+        thumbnail_edge = plan_config.get("thumbnail_edge", 320)
+        baseline = downscale_gray(frame.image, thumbnail_edge)
+        previous = baseline
+        executed = 0
+        reason = None
+        for index, action in enumerate(next_actions, start=1):
+            if self._stopped(task):
+                reason = "用户中断"
+                break
+            with task.metrics.span("plan_guard"):
+                current = grab_screen_thumbnail(thumbnail_edge, self.capture_backend)
+                change = frame_difference(baseline, current)
+                if change > max_change:
+                    reason = f"屏幕变化 {change:.1%} 超过上限 {max_change:.1%}"
+                elif stop_on_dialog and detect_dialog(previous, current):
+                    reason = "检测到弹出的对话框"
+            if reason:
+                break
 
-            # 检查任务是否完成（新格式）
-            if ai_response.status in ["completed", "failed"]:
-                if ai_response.status == "completed":
-                    log_print("✅ 任务完成!")
-                    return "任务完成"
-                else:
-                    log_print("⚠️  任务失败或过于复杂")
-                    return "任务失败或过于复杂"
-
-            # 显示AI分析结果
-            log_print(f"🎯 AI分析: {ai_response.description}")
-            log_print(f"🔧 执行操作: {ai_response.action.get('type', 'unknown')}")
-            if ai_response.action.get("coordinates"):
-                log_print(f"📍 目标坐标: {ai_response.action['coordinates']}")
-
-            # 执行操作（使用新格式）
-            action_type = ai_response.action.get("type", "wait")
-            coordinates = ai_response.action.get("coordinates", [])
-            text = ai_response.action.get("text", "")
-
-            if coordinates and len(coordinates) >= 2 and action_type != "wait":
-                action_str, mapped_coordinates = move_mouse_to_coordinates(
-                    coordinates,
-                    action_type,
-                    text,
-                    scale=scale,
-                    img_width=img_width,
-                    img_height=img_height,
+            log_print(f"📋 执行后续操作 {index}/{len(next_actions)}")
+            step_response = AIResponse(
+                status="in_progress",
+                description=ai_response.description,
+                target=action.get("target", ""),
+                action=action,
+            )
+            with task.metrics.span("action"):
+                self.execute_action(
+                    task, frame, step_response, delta_regions, plan_step=index
                 )
+            executed += 1
+            previous = current
+
+        task.metrics.add("plan_actions", executed)
+        if reason:
+            log_print(f"🛑 停止执行剩余的后续操作: {reason}")
+            task.metrics.add("plan_aborts", 1)
+            task.plan_single_step = True
+            task.plan_note = (
+                f"注意：上一轮的 {len(next_actions)} 个后续操作只执行了 {executed} 个"
+                f"（{reason}），请根据当前屏幕只给出下一步操作。"
+            )
+        return executed
+
+    # 任务成功后写入动作缓存
+    def _store_verified_steps(self, task):
+        if self.action_cache is None:
+            return
+        for step, fingerprint, response_text in task.verified_steps:
+            self.action_cache.store(task.user_content, step, fingerprint, response_text)
+        try:
+            self.action_cache.save()
+        except Exception as e:
+            log_print(f"保存动作缓存失败: {e}")
 
-                # 标记坐标点（照搬GUI版本逻辑）
-                if mapped_coordinates:
-                    if isinstance(mapped_coordinates[0], list):
-                        # 拖拽坐标 [[x1, y1], [x2, y2]]
-                        image_coordinates = []
-                        for coord in mapped_coordinates:
-                            img_x = int(coord[0] * scale)
-                            img_y = int(coord[1] * scale)
-                            image_coordinates.append([img_x, img_y])
-                    else:
-                        # 单点坐标 [x, y]
-                        img_x = int(mapped_coordinates[0] * scale)
-                        img_y = int(mapped_coordinates[1] * scale)
-                        image_coordinates = [img_x, img_y]
-
-                    # 生成标记图片
-                    output_filename = f"screen_label{iteration}.png"
-                    output_path = os.path.join("imgs/label", output_filename)
-                    mark_coordinate_on_image(
-                        image_coordinates, screenshot_path, output_path
-                    )
+    # 主循环
+    def _run_task(self, task):
+        max_iterations = task.max_iterations
 
-                # 通知坐标回调
-                if coordinate_callback and mapped_coordinates:
-                    if isinstance(mapped_coordinates[0], list):
-                        coordinate_callback(
-                            mapped_coordinates[0][0], mapped_coordinates[0][1]
-                        )
-                    else:
-                        coordinate_callback(
-                            mapped_coordinates[0], mapped_coordinates[1]
-                        )
+        log_print(f"开始执行任务: {task.user_content}")
+        log_print(f"最大迭代次数: {max_iterations}")
+
+        while task.iteration < max_iterations and not self._stopped(task):
+            result = self._check_deadline(task)
+            if result is not None:
+                return result
+
+            task.iteration += 1
+            log_print(f"\n🔄 === 第 {task.iteration} 次迭代 ===")
+
+            iteration_start = time.monotonic()
+            task.metrics.start_step(task.iteration)
+            try:
+                result = self._run_iteration(task)
+            finally:
+                self._end_step(task, iteration_start)
+            if result is not None:
+                return result
+
+        return self._loop_exit_result(task)
+
+    # 主循环（异步）
+    async def _run_task_async(self, task):
+        max_iterations = task.max_iterations
+
+        log_print(f"开始执行任务: {task.user_content}")
+        log_print(f"最大迭代次数: {max_iterations}")
+
+        while task.iteration < max_iterations and not self._stopped(task):
+            result = self._check_deadline(task)
+            if result is not None:
+                return result
+
+            task.iteration += 1
+            log_print(f"\n🔄 === 第 {task.iteration} 次迭代 ===")
+
+            iteration_start = time.monotonic()
+            task.metrics.start_step(task.iteration)
+            try:
+                result = await self._run_iteration_async(task)
+            finally:
+                self._end_step(task, iteration_start)
+            if result is not None:
+                return result
+
+        return self._loop_exit_result(task)
+
+    # 记录一次迭代的耗时（启用分层路由时按本步使用的模型层级分别统计）
+    def _end_step(self, task, iteration_start):
+        latency = time.monotonic() - iteration_start
+        task.step_latencies.append(latency)
+        tier = task.route_tier
+        task.route_tier = None
+        if task.trace_step is not None:
+            step, task.trace_step = task.trace_step, None
+            frame_id = step.pop("frame_id")
+            step.update(
+                latency=round(latency, 6), spans=task.metrics.current_spans(), tier=tier
+            )
+            task.trace.add_step(step, frame_id)
+        if tier is None:
+            task.metrics.end_step(latency=round(latency, 6))
+            return
+        if self.router is not None:
+            self.router.record_latency(tier, latency)
+        task.metrics.add(f"tier_{metric_name(tier)}_steps", 1)
+        task.metrics.end_step(latency=round(latency, 6), tier=tier)
+
+    # 是否应停止当前任务
+    def _stopped(self, task):
+        return (
+            should_exit
+            or task.cancel_event.is_set()
+            or (stop_event is not None and stop_event.is_set())
+        )
+
+    # 可被停止事件提前结束的等待
+    def _pause(self, seconds):
+        if stop_event is not None:
+            stop_event.wait(seconds)
+        else:
+            time.sleep(seconds)
+
+    # 检查任务时间上限
+    def _check_deadline(self, task):
+        if task.deadline is not None and time.monotonic() >= task.deadline:
+            log_print(f"⏰ 达到任务时间上限 ({task.time_limit}s)")
+            task.status = "timeout"
+            return f"达到任务时间上限 ({task.time_limit}s)"
+        return None
+
+    # 主循环结束（中断或达到最大迭代次数）时的结果
+    def _loop_exit_result(self, task):
+        if self._stopped(task):
+            return self._interrupt(task)
+        log_print(f"⏰ 达到最大迭代次数 ({task.max_iterations})")
+        task.status = "max_iterations"
+        return f"达到最大迭代次数 ({task.max_iterations})"
+
+    # 标记任务被中断
+    def _interrupt(self, task):
+        task.cancel_event.set()
+        log_print("🛑 用户中断执行")
+        task.status = "interrupted"
+        task.result = "用户中断执行"
+        return task.result
+
+    # 截图、构建消息并查找动作缓存
+    def _prepare_iteration(self, task):
+        """
+        一次迭代中模型请求之前的部分，返回本次迭代的上下文
+        截图失败或跳过本次模型调用时返回None（异步主循环中在执行器线程运行）
+        """
+        config = self.config
+        action_cache = self.action_cache
+
+        frame, current_thumbnail = self._capture(task)
+        if frame is None:
+            return None
+
+        messages, current_user_message, delta_regions = self.build_messages(
+            task, frame
+        )
+        if messages is None:
+            return None
+
+        log_print("🔍 正在调用AI模型分析...")
+        if task.metrics.enabled:
+            task.metrics.add("payload_bytes", len(json.dumps(messages)))
+
+        # 上一步执行了操作但屏幕没有变化（在覆盖上次发送的缩略图之前判断）
+        screen_unchanged = (
+            task.last_action_type not in (None, "wait")
+            and task.last_sent_thumbnail is not None
+            and frame_difference(task.last_sent_thumbnail, current_thumbnail)
+            <= config.get("routing_config", {}).get("no_change_threshold", 0.002)
+        )
+        task.last_sent_thumbnail = current_thumbnail
+        task.last_sent_frame = frame
+        task.consecutive_skips = 0
+
+        # 轨迹：截图交给后台去重、压缩，图片以外的消息内容随本步记录保存
+        if task.trace is not None:
+            task.trace_step = {
+                "iteration": task.iteration,
+                "time": frame.captured_at,
+                "frame_id": task.trace.add_frame(frame.image, current_thumbnail),
+                # 离线评估按录制的截图重现坐标映射
+                "scale": frame.scale,
+                "origin": list(frame.origin),
+                "messages": compact_messages(messages),
+            }
+
+        # 查找动作缓存
+        current_step = task.step_index
+        task.step_index += 1
+        fingerprint = None
+        cached_response_text = None
+        if action_cache is not None:
+            fingerprint = dhash(frame.image)
+            if current_step != task.cache_bypass_step:
+                cached_response_text = action_cache.lookup(
+                    task.user_content, current_step, fingerprint
+                )
+
+        # 分层模型路由：按上一步的结果选择本步使用的模型
+        options = None
+        if self.router is not None and cached_response_text is None:
+            options = self._completion_options(
+                self._route(task, screen_unchanged)
+            )
+
+        return {
+            "frame": frame,
+            "thumbnail": current_thumbnail,
+            "messages": messages,
+            "options": options,
+            "user_message": current_user_message,
+            "delta_regions": delta_regions,
+            "step": current_step,
+            "fingerprint": fingerprint,
+            "cached_response_text": cached_response_text,
+            "stream": config.get("ai_config", {}).get("stream", False),
+        }
+
+    # 选择本步的模型层级
+    def _route(self, task, screen_unchanged):
+        reasons = []
+        if task.model_calls == 0:
+            reasons.append("first_step")
+        if task.parse_failed:
+            reasons.append("parse_failure")
+        recent = task.recent_responses
+        if len(recent) >= 2 and recent[-1] == recent[-2]:
+            reasons.append("repetition")
+        if screen_unchanged:
+            reasons.append("no_change")
+        task.model_calls += 1
+
+        tier, reasons = self.router.select(task, reasons)
+        task.route_tier = tier["name"]
+        if reasons:
+            reason_text = "、".join(REASON_TEXT[reason] for reason in reasons)
+            log_print(f"🧭 使用模型层级 {tier['name']}（{reason_text}）")
+        else:
+            log_print(f"🧭 使用模型层级 {tier['name']}")
+        return tier
+
+    # 流式请求的附加参数
+    def _stream_kwargs(self, task):
+        if task.metrics.enabled:
+            return {"stream_options": {"include_usage": True}}
+        return {}
+
+    # 单次迭代
+    def _run_iteration(self, task):
+        """执行一次迭代，任务结束时返回结果描述，否则返回None"""
+        step = self._prepare_iteration(task)
+        if step is None:
+            return None
+
+        streaming = None
+        try:
+            ai_response_text = step["cached_response_text"]
+            if ai_response_text is not None:
+                log_print("♻️  命中动作缓存，本地回放，跳过模型调用")
+            elif step["stream"]:
+                # 流式模式：status和action解析完成后立即执行，其余内容后台继续读取
+                with task.metrics.span("model_request"):
+                    stream = self._create_completion(
+                        step["messages"],
+                        options=step["options"],
+                        stream=True,
+                        **self._stream_kwargs(task),
+                    )
+                    streaming = StreamingCompletion(stream)
             else:
-                log_print("⚠️  未提供有效坐标或操作")
-                time.sleep(1)
+                with task.metrics.span("model_request"):
+                    response = self._create_completion(
+                        step["messages"], options=step["options"]
+                    )
+                record_usage(task.metrics, response.usage)
 
+                ai_response_text = response.choices[0].message.content
+            return self._complete_iteration(task, step, ai_response_text, streaming)
         except Exception as e:
+            if streaming is not None:
+                streaming.close()
             log_print(f"❌ AI调用失败: {e}")
-            time.sleep(2)
+            self._trace(task, error=str(e))
+            self._pause(2)
 
-    if should_exit:
-        log_print("🛑 用户中断执行")
-        return "用户中断执行"
-    else:
-        log_print(f"⏰ 达到最大迭代次数 ({max_iterations})")
-        return f"达到最大迭代次数 ({max_iterations})"
+        return None
+
+    # 单次迭代（异步）
+    async def _run_iteration_async(self, task):
+        """
+        与_run_iteration相同，模型请求使用异步客户端，截图、编码和执行操作在执行器线程中运行
+        任务被取消时立即中止进行中的HTTP请求和等待
+        """
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        step = await loop.run_in_executor(executor, self._prepare_iteration, task)
+        if step is None:
+            return None
+
+        streaming = None
+        try:
+            ai_response_text = step["cached_response_text"]
+            if ai_response_text is not None:
+                log_print("♻️  命中动作缓存，本地回放，跳过模型调用")
+            elif step["stream"]:
+                with task.metrics.span("model_request"):
+                    stream = await self._create_completion_async(
+                        step["messages"],
+                        options=step["options"],
+                        stream=True,
+                        **self._stream_kwargs(task),
+                    )
+                    streaming = AsyncStreamingCompletion(stream)
+            else:
+                with task.metrics.span("model_request"):
+                    response = await self._create_completion_async(
+                        step["messages"], options=step["options"]
+                    )
+                record_usage(task.metrics, response.usage)
+
+                ai_response_text = response.choices[0].message.content
+            result, state = await loop.run_in_executor(
+                executor,
+                self._interpret_response,
+                task,
+                step,
+                ai_response_text,
+                streaming,
+            )
+            if state is None:
+                return result
+            # 放大定位的请求也走异步客户端，取消任务时与主请求一样立即中止
+            zoom_box = None
+            if state["zoom"]:
+                with task.metrics.span("zoom"):
+                    zoom_box = await self._zoom_refine_async(
+                        task,
+                        step["frame"],
+                        state["ai_response"],
+                        (step["options"] or {}).get("model"),
+                    )
+            return await loop.run_in_executor(
+                executor, self._execute_response, task, step, state, zoom_box
+            )
+        except asyncio.CancelledError:
+            # 执行器线程中尚未开始的操作不再执行
+            task.cancel_event.set()
+            if streaming is not None:
+                streaming.close()
+            raise
+        except Exception as e:
+            if streaming is not None:
+                streaming.close()
+            log_print(f"❌ AI调用失败: {e}")
+            self._trace(task, error=str(e))
+            await asyncio.sleep(2)
+
+        return None
+
+    # 解析响应并执行操作
+    def _complete_iteration(self, task, step, ai_response_text, streaming=None):
+        """
+        一次迭代中模型响应之后的部分：解析、执行操作和多步计划、记录待验证的步骤
+        ai_response_text 与 streaming 二选一；任务结束时返回结果描述，否则返回None
+        """
+        result, state = self._interpret_response(task, step, ai_response_text, streaming)
+        if state is None:
+            return result
+        zoom_box = None
+        if state["zoom"]:
+            with task.metrics.span("zoom"):
+                zoom_box = self._zoom_refine(
+                    task, step["frame"], state["ai_response"], (step["options"] or {}).get("model")
+                )
+        return self._execute_response(task, step, state, zoom_box)
+
+    # 解析模型响应
+    def _interpret_response(self, task, step, ai_response_text, streaming=None):
+        """
+        解析响应、处理任务结束并匹配目标模板，返回 (结果, 状态)
+        任务结束或已被取消时状态为None；否则状态交给放大定位和_execute_response继续执行
+        """
+        config = self.config
+        history_config = config.get("history_config", {})
+        action_cache = self.action_cache
+        frame = step["frame"]
+        current_user_message = step["user_message"]
+        current_step = step["step"]
+        fingerprint = step["fingerprint"]
+        cached_response_text = step["cached_response_text"]
+
+        early_fields = None
+        if streaming is not None:
+            with task.metrics.span("model_first_action"):
+                early_fields = streaming.wait_fields()
+            if early_fields is None:
+                # 未能提前解析，等待流结束后走常规解析
+                with task.metrics.span("model_stream_tail"):
+                    ai_response_text = streaming.wait_text()
+                record_usage(task.metrics, streaming.usage)
+
+        if early_fields is not None:
+            log_print("⚡ 流式解析到操作，提前执行")
+            ai_response = AIResponse(
+                status=early_fields.get("status", "in_progress"),
+                description=early_fields.get("description", ""),
+                target=early_fields.get("target", ""),
+                action=early_fields.get("action", {}),
+            )
+        else:
+            # 清理AI响应中的无效字符
+            ai_response_text = ai_response_text.encode(
+                "utf-8", errors="ignore"
+            ).decode("utf-8")
+            log_print(f"🤖 AI原始响应:\n{ai_response_text}")
+            self._trace(task, response=ai_response_text)
+            record_history(
+                task,
+                current_user_message,
+                frame,
+                ai_response_text,
+                history_config,
+            )
+
+            # 解析并执行操作
+            with task.metrics.span("parse"):
+                ai_response = self._parse_response(task, ai_response_text)
+        self._trace(
+            task,
+            status=ai_response.status,
+            action=ai_response.action,
+            target=ai_response.target,
+            description=ai_response.description,
+            cached=cached_response_text is not None,
+        )
+        # 响应无法解析时下一步升级模型层级
+        task.parse_failed = ai_response.parse_failed
+
+        # 检查任务是否完成（新格式）
+        if ai_response.status in ["completed", "failed"]:
+            if streaming is not None:
+                # 需要写入缓存时读完整个响应，否则直接关闭流
+                if action_cache is not None:
+                    ai_response_text = streaming.wait_text()
+                else:
+                    streaming.close()
+            if ai_response.status == "completed":
+                log_print("✅ 任务完成!")
+                # 任务成功后将已验证的步骤写入缓存（任务已被取消时会话可能已结束任务，不再写入）
+                if action_cache is not None and not task.cancel_event.is_set():
+                    if cached_response_text is None:
+                        task.verified_steps.append(
+                            (current_step, fingerprint, ai_response_text)
+                        )
+                    self._store_verified_steps(task)
+                task.status = "completed"
+                return "任务完成", None
+            else:
+                log_print("⚠️  任务失败或过于复杂")
+                task.status = "failed"
+                return "任务失败或过于复杂", None
+
+        # 任务已被取消（异步主循环中请求返回后才被取消时）不再执行操作
+        if self._stopped(task):
+            if streaming is not None:
+                streaming.close()
+            return None, None
+
+        # 目标模板匹配：已知目标在本地定位，代替模型估计的坐标
+        matched_point = None
+        if self.target_cache is not None:
+            with task.metrics.span("template_match"):
+                matched_point = self._match_target(task, frame, ai_response)
+
+        return None, {
+            "ai_response": ai_response,
+            "ai_response_text": ai_response_text,
+            "early_fields": early_fields,
+            "streaming": streaming,
+            "matched_point": matched_point,
+            # 放大定位：目标很小或置信度低时在原始分辨率裁剪图上确认坐标
+            # 动作缓存回放的坐标已经验证过，不再额外请求模型
+            "zoom": matched_point is None
+            and cached_response_text is None
+            and config.get("zoom_config", {}).get("enabled", False),
+        }
+
+    # 执行解析出的操作
+    def _execute_response(self, task, step, state, zoom_box=None):
+        """执行操作和多步计划、记录待验证的步骤（异步主循环中在执行器线程运行）"""
+        config = self.config
+        history_config = config.get("history_config", {})
+        plan_config = config.get("plan_config", {})
+        action_cache = self.action_cache
+        frame = step["frame"]
+        current_thumbnail = step["thumbnail"]
+        current_user_message = step["user_message"]
+        delta_regions = step["delta_regions"]
+        current_step = step["step"]
+        fingerprint = step["fingerprint"]
+        cached_response_text = step["cached_response_text"]
+        ai_response = state["ai_response"]
+        ai_response_text = state["ai_response_text"]
+        early_fields = state["early_fields"]
+        matched_point = state["matched_point"]
+        streaming = state["streaming"]
+
+        # 放大定位期间或进入执行器线程前任务已被取消时，不再执行操作
+        if self._stopped(task):
+            if streaming is not None:
+                streaming.close()
+            return None
+
+        action_type = ai_response.action.get("type", "wait")
+        task.last_action_type = action_type
+        with task.metrics.span("action"):
+            mapped_coordinates = self.execute_action(
+                task,
+                frame,
+                ai_response,
+                delta_regions,
+                zoom_box=zoom_box,
+                matched_point=matched_point,
+            )
+        self._trace(task, mapped=mapped_coordinates)
+        # 执行期间任务被取消（异步主循环可能已结束任务）时不再更新模板和缓存
+        if task.cancel_event.is_set():
+            if early_fields is not None:
+                streaming.close()
+            return None
+        if self.target_cache is not None:
+            task.pending_target = self._pending_target(
+                frame,
+                ai_response,
+                mapped_coordinates,
+                current_thumbnail,
+                matched_point is not None,
+            )
+
+        # 流式模式：操作执行完毕后取回完整文本，用于日志和历史记录
+        if early_fields is not None:
+            with task.metrics.span("model_stream_tail"):
+                ai_response_text = streaming.wait_text()
+            record_usage(task.metrics, streaming.usage)
+            ai_response_text = ai_response_text.encode(
+                "utf-8", errors="ignore"
+            ).decode("utf-8")
+            log_print(f"🤖 AI原始响应:\n{ai_response_text}")
+            self._trace(task, response=ai_response_text)
+            record_history(
+                task,
+                current_user_message,
+                frame,
+                ai_response_text,
+                history_config,
+            )
+
+        # 多步计划：在本地依次执行后续操作（上一轮计划中止后先回到单步）
+        if plan_config.get("enabled", False) and action_type != "wait":
+            if task.plan_single_step:
+                task.plan_single_step = False
+            else:
+                if early_fields is not None:
+                    # 后续操作在完整响应中
+                    ai_response = self._parse_response(task, ai_response_text)
+                self._run_plan(task, frame, ai_response, delta_regions)
+
+        # 记录待验证的步骤，下一次截图时检查操作是否生效
+        if action_cache is not None and action_type != "wait":
+            task.pending_check = {
+                "thumbnail": current_thumbnail,
+                "from_cache": cached_response_text is not None,
+                "entry": (current_step, fingerprint, ai_response_text),
+            }
+
+        return None
+
+
+# 默认会话（兼容按模块函数调用的方式）
+default_session = None
+
+
+# 获取默认会话
+def get_default_session():
+    global default_session
+    if default_session is None:
+        default_session = AgentSession()
+    return default_session
+
+
+# 主控制函数
+def auto_control_computer(user_content):
+    """自动控制电脑的主函数（使用默认会话）"""
+    return get_default_session().run_task(user_content)
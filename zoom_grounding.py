@@ -0,0 +1,137 @@
+"""
+放大定位（由粗到细）
+模型在缩小后的整屏截图上给出粗略坐标；当它对坐标把握不大或目标很小时，
+从内存中的原始分辨率截图裁剪目标附近区域，再请求一次精确坐标
+"""
+
+import json
+import re
+
+from structured_output import validate_zoom_response
+
+# 启用放大定位时追加到主系统提示的说明
+GROUNDING_PROMPT = """
+
+## 定位信息
+
+action 中请额外输出 confidence（0~1，对坐标准确性的把握）和 target_box（目标元素的外接框 [x1, y1, x2, y2]，与坐标使用相同的 0~1000 相对坐标；没有具体目标时为 null）。
+目标很小或把握不大时，系统会放大目标附近区域再次确认坐标。
+"""
+
+# 放大定位请求的系统提示
+ZOOM_SYSTEM_PROMPT = """你是 GUI 定位助手。图片是屏幕局部区域的原始分辨率截图。
+请找到用户描述的目标元素，输出其中心点在这张图中的坐标，使用 0~1000 的相对坐标（左上角为 [0, 0]，右下角为 [1000, 1000]）。
+严格输出 JSON：{"found": true, "coordinates": [x, y]}；图中找不到目标时输出 {"found": false, "coordinates": [0, 0]}。"""
+
+# 需要精确坐标的单点操作
+POINT_ACTIONS = {
+    "click",
+    "double_click",
+    "long_press",
+    "right_click",
+    "scroll_up",
+    "scroll_down",
+    "input",
+}
+
+
+# 判断是否需要放大定位
+def zoom_reason(action, frame, zoom_config):
+    """
+    返回触发放大定位的原因，不需要时返回None
+    只对整屏坐标的单点操作、且截图经过缩小时生效；按元素编号操作时不需要放大
+    """
+    if action.get("type") not in POINT_ACTIONS or action.get("region") is not None:
+        return None
+    if action.get("mark") is not None:
+        return None
+    coordinates = action.get("coordinates")
+    if not (
+        isinstance(coordinates, list)
+        and len(coordinates) >= 2
+        and all(isinstance(value, (int, float)) for value in coordinates[:2])
+    ):
+        return None
+    # 截图未缩小时放大没有额外的像素可用
+    if frame.scale >= 1:
+        return None
+
+    confidence = action.get("confidence")
+    if isinstance(confidence, (int, float)) and confidence < zoom_config.get(
+        "confidence_threshold", 0.6
+    ):
+        return f"置信度 {confidence:.2f}"
+
+    box = action.get("target_box")
+    if isinstance(box, list) and len(box) == 4:
+        width = abs(box[2] - box[0]) / 1000 * frame.width
+        height = abs(box[3] - box[1]) / 1000 * frame.height
+        if min(width, height) < zoom_config.get("small_target_px", 24):
+            return f"目标尺寸 {width:.0f}x{height:.0f}px"
+    return None
+
+
+# 计算放大区域
+def zoom_crop_box(action, frame, zoom_config):
+    """
+    以粗略坐标为中心计算裁剪区域，返回image坐标下的 (x, y, w, h)
+    区域边长为原始分辨率下的crop_edge像素，且至少覆盖目标外接框的两倍
+    """
+    center_x = action["coordinates"][0] / 1000 * frame.width
+    center_y = action["coordinates"][1] / 1000 * frame.height
+    side = zoom_config.get("crop_edge", 480) * frame.scale
+
+    width = height = side
+    box = action.get("target_box")
+    if isinstance(box, list) and len(box) == 4:
+        width = max(width, 2 * abs(box[2] - box[0]) / 1000 * frame.width)
+        height = max(height, 2 * abs(box[3] - box[1]) / 1000 * frame.height)
+    width = min(width, frame.width)
+    height = min(height, frame.height)
+
+    left = min(max(0, center_x - width / 2), frame.width - width)
+    top = min(max(0, center_y - height / 2), frame.height - height)
+    return left, top, width, height
+
+
+# 构建放大定位请求
+def build_zoom_messages(crop_base64, target, description=""):
+    text = f"目标元素：{target or description}"
+    if description and target:
+        text += f"\n当前界面：{description}"
+    return [
+        {"role": "system", "content": ZOOM_SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": text},
+                {
+                    "type": "image_url",
+                    "image_url": {"url": f"data:image/png;base64,{crop_base64}"},
+                },
+            ],
+        },
+    ]
+
+
+# 解析放大定位响应
+def parse_zoom_response(response_text):
+    """返回裁剪图中的坐标 [x, y]（0~1000），未找到或无法解析时返回None"""
+    result = validate_zoom_response(response_text)
+    if result is None:
+        match = re.search(r"\{.*\}", response_text, re.DOTALL)
+        if not match:
+            return None
+        try:
+            data = json.loads(match.group(0))
+            result = bool(data.get("found", True)), data.get("coordinates")
+        except (ValueError, AttributeError):
+            return None
+
+    found, coordinates = result
+    if not found or not isinstance(coordinates, list) or len(coordinates) < 2:
+        return None
+    x, y = coordinates[:2]
+    if not all(isinstance(v, (int, float)) and 0 <= v <= 1000 for v in (x, y)):
+        return None
+    return [x, y]